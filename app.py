@@ -1,8 +1,27 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from routes import upload, retrieve, answer
+from routes import upload, retrieve, answer, collections, snapshots, admin, metrics, health
 from fastapi.middleware.cors import CORSMiddleware
+from utils.clients import STARTUP_WARMUP, close_clients, start_warm_up, warm_up
+from utils.concurrency import run_blocking
+from utils.embedding_cache import embedding_cache
+from utils.tracing import TracingMiddleware
 
-app = FastAPI(title="Corolair Technical Test")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Step 1: Create the clients and import the heavy dependencies before the first requests need them
+    if STARTUP_WARMUP == "blocking":
+        await run_blocking(warm_up)
+    elif STARTUP_WARMUP == "background":
+        start_warm_up()
+    yield
+    # Step 2: Write the buffered query embeddings to disk and close the pooled connections before exiting
+    embedding_cache.flush()
+    await close_clients()
+
+
+app = FastAPI(title="Corolair Technical Test", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -11,11 +30,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let browsers read the stage timings of cross-origin responses
+    expose_headers=["Server-Timing"],
 )
+# Spans and Server-Timing header of each request, see utils/tracing.py
+app.add_middleware(TracingMiddleware)
 
 app.include_router(upload.router, prefix="/upload", tags=["Upload"])
 app.include_router(retrieve.router, prefix="/retrieve", tags=["Retrieve"])
 app.include_router(answer.router, prefix="/answer", tags=["Answer"])
+app.include_router(collections.router, prefix="/collections", tags=["Collections"])
+app.include_router(snapshots.router, prefix="/snapshots", tags=["Snapshots"])
+app.include_router(admin.router, prefix="/admin", tags=["Admin"])
+app.include_router(metrics.router, tags=["Metrics"])
+app.include_router(health.router, tags=["Health"])
 
 
 @app.get("/")
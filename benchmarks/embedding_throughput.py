@@ -0,0 +1,48 @@
+"""
+Offline throughput benchmark for `create_embeddings`.
+
+Runs against the local stub embedding backend, so no OpenAI key or network access is needed.
+Compares the batched, concurrent pipeline with the previous one-request-per-chunk loop.
+
+Usage:
+    python -m benchmarks.embedding_throughput --chunks 5000 --latency-ms 50
+"""
+
+import argparse
+import os
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=2000, help="number of 500-character chunks")
+    parser.add_argument("--latency-ms", type=float, default=50, help="simulated latency per API call")
+    parser.add_argument("--skip-sequential", action="store_true", help="only run the batched pipeline")
+    args = parser.parse_args()
+
+    # The backend is selected at import time, so configure it before importing the module
+    os.environ["EMBEDDING_BACKEND"] = "stub"
+    os.environ["STUB_OPENAI_LATENCY_MS"] = str(args.latency_ms)
+    from utils import embeddings_generator
+
+    chunks = [f"chunk {i} " + "lorem ipsum dolor sit amet " * 18 for i in range(args.chunks)]
+
+    start = time.perf_counter()
+    batched = embeddings_generator.create_embeddings(chunks)
+    batched_time = time.perf_counter() - start
+    assert [text for text, _ in batched] == chunks, "results are not in chunk order"
+    print(f"batched:    {batched_time:8.2f}s  {len(chunks) / batched_time:10.1f} chunks/s")
+
+    if not args.skip_sequential:
+        start = time.perf_counter()
+        for chunk in chunks:
+            embeddings_generator.get_embeddings_client().embeddings.create(
+                input=[chunk], model=embeddings_generator.EMBEDDING_MODEL
+            )
+        sequential_time = time.perf_counter() - start
+        print(f"sequential: {sequential_time:8.2f}s  {len(chunks) / sequential_time:10.1f} chunks/s")
+        print(f"speedup:    {sequential_time / batched_time:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
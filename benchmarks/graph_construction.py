@@ -0,0 +1,140 @@
+"""
+Benchmark of the similarity-graph edge construction.
+
+Compares `compute_similarity_edges` (tiled matrix product) with the previous per-pair loop
+(one sklearn `cosine_similarity` call per pair) on synthetic clustered embeddings, and checks that
+both produce the same edges at the 0.7 threshold, including for pairs within --epsilon of it.
+
+The per-pair loop is quadratic with a large constant, so above --legacy-max-chunks its time is
+extrapolated from a sample of pairs instead of measured.
+
+Usage:
+    python -m benchmarks.graph_construction --sizes 1000 5000 20000
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+
+# Importing utils builds the embedding client, use the offline backend
+os.environ.setdefault("EMBEDDING_BACKEND", "stub")
+from utils.Knowlege_graph import GRAPH_SIMILARITY_THRESHOLD, GRAPH_TOP_K, compute_similarity_edges
+
+DIMENSIONS = 1536
+
+
+def synthetic_embeddings(n, n_topics=None, seed=0):
+    """
+    Returns n unit vectors grouped around topics, with a spread of within-topic similarities
+    around the 0.7 threshold (unrelated random vectors would never be linked).
+    """
+    rng = np.random.default_rng(seed)
+    n_topics = n_topics or max(1, n // 20)
+    topics = rng.standard_normal((n_topics, DIMENSIONS))
+    topics /= np.linalg.norm(topics, axis=1, keepdims=True)
+    noise = rng.standard_normal((n, DIMENSIONS)) / np.sqrt(DIMENSIONS)
+    # Noise scales between 0.4 and 0.9 give pairwise similarities roughly between 0.55 and 0.85
+    scales = rng.uniform(0.4, 0.9, size=(n, 1))
+    vectors = topics[rng.integers(0, n_topics, size=n)] + scales * noise
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def threshold_pairs(n_pairs, epsilon, seed=0):
+    """
+    Returns 2 * n_pairs float32 vectors of random norms, where vectors 2k and 2k + 1 have a cosine similarity
+    within epsilon of the threshold (and unrelated vectors a similarity close to 0).
+    """
+    rng = np.random.default_rng(seed)
+    u = rng.standard_normal((n_pairs, DIMENSIONS))
+    u /= np.linalg.norm(u, axis=1, keepdims=True)
+    w = rng.standard_normal((n_pairs, DIMENSIONS))
+    w -= np.sum(w * u, axis=1, keepdims=True) * u
+    w /= np.linalg.norm(w, axis=1, keepdims=True)
+    similarity = GRAPH_SIMILARITY_THRESHOLD + rng.uniform(-epsilon, epsilon, size=(n_pairs, 1))
+    v = similarity * u + np.sqrt(1 - similarity**2) * w
+    vectors = np.empty((2 * n_pairs, DIMENSIONS))
+    vectors[0::2], vectors[1::2] = u, v
+    return (vectors * rng.uniform(0.5, 2, size=(2 * n_pairs, 1))).astype(np.float32)
+
+
+def legacy_edges(embeddings, pairs=None):
+    """
+    The previous implementation of the edge construction (Step 4 of build_graph_and_store).
+    """
+    chunks = [(None, embedding.tolist()) for embedding in embeddings]
+    if pairs is None:
+        pairs = ((i, j) for i in range(len(chunks)) for j in range(i + 1, len(chunks)))
+    edges = set()
+    for i, j in pairs:
+        embedding_i = np.array(chunks[i][1]).reshape(1, -1)
+        embedding_j = np.array(chunks[j][1]).reshape(1, -1)
+        similarity = cosine_similarity(embedding_i, embedding_j)[0][0]
+        if similarity > GRAPH_SIMILARITY_THRESHOLD:
+            edges.add((i, j))
+    return edges
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--legacy-max-chunks", type=int, default=1000)
+    parser.add_argument("--legacy-sample-pairs", type=int, default=20000)
+    parser.add_argument("--threshold-pairs", type=int, default=200)
+    parser.add_argument("--epsilon", type=float, default=1e-7)
+    args = parser.parse_args()
+
+    # Pairs at the threshold: the decision must not depend on rounding differences with sklearn
+    embeddings = threshold_pairs(args.threshold_pairs, args.epsilon)
+    pairs = [(2 * k, 2 * k + 1) for k in range(args.threshold_pairs)]
+    rows, cols, _ = compute_similarity_edges(embeddings)
+    edges = set(zip(rows.tolist(), cols.tolist()))
+    legacy = legacy_edges(embeddings, pairs)
+    agree = sum((pair in edges) == (pair in legacy) for pair in pairs)
+    print(f"pairs within ±{args.epsilon:g} of the threshold: {agree}/{len(pairs)} linked like the per-pair loop")
+    assert agree == len(pairs) and edges <= set(pairs), "graphs differ at the threshold"
+
+    print(f"{'chunks':>7} {'edges':>9} {'loop (s)':>12} {'tiled (s)':>10} {'speedup':>9} {'top-k (s)':>10} {'top-k recall':>13}")
+    for n in args.sizes:
+        embeddings = synthetic_embeddings(n)
+
+        start = time.perf_counter()
+        rows, cols, _ = compute_similarity_edges(embeddings)
+        tiled_time = time.perf_counter() - start
+        edges = set(zip(rows.tolist(), cols.tolist()))
+
+        if n <= args.legacy_max_chunks:
+            start = time.perf_counter()
+            legacy = legacy_edges(embeddings)
+            legacy_time = time.perf_counter() - start
+            assert legacy == edges, f"graphs differ: {len(legacy ^ edges)} edges"
+            legacy_label = f"{legacy_time:12.2f}"
+        else:
+            rng = np.random.default_rng(1)
+            i = rng.integers(0, n - 1, size=args.legacy_sample_pairs)
+            j = rng.integers(i + 1, n)
+            sample = list(zip(i.tolist(), j.tolist()))
+            start = time.perf_counter()
+            legacy_sample = legacy_edges(embeddings, sample)
+            per_pair = (time.perf_counter() - start) / len(sample)
+            assert legacy_sample == {pair for pair in sample if pair in edges}, "graphs differ on sampled pairs"
+            legacy_time = per_pair * n * (n - 1) / 2
+            legacy_label = f"~{legacy_time:11.0f}"
+
+        start = time.perf_counter()
+        rows_k, cols_k, _ = compute_similarity_edges(embeddings, top_k=GRAPH_TOP_K)
+        top_k_time = time.perf_counter() - start
+        # Recall against the exact graph restricted to each chunk's top-k neighbours is what the mode aims
+        # for; against the full graph it is a lower bound.
+        recall = len(set(zip(rows_k.tolist(), cols_k.tolist())) & edges) / max(1, len(edges))
+
+        print(
+            f"{n:>7} {len(edges):>9} {legacy_label} {tiled_time:10.2f} {legacy_time / tiled_time:8.0f}x"
+            f" {top_k_time:10.2f} {recall:13.2%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
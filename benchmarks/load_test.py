@@ -0,0 +1,161 @@
+"""
+Load test of the /retrieve and /answer endpoints against local stubs.
+
+OpenAI is replaced by the stub backends (with a simulated latency per call) and all data is written
+to a temporary directory, so the test runs offline and doesn't touch the real LanceDB stores.
+A synthetic document is ingested first, then each endpoint is driven at a fixed concurrency.
+
+With --distinct lower than --requests, the queries repeat: concurrent identical queries share their
+upstream calls (single-flight) and the later ones hit the caches. The calls coalesced and the ones
+delayed by the rate governor (OPENAI_*_RPM/TPM) are reported.
+
+With --documents N, N synthetic documents are ingested in a collection, which is also queried as a
+whole (multi-document /retrieve) to compare its latency with the single-document one.
+
+Usage:
+    python -m benchmarks.load_test --requests 500 --concurrency 32 --latency-ms 100
+    python -m benchmarks.load_test --requests 500 --documents 24 --chunks 500
+    OPENAI_CHAT_RPM=3000 python -m benchmarks.load_test --requests 500 --distinct 50
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import numpy as np
+
+
+def configure_offline_environment(data_dir, latency_ms):
+    """
+    Points every store to data_dir and selects the stub OpenAI backends. Must run before importing
+    the application, which reads this configuration at import time.
+    """
+    os.environ["EMBEDDING_BACKEND"] = "stub"
+    os.environ["CHAT_BACKEND"] = "stub"
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    os.environ["STUB_OPENAI_LATENCY_MS"] = str(latency_ms)
+    os.environ["LANCEDB_URI"] = os.path.join(data_dir, "lancedb")
+    os.environ["EMBEDDING_CACHE_URI"] = os.path.join(data_dir, "lancedb-cache")
+    os.environ["GRAPH_STORE_DIR"] = os.path.join(data_dir, "graphs")
+    os.environ["LEXICAL_INDEX_DIR"] = os.path.join(data_dir, "lexical")
+    os.environ["DOCUMENT_REGISTRY_PATH"] = os.path.join(data_dir, "documents.json")
+
+
+def ingest_synthetic_document(doc_id, n_chunks):
+    from utils.embeddings_generator import create_embeddings
+    from utils.Knowlege_graph import build_graph_and_store
+
+    texts = [
+        f"Section {i}: " + " ".join(f"term{(i * 7 + j) % 997}" for j in range(60))
+        for i in range(n_chunks)
+    ]
+    build_graph_and_store(doc_id, create_embeddings(texts))
+
+
+def percentiles(latencies):
+    values = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    return dict(zip(("p50", "p95", "p99"), values.round(1).tolist()))
+
+
+async def drive(client, path, payloads, concurrency):
+    """
+    Sends the payloads to an endpoint from `concurrency` concurrent workers.
+
+    Returns:
+    dict: throughput (requests/s), latency percentiles (ms) and number of errors.
+    """
+    latencies, errors = [], 0
+    pending = iter(payloads)
+
+    async def worker():
+        nonlocal errors
+        for payload in pending:
+            start = time.perf_counter()
+            response = await client.post(path, json=payload)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200 or not response.json().get("success"):
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {"throughput": round(len(latencies) / elapsed, 1), **percentiles(latencies), "errors": errors}
+
+
+async def run(args):
+    import httpx
+    from app import app
+    from utils.concurrency import chat_flight, embedding_flight
+    from utils.ingestion_jobs import add_to_collection
+    from utils.rate_limit import rate_limit_stats
+
+    doc_id = "load-test-document"
+    ingest_synthetic_document(doc_id, args.chunks)
+    doc_ids = [doc_id] + [f"load-test-document-{i}" for i in range(1, args.documents)]
+    for other in doc_ids[1:]:
+        ingest_synthetic_document(other, args.chunks)
+    if len(doc_ids) > 1:
+        add_to_collection("load-test-collection", doc_ids)
+
+    # Distinct queries by default, so that the embedding cache doesn't hide the upstream calls
+    distinct = args.distinct or args.requests
+    queries = [
+        f"What does the course say about term{i % distinct % 997} and term{(i % distinct * 3) % 997}?"
+        for i in range(args.requests)
+    ]
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=60) as client:
+        results = {
+            "/retrieve/": await drive(
+                client,
+                "/retrieve/",
+                [{"document_id": doc_id, "query": f"{q} (r)"} for q in queries],
+                args.concurrency,
+            ),
+            "/answer/": await drive(
+                client,
+                "/answer/",
+                [{"doc_id": doc_id, "query": f"{q} (a)"} for q in queries],
+                args.concurrency,
+            ),
+        }
+        if len(doc_ids) > 1:
+            results["/retrieve/ *"] = await drive(
+                client,
+                "/retrieve/",
+                [{"collection_id": "load-test-collection", "query": f"{q} (c)"} for q in queries],
+                args.concurrency,
+            )
+
+    print(f"{'endpoint':<12} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for path, r in results.items():
+        print(f"{path:<12} {r['throughput']:>8} {r['p50']:>8} {r['p95']:>8} {r['p99']:>8} {r['errors']:>7}")
+    if len(doc_ids) > 1:
+        print(f"(* across the collection of {len(doc_ids)} documents)")
+
+    rates = rate_limit_stats()
+    print(f"\n{'upstream':<18} {'coalesced':>10} {'delayed':>8} {'waited s':>9}")
+    for name, flight in (("openai_embeddings", embedding_flight), ("openai_chat", chat_flight)):
+        print(f"{name:<18} {flight.stats()['coalesced']:>10} {rates[name]['delayed']:>8} {rates[name]['wait_s']:>9}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency-ms", type=float, default=100, help="simulated latency per OpenAI call")
+    parser.add_argument("--chunks", type=int, default=1000, help="chunks of the synthetic document")
+    parser.add_argument("--distinct", type=int, default=0, help="distinct queries (default: all of them)")
+    parser.add_argument("--documents", type=int, default=1, help="synthetic documents, queried as a collection")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="load-test-") as data_dir:
+        configure_offline_environment(data_dir, args.latency_ms)
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+"""
+End-to-end offline benchmark of /upload, /retrieve and /answer, with saved and comparable results.
+
+Synthetic PDFs of configurable size are generated with PyMuPDF and served by a local HTTP server, OpenAI
+is replaced by the stub backends (deterministic vectors, configurable latency), and every store is
+written to a temporary directory. The phases run in order at a fixed concurrency:
+
+- upload: POST /upload for each PDF, then GET /upload/{job_id} until the job is finished. The latency
+  is the time to a queryable document, and the ingestion stages are timed from the job status.
+- retrieve: POST /retrieve with distinct queries on the uploaded documents.
+- answer: POST /answer with distinct queries.
+
+For each phase: throughput, p50/p95/p99 latency, errors, and the peak RSS of the process sampled
+during the phase. Results can be saved as JSON and compared with a previous run.
+
+Usage:
+    python -m benchmarks.offline_suite --documents 8 --pages 40 --save benchmarks/results/baseline.json
+    python -m benchmarks.offline_suite --documents 8 --pages 40 --compare benchmarks/results/baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from benchmarks.load_test import configure_offline_environment, drive, percentiles
+
+PHASES = ["upload", "retrieve", "answer"]
+# Metrics compared between runs, and whether higher is better
+COMPARED_METRICS = {"throughput": True, "p50": False, "p95": False, "p99": False, "peak_rss_mb": False}
+
+_VOCABULARY = [
+    "algorithm", "analysis", "assessment", "budget", "calculus", "chemistry", "climate", "compliance",
+    "curriculum", "database", "derivative", "ecosystem", "economics", "energy", "engineering", "ethics",
+    "evaluation", "finance", "genetics", "geometry", "governance", "history", "inference", "inventory",
+    "leadership", "learning", "literature", "logistics", "marketing", "matrix", "mechanics", "network",
+    "nutrition", "optimization", "philosophy", "physics", "probability", "protocol", "psychology",
+    "regression", "safety", "sampling", "security", "semester", "statistics", "strategy", "syllabus",
+    "taxonomy", "theorem", "thermodynamics", "training", "variance", "workflow", "workshop",
+]
+
+
+# --- Synthetic PDFs and the local server hosting them -----------------------------------------------
+
+
+def synthetic_text(seed: int, n_words: int) -> str:
+    """
+    Deterministic pseudo-course text: vocabulary words with course codes and numbers, in paragraphs.
+    """
+    rng = random.Random(seed)
+    words = []
+    for i in range(n_words):
+        if i % 40 == 39:
+            words.append(f"CS{rng.randint(100, 999)}.\n\n")
+        elif i % 12 == 11:
+            words.append(str(rng.randint(1, 2030)))
+        else:
+            words.append(rng.choice(_VOCABULARY))
+    return " ".join(words)
+
+
+def synthetic_pdf(seed: int, pages: int, words_per_page: int) -> bytes:
+    """
+    Generates a PDF of `pages` pages of synthetic text.
+    """
+    import fitz
+
+    document = fitz.open()
+    for page_number in range(pages):
+        page = document.new_page()
+        text = synthetic_text(seed * 100003 + page_number, words_per_page)
+        page.insert_textbox(page.rect + (50, 50, -50, -50), text, fontsize=8)
+    data = document.tobytes(garbage=3, deflate=True)
+    document.close()
+    return data
+
+
+class PDFServer:
+    """
+    Local HTTP server serving in-memory PDFs at /<name>.pdf, in a background thread.
+    """
+
+    def __init__(self, files: dict):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                data = files.get(self.path.lstrip("/"))
+                if data is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/pdf")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, name="pdf-server", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# --- Memory sampling ----------------------------------------------------------------------------
+
+
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024**2
+    except OSError:
+        # Not Linux: fall back to the peak since the process started (kilobytes on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024**2 if platform.system() == "Darwin" else peak / 1024
+
+
+class RSSSampler:
+    """
+    Samples the RSS of the process in a background thread while a phase runs, and keeps its peak.
+    """
+
+    def __init__(self, interval_s: float = 0.01):
+        self.interval_s = interval_s
+        self.start_mb = self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+            self._stop.wait(self.interval_s)
+
+    def __enter__(self):
+        self.start_mb = self.peak_mb = current_rss_mb()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def to_dict(self) -> dict:
+        return {"peak_rss_mb": round(self.peak_mb, 1), "rss_growth_mb": round(self.peak_mb - self.start_mb, 1)}
+
+
+# --- Phases -------------------------------------------------------------------------------------
+
+
+async def drive_uploads(client, urls, concurrency, poll_interval_s=0.05, timeout_s=600):
+    """
+    Uploads the PDFs from `concurrency` concurrent workers, each waiting for its job to finish.
+
+    Returns:
+    tuple: The phase results (as `drive`) and the finished jobs' status.
+    """
+    latencies, jobs, errors = [], [], 0
+    pending = iter(urls)
+
+    async def worker():
+        nonlocal errors
+        for url in pending:
+            start = time.perf_counter()
+            response = (await client.post("/upload/", json={"url": url})).json()
+            if not response.get("success"):
+                errors += 1
+                continue
+            job_id = response["data"]["job_id"]
+            while time.perf_counter() - start < timeout_s:
+                job = (await client.get(f"/upload/{job_id}")).json()["data"]
+                if job["status"] in ("succeeded", "failed"):
+                    break
+                await asyncio.sleep(poll_interval_s)
+            latencies.append(time.perf_counter() - start)
+            jobs.append(job)
+            if job["status"] != "succeeded":
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    results = {"throughput": round(len(latencies) / elapsed, 2), **percentiles(latencies), "errors": errors}
+    return results, jobs
+
+
+def ingestion_stage_timings(jobs) -> dict:
+    """
+    Returns the p50/p95 duration of each ingestion stage, from the jobs' status.
+    """
+    durations = {}
+    for job in jobs:
+        for name, info in job["stages"].items():
+            if "duration_ms" in info:
+                durations.setdefault(name, []).append(info["duration_ms"])
+    return {
+        name: dict(zip(("p50_ms", "p95_ms"), np.percentile(values, [50, 95]).round(1).tolist()))
+        for name, values in durations.items()
+    }
+
+
+async def run(args) -> dict:
+    import httpx
+    from app import app
+    from utils.answer_generator import COMPLETION_PARAMETERS
+    from utils.tracing import OPENAI_TOKENS
+
+    # Step 1: Generate the PDFs and serve them locally
+    files = {f"doc-{i}.pdf": synthetic_pdf(args.seed + i, args.pages, args.words_per_page) for i in range(args.documents)}
+    queries = [
+        f"What does the course say about {_VOCABULARY[i % len(_VOCABULARY)]} and CS{100 + (i * 37) % 900}?"
+        for i in range(args.requests)
+    ]
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    with PDFServer(files) as server:
+        async with httpx.AsyncClient(transport=transport, base_url="http://offline-suite", timeout=600) as client:
+            # Step 2: Upload the documents and wait until they are queryable
+            with RSSSampler() as memory:
+                upload, jobs = await drive_uploads(
+                    client, [f"{server.base_url}/{name}" for name in files], args.upload_concurrency
+                )
+            chunks = sum(job["stages"]["parse"].get("chunks", 0) for job in jobs)
+            results["upload"] = {
+                **upload,
+                **memory.to_dict(),
+                "documents": len(files),
+                "pdf_mb": round(sum(map(len, files.values())) / 1024**2, 2),
+                "chunks": chunks,
+                "stages": ingestion_stage_timings(jobs),
+            }
+            doc_ids = [job["document_id"] for job in jobs if job["status"] == "succeeded"]
+            if not doc_ids:
+                raise RuntimeError("No document was ingested, see the job errors above.")
+
+            # Step 3: Retrieval and answers, spread over the documents, with distinct queries so that
+            # the caches don't hide the upstream calls
+            with RSSSampler() as memory:
+                retrieve = await drive(
+                    client,
+                    "/retrieve/",
+                    [
+                        {"document_id": doc_ids[i % len(doc_ids)], "query": f"{q} (r)", "mode": args.mode}
+                        for i, q in enumerate(queries)
+                    ],
+                    args.concurrency,
+                )
+            results["retrieve"] = {**retrieve, **memory.to_dict()}
+
+            # Prompt tokens of the answers, as reported by the (stub) chat API
+            prompt_tokens = OPENAI_TOKENS.value(COMPLETION_PARAMETERS["model"], "prompt")
+            with RSSSampler() as memory:
+                answer = await drive(
+                    client,
+                    "/answer/",
+                    [
+                        {"doc_id": doc_ids[i % len(doc_ids)], "query": f"{q} (a)", "mode": args.mode}
+                        for i, q in enumerate(queries)
+                    ],
+                    args.concurrency,
+                )
+            prompt_tokens = OPENAI_TOKENS.value(COMPLETION_PARAMETERS["model"], "prompt") - prompt_tokens
+            results["answer"] = {
+                **answer,
+                **memory.to_dict(),
+                "prompt_tokens_per_answer": round(prompt_tokens / max(1, len(queries) - answer["errors"]), 1),
+            }
+    return results
+
+
+# --- Saved results ------------------------------------------------------------------------------
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(path: str, report: dict):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {path}")
+
+
+def print_results(phases: dict):
+    print(f"{'phase':<10} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7} {'peak RSS MB':>12}")
+    for phase in PHASES:
+        r = phases[phase]
+        print(
+            f"{phase:<10} {r['throughput']:>8} {r['p50']:>9} {r['p95']:>9} {r['p99']:>9} {r['errors']:>7} {r['peak_rss_mb']:>12}"
+        )
+    print(f"\nprompt tokens per answer: {phases['answer'].get('prompt_tokens_per_answer')}")
+    print("\ningestion stage   p50 ms    p95 ms")
+    for name, timing in phases["upload"]["stages"].items():
+        print(f"{name:<15} {timing['p50_ms']:>8} {timing['p95_ms']:>9}")
+
+
+def compare_results(baseline: dict, current: dict, tolerance: float) -> list:
+    """
+    Prints the change of each compared metric against a baseline run.
+
+    Returns:
+    list: The (phase, metric) pairs that got worse by more than `tolerance` (a fraction).
+    """
+    if baseline["meta"]["parameters"] != current["meta"]["parameters"]:
+        print("Warning: the baseline was run with different parameters, the comparison may not be meaningful.")
+    print(f"\nCompared with {baseline['meta']['timestamp']} (commit {baseline['meta'].get('git_commit')}):")
+    print(f"{'phase':<10} {'metric':<12} {'baseline':>10} {'current':>10} {'change':>9}")
+    regressions = []
+    for phase in PHASES:
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            before, after = baseline["phases"][phase][metric], current["phases"][phase][metric]
+            change = (after - before) / before if before else 0.0
+            worse = change < -tolerance if higher_is_better else change > tolerance
+            if worse:
+                regressions.append((phase, metric))
+            flag = "  worse" if worse else ""
+            print(f"{phase:<10} {metric:<12} {before:>10} {after:>10} {change:>+8.1%}{flag}")
+    # Not in the results saved before it was measured
+    before = baseline["phases"]["answer"].get("prompt_tokens_per_answer")
+    after = current["phases"]["answer"].get("prompt_tokens_per_answer")
+    if before and after:
+        print(f"{'answer':<10} {'prompt tok':<12} {before:>10} {after:>10} {(after - before) / before:>+8.1%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--documents", type=int, default=8, help="number of synthetic PDFs to upload")
+    parser.add_argument("--pages", type=int, default=40, help="pages per PDF")
+    parser.add_argument("--words-per-page", type=int, default=400)
+    parser.add_argument("--requests", type=int, default=300, help="requests to /retrieve and to /answer")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent /retrieve and /answer requests")
+    parser.add_argument("--upload-concurrency", type=int, default=4, help="concurrent uploads")
+    parser.add_argument("--mode", default="vector", choices=["vector", "graph", "lexical", "hybrid"])
+    parser.add_argument("--latency-ms", type=float, default=50, help="simulated latency per OpenAI call")
+    parser.add_argument("--token-latency-ms", type=float, default=0, help="simulated latency per streamed chunk")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with the results saved in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative change reported as worse")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="offline-suite-") as data_dir:
+        configure_offline_environment(data_dir, args.latency_ms)
+        os.environ["STUB_OPENAI_TOKEN_LATENCY_MS"] = str(args.token_latency_ms)
+        phases = asyncio.run(run(args))
+
+    parameters = {k: v for k, v in vars(args).items() if k not in ("save", "compare", "tolerance")}
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "parameters": parameters,
+        },
+        "phases": phases,
+    }
+    print_results(phases)
+    if args.save:
+        save_results(args.save, report)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_results(baseline, report, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) worse than the baseline by more than {args.tolerance:.0%}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Throughput of restoring documents from snapshots (see utils/snapshots.py), against reading the same files
+from disk and against ingesting the documents again.
+
+The documents are ingested from stub embeddings and exported in one process, then restored into empty
+stores in another one, so the restore doesn't reuse anything cached in memory. The files are read once
+before the measurements, so that reading them and importing them both start from the page cache.
+
+Usage:
+    python -m benchmarks.snapshot_restore --documents 200 --chunks 300
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def _configure(data_dir):
+    from benchmarks.load_test import configure_offline_environment
+
+    configure_offline_environment(data_dir, 0)
+    # Keep the index maintenance out of the measurement
+    os.environ["VECTOR_INDEX_MIN_ROWS"] = str(10**9)
+
+
+def _read_files(directory) -> int:
+    size = 0
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), "rb") as f:
+            while True:
+                block = f.read(16 * 1024**2)
+                if not block:
+                    break
+                size += len(block)
+    return size
+
+
+def export_phase(data_dir, snapshot_dir, n_documents, n_chunks):
+    """
+    Ingests synthetic documents and exports them, returns the ingestion and export timings.
+    """
+    _configure(data_dir)
+    from benchmarks.load_test import ingest_synthetic_document
+    from utils.snapshots import export_documents
+    from utils.vector_index import wait_for_index_maintenance
+
+    start = time.perf_counter()
+    for idx in range(n_documents):
+        ingest_synthetic_document(f"snapshot-{idx}", n_chunks)
+    ingested = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = export_documents(snapshot_dir)
+    exported = time.perf_counter() - start
+    wait_for_index_maintenance()
+    return {"ingest_s": ingested, "export_s": exported, "bytes": sum(r["bytes"] for r in results)}
+
+
+def import_phase(data_dir, snapshot_dir):
+    """
+    Restores the exported documents into empty stores, returns the read and import timings.
+    """
+    _configure(data_dir)
+    from utils.snapshots import import_snapshots
+    from utils.vector_index import wait_for_index_maintenance
+
+    _read_files(snapshot_dir)
+    start = time.perf_counter()
+    size = _read_files(snapshot_dir)
+    read = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = import_snapshots([snapshot_dir])
+    imported = time.perf_counter() - start
+    wait_for_index_maintenance()
+    return {"read_s": read, "import_s": imported, "bytes": size, "chunks": result["chunks"]}
+
+
+def _run(*args):
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.snapshot_restore", *map(str, args)],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--chunks", type=int, default=300, help="chunks per document")
+    parser.add_argument("--run", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        phase, *paths = args.run
+        if phase == "export":
+            result = export_phase(*paths, args.documents, args.chunks)
+        else:
+            result = import_phase(*paths)
+        print(json.dumps(result))
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="snapshot-restore-")
+    snapshot_dir = os.path.join(work_dir, "snapshots")
+    source = _run(
+        "--run", "export", os.path.join(work_dir, "source"), snapshot_dir,
+        "--documents", args.documents, "--chunks", args.chunks,
+    )
+    restored = _run("--run", "import", os.path.join(work_dir, "restored"), snapshot_dir)
+
+    mb = restored["bytes"] / 1024**2
+    print(f"{args.documents} documents of {args.chunks} chunks, {mb:.1f} MB of snapshots in {work_dir}")
+    print(f"{'':<22} {'seconds':>8} {'MB/s':>8} {'documents/s':>12}")
+    for name, seconds in (
+        ("ingest (stub OpenAI)", source["ingest_s"]),
+        ("export", source["export_s"]),
+        ("read the files", restored["read_s"]),
+        ("import", restored["import_s"]),
+    ):
+        print(f"{name:<22} {seconds:>8.2f} {mb / seconds:>8.1f} {args.documents / seconds:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
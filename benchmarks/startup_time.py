@@ -0,0 +1,137 @@
+"""
+Startup time of the application: import time, and time to the first requests of a fresh server.
+
+Each measure runs in a new Python process, so nothing is already imported or cached in memory:
+
+- import: `import app`, with the slowest top-level imports (from `python -X importtime`).
+- server: for each STARTUP_WARMUP mode, a uvicorn server is started and timed from the process start
+  to its first response (GET /), to the first POST /retrieve and POST /answer on a document ingested
+  beforehand, and to GET /ready (warm-up done). With "blocking", the server only answers once warm.
+
+OpenAI is replaced by the stub backends and every store is written to a temporary directory.
+
+Usage:
+    python -m benchmarks.startup_time --runs 5 --modes off background blocking
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from benchmarks.load_test import configure_offline_environment, ingest_synthetic_document
+
+_IMPORT_SCRIPT = "import time; start = time.perf_counter(); import app; print(time.perf_counter() - start)"
+
+
+def measure_import() -> float:
+    output = subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", _IMPORT_SCRIPT], capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def slowest_imports(top: int = 8) -> list:
+    """
+    Returns the (package, cumulative ms) of the slowest top-level packages imported by `import app`, apart
+    from the app's own modules.
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-W", "ignore", "-X", "importtime", "-c", "import app"], capture_output=True, text=True
+    ).stderr
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        if "." not in name and not name.startswith(("app", "routes", "utils")):
+            modules.append((name, int(cumulative) / 1000))
+    return sorted(modules, key=lambda module: -module[1])[:top]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_server(mode: str, doc_id: str, timeout_s: float = 120) -> dict:
+    """
+    Starts a server with STARTUP_WARMUP=mode and returns the seconds from its start to each milestone.
+    """
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = {**os.environ, "STARTUP_WARMUP": mode}
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-W", "ignore", "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        # Step 1: First response
+        while True:
+            if time.perf_counter() - start > timeout_s:
+                raise TimeoutError(f"The server didn't start within {timeout_s}s")
+            try:
+                requests.get(base_url + "/", timeout=1).raise_for_status()
+                break
+            except requests.RequestException:
+                time.sleep(0.01)
+        milestones = {"first_response": time.perf_counter() - start}
+
+        # Step 2: First requests that need the clients
+        response = requests.post(base_url + "/retrieve/", json={"document_id": doc_id, "query": "term42 term7"})
+        milestones["first_retrieve"] = time.perf_counter() - start
+        assert response.json()["success"], response.text
+        response = requests.post(base_url + "/answer/", json={"doc_id": doc_id, "query": "What is term42?"})
+        milestones["first_answer"] = time.perf_counter() - start
+        assert response.json()["success"], response.text
+
+        # Step 3: Ready (waits for the warm-up if it is still running)
+        requests.get(base_url + "/ready", timeout=timeout_s).raise_for_status()
+        milestones["ready"] = time.perf_counter() - start
+        return milestones
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per measure (medians are reported)")
+    parser.add_argument("--modes", nargs="+", default=["off", "background", "blocking"], help="STARTUP_WARMUP modes")
+    parser.add_argument("--chunks", type=int, default=200, help="chunks of the document ingested beforehand")
+    parser.add_argument("--latency-ms", type=float, default=0, help="simulated latency per OpenAI call")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="startup-time-") as data_dir:
+        configure_offline_environment(data_dir, args.latency_ms)
+        ingest_synthetic_document("startup-doc", args.chunks)
+
+        imports = [measure_import() for _ in range(args.runs)]
+        print(f"import app: {statistics.median(imports):.2f}s (median of {args.runs}, min {min(imports):.2f}s)")
+        print(f"\n{'slowest imports':<22} {'ms':>7}")
+        for name, ms in slowest_imports():
+            print(f"{name:<22} {ms:>7.0f}")
+
+        print(f"\n{'STARTUP_WARMUP':<15} {'1st response':>13} {'1st retrieve':>13} {'1st answer':>11} {'ready':>7}  (s)")
+        for mode in args.modes:
+            runs = [measure_server(mode, "startup-doc") for _ in range(args.runs)]
+            medians = {name: statistics.median(run[name] for run in runs) for name in runs[0]}
+            print(
+                f"{mode:<15} {medians['first_response']:>13.2f} {medians['first_retrieve']:>13.2f} "
+                f"{medians['first_answer']:>11.2f} {medians['ready']:>7.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
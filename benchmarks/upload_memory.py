@@ -0,0 +1,153 @@
+"""
+Peak memory (RSS) of ingesting a document, with the previous list-of-floats pipeline and the current one.
+
+Each mode runs in its own process, so the peak RSS reported by the OS only covers that mode. Embeddings
+come from the stub backend and every store is written to a temporary directory.
+
+- legacy: embeddings as Python lists of floats in (text, list) tuples, one pydantic row per chunk,
+  float64 similarity matrix (the pipeline before the float32 matrix).
+- float32 / float16 / int8: the current pipeline (`create_embeddings` + `build_graph_and_store`) with
+  EMBEDDING_STORAGE_DTYPE set accordingly.
+
+Usage:
+    python -m benchmarks.upload_memory --chunks 10000
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+MODES = ["legacy", "float32", "float16", "int8"]
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _directory_size_mb(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total / 1024**2
+
+
+def _texts(n_chunks):
+    return [f"Section {i}: " + " ".join(f"term{(i * 7 + j) % 997}" for j in range(60)) for i in range(n_chunks)]
+
+
+def _legacy_upload(doc_id, texts):
+    import networkx as nx
+    import numpy as np
+    from utils import Knowlege_graph as kg
+    from utils.clients import get_db, get_embeddings_client
+    from utils.embeddings_generator import EMBEDDING_MODEL
+
+    # Embeddings as lists of floats, like the previous `create_embeddings` returned them
+    chunks = []
+    for start in range(0, len(texts), 2048):
+        batch = texts[start : start + 2048]
+        response = get_embeddings_client().embeddings.create(input=batch, model=EMBEDDING_MODEL)
+        chunks.extend(zip(batch, [item.embedding for item in response.data]))
+
+    # One pydantic row per chunk
+    class LegacySchema(kg.LanceModel):
+        id: str
+        vector: kg.Vector(1536)
+        payload: kg.Document
+        doc_id: str
+
+    rows = [
+        LegacySchema(
+            id=f"{doc_id}_node_{idx}",
+            vector=np.array(embedding),
+            payload=kg.Document(
+                content=text,
+                meta=kg.Metadata(doc_id=doc_id, source="source_example", timestamp=datetime.now()),
+            ),
+            doc_id=doc_id,
+        )
+        for idx, (text, embedding) in enumerate(chunks)
+    ]
+    get_db().create_table(kg.NODES_TABLE, data=rows)
+    del rows
+
+    # Graph with list attributes and a float64 copy of the embeddings
+    graph = nx.Graph()
+    for idx, (text, embedding) in enumerate(chunks):
+        graph.add_node(idx, doc_id=doc_id, text=text, embedding=embedding)
+    matrix = np.asarray([embedding for _, embedding in chunks], dtype=np.float64)
+    rows, cols, weights = kg.compute_similarity_edges(matrix)
+    graph.add_weighted_edges_from(zip(rows.tolist(), cols.tolist(), weights.tolist()))
+    return graph
+
+
+def run_mode(mode, n_chunks):
+    """
+    Ingests a synthetic document in this process and returns its timings and peak RSS.
+    """
+    data_dir = tempfile.mkdtemp(prefix="upload-memory-")
+    os.environ["EMBEDDING_BACKEND"] = "stub"
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    os.environ["LANCEDB_URI"] = os.path.join(data_dir, "lancedb")
+    os.environ["EMBEDDING_CACHE_URI"] = os.path.join(data_dir, "lancedb-cache")
+    os.environ["GRAPH_STORE_DIR"] = os.path.join(data_dir, "graphs")
+    # Keep the index maintenance out of the measurement
+    os.environ["VECTOR_INDEX_MIN_ROWS"] = str(10**9)
+    if mode != "legacy":
+        os.environ["EMBEDDING_STORAGE_DTYPE"] = mode
+
+    from utils.embeddings_generator import create_embeddings
+    from utils.Knowlege_graph import build_graph_and_store
+
+    texts = _texts(n_chunks)
+    baseline = _peak_rss_mb()
+    start = time.perf_counter()
+    if mode == "legacy":
+        _legacy_upload("memory-benchmark", texts)
+    else:
+        build_graph_and_store("memory-benchmark", create_embeddings(texts))
+    elapsed = time.perf_counter() - start
+    return {
+        "mode": mode,
+        "seconds": round(elapsed, 2),
+        "baseline_rss_mb": round(baseline, 1),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "upload_rss_mb": round(_peak_rss_mb() - baseline, 1),
+        "nodes_table_mb": round(_directory_size_mb(os.environ["LANCEDB_URI"]), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=10000)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--run", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_mode(args.run, args.chunks)))
+        return
+
+    print(f"{'mode':<9} {'seconds':>8} {'peak RSS MB':>12} {'upload MB':>10} {'table MB':>9}")
+    for mode in args.modes:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.upload_memory", "--run", mode, "--chunks", str(args.chunks)],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        r = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{r['mode']:<9} {r['seconds']:>8} {r['peak_rss_mb']:>12} {r['upload_rss_mb']:>10} {r['nodes_table_mb']:>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
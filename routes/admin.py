@@ -0,0 +1,123 @@
+from fastapi import APIRouter, Query
+from utils.embedding_cache import embedding_cache
+from utils.answer_cache import answer_cache
+from utils.fallback import fallback_status
+from utils.vector_cache import document_vectors
+from utils.tracing import recent_traces
+from utils.clients import HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE_CONNECTIONS, get_db
+from utils.concurrency import UPSTREAM_CONCURRENCY, chat_flight, embedding_flight
+from utils.rate_limit import rate_limit_stats
+from utils.Knowlege_graph import NODES_TABLE, open_nodes_table
+from utils.vector_index import index_status, estimate_recall, maintain_indexes
+
+router = APIRouter()
+
+
+@router.get(
+    "/embedding-cache",
+    summary="Embedding cache statistics",
+    description="Returns the hit/miss counters of the embedding cache shared by the upload and query paths.",
+)
+def embedding_cache_stats():
+    return {"success": True, "data": embedding_cache.stats()}
+
+
+@router.get(
+    "/answer-cache",
+    summary="Answer cache statistics",
+    description="Returns the exact and semantic hit counters, evictions and size of the answer cache.",
+)
+def answer_cache_stats():
+    return {"success": True, "data": answer_cache.stats()}
+
+
+@router.get(
+    "/upstreams",
+    summary="Upstream limits",
+    description="Returns, per upstream service, the concurrency limit, the rate governor (requests and tokens per minute, "
+    "calls delayed and time waited, pauses after rate limits) and the identical in-flight requests that were coalesced, "
+    "with the size of the shared HTTP connection pool.",
+)
+def upstream_stats():
+    rates = rate_limit_stats()
+    flights = {"openai_embeddings": embedding_flight.stats(), "openai_chat": chat_flight.stats()}
+    upstreams = {
+        name: {"concurrency": limit, "rate_limit": rates.get(name), "single_flight": flights.get(name)}
+        for name, limit in UPSTREAM_CONCURRENCY.items()
+    }
+    http_pool = {"max_connections": HTTP_MAX_CONNECTIONS, "max_keepalive_connections": HTTP_MAX_KEEPALIVE_CONNECTIONS}
+    return {"success": True, "data": {"upstreams": upstreams, "http_pool": http_pool}}
+
+
+@router.get(
+    "/fallback",
+    summary="Fallback strategies",
+    description="Returns the fallback strategies tried in order when an answer is not relevant, with their timeout, "
+    "and the statistics of the cache of fallback answers.",
+)
+def fallback_stats():
+    return {"success": True, "data": fallback_status()}
+
+
+@router.get(
+    "/vector-cache",
+    summary="Hot vector cache statistics",
+    description="Returns the hit/miss counters, evictions and memory use of the in-memory cache of document vectors "
+    "used to score the chunks of recently ingested or searched documents.",
+)
+def vector_cache_stats():
+    return {"success": True, "data": document_vectors.stats()}
+
+
+@router.get(
+    "/traces",
+    summary="Recent request traces",
+    description="Returns the spans of the most recent requests, newest first: the name, parent, start offset and "
+    "duration of each traced stage. Empty when tracing is disabled (TRACING_ENABLED=false).",
+)
+def request_traces(limit: int = Query(20, ge=1, le=1000)):
+    return {"success": True, "data": {"traces": recent_traces(limit)}}
+
+
+def _nodes_table():
+    if NODES_TABLE not in get_db().table_names():
+        return None
+    return open_nodes_table()
+
+
+@router.get(
+    "/index",
+    summary="Vector index status",
+    description="Returns the indexes of the chunks table (indexed and unindexed rows), the state of the "
+    "background index maintenance and the latency percentiles of the recent vector searches.",
+)
+def vector_index_status():
+    table = _nodes_table()
+    if table is None:
+        return {"success": False, "error": {"message": "No document has been ingested yet."}}
+    return {"success": True, "data": index_status(table)}
+
+
+@router.post(
+    "/index/recall",
+    summary="Estimate the recall of the vector index",
+    description="Compares the indexed search with an exact search for queries sampled from the stored chunks, "
+    "and returns the average recall@k.",
+)
+def vector_index_recall(samples: int = Query(20, ge=1, le=1000), k: int = Query(10, ge=1, le=100)):
+    table = _nodes_table()
+    if table is None:
+        return {"success": False, "error": {"message": "No document has been ingested yet."}}
+    return {"success": True, "data": estimate_recall(table, samples=samples, k=k)}
+
+
+@router.post(
+    "/index/maintain",
+    summary="Update the vector indexes",
+    description="Creates, extends or retrains the indexes of the chunks table now, instead of after the next upload.",
+)
+def vector_index_maintain():
+    table = _nodes_table()
+    if table is None:
+        return {"success": False, "error": {"message": "No document has been ingested yet."}}
+    return {"success": True, "data": {"actions": maintain_indexes(table)}}
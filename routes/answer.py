@@ -1,6 +1,14 @@
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from utils.answer_generator import generate_answer, agent
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, model_validator
+from typing import Annotated, List, Optional
+from utils.answer_generator import generate_answer_async, stream_answer
+from utils.answer_cache import answer_cache, scope_key
+from utils.document_registry import DOC_ID_PATTERN, resolve_documents
+from utils.embeddings_generator import get_query_embedding_async
+from utils.fallback import fallback_answer
+from utils.Knowlege_graph import RetrievalMode
+from utils.tracing import span
 from uuid import uuid4
 import json
 
@@ -9,43 +17,146 @@ router = APIRouter()
 
 # Request model to accept doc_id and query
 class AnswerRequest(BaseModel):
-    doc_id: str
+    # The documents answering: one document, a list of documents, or the documents of a collection
+    doc_id: Optional[str] = Field(default=None, pattern=DOC_ID_PATTERN)
+    doc_ids: Optional[List[Annotated[str, Field(pattern=DOC_ID_PATTERN)]]] = Field(default=None, min_length=1)
+    collection_id: Optional[str] = None
     query: str
+    # Retrieval mode of the context, see POST /retrieve
+    mode: RetrievalMode = "vector"
+    # Across several documents, also use the chunks linked to the hits by cross-document edges
+    cross_document: bool = False
+
+    @model_validator(mode="after")
+    def check_target(self):
+        targets = [self.doc_id, self.doc_ids, self.collection_id]
+        if sum(target is not None for target in targets) != 1:
+            raise ValueError("Exactly one of doc_id, doc_ids and collection_id is required")
+        return self
+
+    def documents(self):
+        # The doc_id, or the list of documents searched together
+        return resolve_documents(self.doc_id, self.doc_ids, self.collection_id)
 
 
 # Response model to return the generated answer
 class AnswerResponse(BaseModel):
     success: bool
-    data: dict
+    data: Optional[dict] = None
+    error: Optional[dict] = None
+
+
+async def _cached_answer(doc_id: str, query: str, mode: str):
+    """
+    Looks up the answer cache, first by normalized query then by query embedding. The lexical mode
+    doesn't embed the query, so it only uses the first lookup. doc_id is the `scope_key` of the documents.
+
+    Returns:
+    tuple: The cached answer (or None) and the query embedding (None if not computed).
+    """
+    with span("answer.cache", lookup="exact") as cache_span:
+        cached = answer_cache.get_exact(doc_id, query)
+        cache_span.set(hit=cached is not None)
+    if cached is not None:
+        return cached, None
+    # Served from the embedding cache when retrieval needs it again on a miss
+    query_embedding = await get_query_embedding_async(query) if mode != "lexical" else None
+    with span("answer.cache", lookup="semantic") as cache_span:
+        cached = answer_cache.get_similar(doc_id, query_embedding)
+        cache_span.set(hit=cached is not None)
+    return cached, query_embedding
 
 
 @router.post("/", response_model=AnswerResponse)
 async def generate_answer_route(request: AnswerRequest):
     try:
-        # Step 1: Generate an answer based on the document ID and query
-        answer = generate_answer(request.doc_id, request.query)
-
-        # Step 2: Parse the 'content' field as JSON
-        content_json = json.loads(answer["content"])
-
-        # Step 3: Extract 'content' and 'relevant' from the parsed JSON
-        answer_content = content_json["content"]
-        is_relevant = content_json["relevant"]
-
-        if is_relevant:
-            # Return the answer in the success format
-            return {"success": True, "data": {"answer": answer_content}}
-        else:
-            # Generate an alternative response using the agent
-            agent_response = agent.run(request.query)
-            return {
-                "success": True,
-                "data": {
-                    "answer": "Sorry, I couldn't find a relevant answer from the document. Here's an alternative answer to your question: "
-                    + agent_response
-                },
-            }
+        # Step 1: Return the cached answer of the same or a similar question
+        documents = request.documents()
+        scope = scope_key(documents)
+        cached, query_embedding = await _cached_answer(scope, request.query, request.mode)
+        if cached is not None:
+            return {"success": True, "data": {"answer": cached["answer"]}}
+
+        # Step 2: Generate an answer based on the document ID and query
+        answer = await generate_answer_async(documents, request.query, request.mode, request.cross_document)
+
+        # Step 3: Extract 'content' and 'relevant' from the structured answer
+        answer_content = answer["content"]
+        is_relevant = answer["relevant"]
+
+        if not is_relevant:
+            answer_content = await fallback_answer(documents, request.query, answer["sources"])
+
+        # Step 4: Cache the answer for the next similar questions
+        answer_cache.put(
+            scope,
+            request.query,
+            query_embedding,
+            {"answer": answer_content, "relevant": is_relevant, "sources": answer["sources"]},
+        )
+
+        # Return the answer in the success format
+        return {"success": True, "data": {"answer": answer_content}}
 
     except Exception as e:
         # Standardized error response
         return {"success": False, "data": None, "error": {"message": str(e)}}
+
+
+def _sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=float)}\n\n"
+
+
+@router.post(
+    "/stream",
+    summary="Stream an answer with Server-Sent Events",
+    description="Same as POST /answer, but the response is a text/event-stream: a `sources` event with the relevant chunks as soon as "
+    "retrieval is done, `token` events with each new piece of the answer, then a `relevance` event. If the answer is not "
+    "relevant, a `fallback` event carries the alternative answer. Errors are sent as an `error` event.",
+)
+async def stream_answer_route(request: AnswerRequest):
+    async def events():
+        try:
+            # Replay the cached answer of the same or a similar question
+            documents = request.documents()
+            scope = scope_key(documents)
+            cached, query_embedding = await _cached_answer(scope, request.query, request.mode)
+            if cached is not None:
+                # In the order of a live stream: the answer comes before its relevance, the fallback after
+                yield _sse_event("sources", cached["sources"])
+                if cached["relevant"]:
+                    yield _sse_event("token", {"text": cached["answer"]})
+                yield _sse_event("relevance", {"relevant": cached["relevant"]})
+                if not cached["relevant"]:
+                    yield _sse_event("fallback", {"answer": cached["answer"]})
+                return
+
+            sources = []
+            async for event, data in stream_answer(documents, request.query, request.mode, request.cross_document):
+                if event == "token":
+                    yield _sse_event("token", {"text": data})
+                elif event == "relevance":
+                    yield _sse_event("relevance", {"relevant": data["relevant"]})
+                    answer_content = data["content"]
+                    if not data["relevant"]:
+                        answer_content = await fallback_answer(documents, request.query, sources)
+                        yield _sse_event("fallback", {"answer": answer_content})
+                    answer_cache.put(
+                        scope,
+                        request.query,
+                        query_embedding,
+                        {"answer": answer_content, "relevant": data["relevant"], "sources": sources},
+                    )
+                else:
+                    if event == "sources":
+                        sources = data
+                    yield _sse_event(event, data)
+        except Exception as e:
+            yield _sse_event("error", {"message": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Ask proxies not to buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,61 @@
+from fastapi import APIRouter
+from pydantic import BaseModel, Field
+from typing import Annotated, Any, Dict, List, Optional
+import traceback
+from utils.concurrency import run_blocking
+from utils.document_registry import DOC_ID_PATTERN, document_registry
+from utils.ingestion_jobs import UnknownDocument, add_to_collection
+
+router = APIRouter()
+
+
+class CollectionRequest(BaseModel):
+    document_ids: List[Annotated[str, Field(pattern=DOC_ID_PATTERN)]] = Field(..., min_length=1)
+
+    class Config:
+        schema_extra = {"example": {"document_ids": ["12345", "67890"]}}
+
+
+class CollectionResponse(BaseModel):
+    success: bool
+    data: Optional[Dict[str, Any]] = None
+    error: Optional[Dict[str, Any]] = None
+
+
+@router.put(
+    "/{collection_id}",
+    response_model=CollectionResponse,
+    summary="Add documents to a collection",
+    description="Adds stored documents to a collection (e.g. the documents of a course), creating it if needed. Each added "
+    "document is linked to the other documents of the collection by cross-document edges between their most similar "
+    "chunks. The collection can then be searched as a whole with `collection_id` in POST /retrieve and POST /answer. "
+    "Documents can also be added when they are uploaded, with `collection_id` in POST /upload.",
+)
+async def put_collection(collection_id: str, request: CollectionRequest):
+    try:
+        # Linking compares the vectors of the documents, don't block the event loop meanwhile
+        data = await run_blocking(add_to_collection, collection_id, request.document_ids)
+        return {"success": True, "data": data}
+
+    except UnknownDocument as e:
+        return {"success": False, "data": None, "error": {"message": str(e), "type": type(e).__name__}}
+    except Exception as e:
+        print("ERROR:", e)
+        traceback.print_exc()
+        return {"success": False, "data": None, "error": {"message": str(e), "type": type(e).__name__}}
+
+
+@router.get(
+    "/{collection_id}",
+    response_model=CollectionResponse,
+    summary="Get the documents of a collection",
+)
+async def get_collection(collection_id: str):
+    documents = document_registry.collection_documents(collection_id)
+    if documents is None:
+        return {
+            "success": False,
+            "data": None,
+            "error": {"message": f"No collection found with ID: {collection_id}"},
+        }
+    return {"success": True, "data": {"collection_id": collection_id, "document_ids": documents}}
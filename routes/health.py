@@ -0,0 +1,29 @@
+from fastapi import APIRouter, Query
+from fastapi.responses import JSONResponse
+from utils.clients import readiness, start_warm_up, warm_up
+from utils.concurrency import run_blocking
+
+router = APIRouter()
+
+
+@router.get(
+    "/ready",
+    summary="Readiness",
+    description="Warms up the shared clients and heavy dependencies if it wasn't done yet (LanceDB, OpenAI clients, "
+    "PDF processing, tokenizers) and returns 200 once they are ready, with the time each one took, "
+    "or 503 while warming up (with `wait=false`) or if a component failed. The warm-up also starts with the app, "
+    "see STARTUP_WARMUP.",
+)
+async def ready(wait: bool = Query(True, description="Wait for the warm-up instead of returning 503 while it runs")):
+    if wait:
+        state = await run_blocking(warm_up)
+    else:
+        if readiness()["status"] in ("pending", "failed"):
+            start_warm_up()
+        state = readiness()
+    if state["status"] == "ready":
+        return {"success": True, "data": state}
+    return JSONResponse(
+        status_code=503,
+        content={"success": False, "data": state, "error": {"message": f"Not ready: {state['status']}"}},
+    )
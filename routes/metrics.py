@@ -0,0 +1,76 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from utils.embedding_cache import embedding_cache
+from utils.answer_cache import answer_cache
+from utils.fallback import fallback_cache
+from utils.vector_cache import document_vectors
+from utils.concurrency import chat_flight, embedding_flight
+from utils.rate_limit import rate_limit_stats
+from utils.tracing import register_gauges, render_metrics
+
+router = APIRouter()
+
+
+def _cache_gauges() -> dict:
+    # Read from the caches' own counters at scrape time
+    caches = {
+        "embedding": embedding_cache.stats(),
+        "answer": answer_cache.stats(),
+        "fallback": fallback_cache.stats(),
+        "vector": document_vectors.stats(),
+    }
+    return {
+        "cache_hit_rate": (
+            "Hit rate of the caches since startup.",
+            [({"cache": name}, stats["hit_rate"]) for name, stats in caches.items()],
+        ),
+        "cache_misses": (
+            "Misses of the caches since startup.",
+            [({"cache": name}, stats["misses"]) for name, stats in caches.items()],
+        ),
+        "cache_entries": (
+            "Entries held in memory by the caches.",
+            [
+                ({"cache": "embedding"}, caches["embedding"]["memory_entries"]),
+                ({"cache": "answer"}, caches["answer"]["entries"]),
+                ({"cache": "fallback"}, caches["fallback"]["entries"]),
+                ({"cache": "vector"}, caches["vector"]["documents"]),
+            ],
+        ),
+    }
+
+
+register_gauges(_cache_gauges)
+
+
+def _upstream_gauges() -> dict:
+    rates = rate_limit_stats()
+    flights = {"openai_embeddings": embedding_flight.stats(), "openai_chat": chat_flight.stats()}
+    return {
+        "upstream_rate_limited_calls": (
+            "Calls delayed by the rate governor of an upstream service since startup.",
+            [({"upstream": name}, stats["delayed"]) for name, stats in rates.items()],
+        ),
+        "upstream_rate_limit_wait_seconds": (
+            "Total time waited for the rate governor of an upstream service since startup.",
+            [({"upstream": name}, stats["wait_s"]) for name, stats in rates.items()],
+        ),
+        "upstream_coalesced_calls": (
+            "Calls that shared an identical in-flight request instead of calling the upstream service.",
+            [({"upstream": name}, stats["coalesced"]) for name, stats in flights.items()],
+        ),
+    }
+
+
+register_gauges(_upstream_gauges)
+
+
+@router.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    summary="Prometheus metrics",
+    description="Returns the request and stage latency histograms, the OpenAI token counters and the cache "
+    "statistics in the Prometheus text exposition format.",
+)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
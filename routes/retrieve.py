@@ -1,19 +1,51 @@
+import os
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import Dict, Any
-from utils.Knowlege_graph import retrieve_relevant_chunks_from_db
+from pydantic import BaseModel, Field, model_validator
+from typing import Annotated, Dict, Any, List, Optional
+from utils.document_registry import DOC_ID_PATTERN, resolve_documents
+from utils.Knowlege_graph import (
+    RetrievalMode,
+    retrieve_relevant_chunks_from_db_async,
+    retrieve_relevant_chunks_batch_async,
+    retrieve_relevant_chunks_multi_async,
+)
+
+# Maximum number of queries in one POST /retrieve/batch request
+RETRIEVE_BATCH_MAX_QUERIES = int(os.getenv("RETRIEVE_BATCH_MAX_QUERIES", "1000"))
 
 router = APIRouter()
 
 
 # Request model to accept doc_id and query
 class RetrieveRequest(BaseModel):
-    document_id: str
+    # The documents searched: one document, a list of documents, or the documents of a collection
+    document_id: Optional[str] = Field(default=None, pattern=DOC_ID_PATTERN)
+    document_ids: Optional[List[Annotated[str, Field(pattern=DOC_ID_PATTERN)]]] = Field(default=None, min_length=1)
+    collection_id: Optional[str] = None
     query: str
+    # "vector": pure vector search, "graph": vector hits expanded by their knowledge graph neighbours,
+    # "lexical": BM25 keyword search (no embedding call), "hybrid": vector and BM25 results fused
+    mode: RetrievalMode = "vector"
+    hops: int = Field(default=1, ge=1, le=3)
+    top_k: int = Field(default=3, ge=1, le=50)
+    # Across several documents, also return the chunks linked to the hits by cross-document edges
+    cross_document: bool = False
+
+    @model_validator(mode="after")
+    def check_target(self):
+        targets = [self.document_id, self.document_ids, self.collection_id]
+        if sum(target is not None for target in targets) != 1:
+            raise ValueError("Exactly one of document_id, document_ids and collection_id is required")
+        return self
 
     class Config:
         schema_extra = {
-            "example": {"document_id": "12345", "query": "What is the meaning of AI?"}
+            "example": {
+                "document_id": "12345",
+                "query": "What is the meaning of AI?",
+                "mode": "graph",
+                "hops": 1,
+            }
         }
 
 
@@ -26,7 +58,8 @@ class Chunk(BaseModel):
 
 class RetrieveResponse(BaseModel):
     success: bool
-    data: Dict[str, Any]
+    data: Optional[Dict[str, Any]] = None
+    error: Optional[Dict[str, Any]] = None
 
 
 @router.post(
@@ -34,7 +67,10 @@ class RetrieveResponse(BaseModel):
     response_model=RetrieveResponse,
     summary="Retrieve relevant chunks from a document based on a query",
     description="This endpoint retrieves relevant chunks from a specified document based on the provided query. "
-    "It uses a search mechanism that finds the most similar chunks to the query and returns them as part of the response.",
+    "It uses a search mechanism that finds the most similar chunks to the query and returns them as part of the response. "
+    "Several documents are searched together with `document_ids` or `collection_id`: they are searched in parallel and "
+    "the best `top_k` chunks overall are returned, each with its `document_id`, and with `cross_document` the chunks "
+    "of the other documents linked to them. A document that could not be searched is reported in `errors`.",
     response_description="A list of relevant chunks containing the text and similarity score that matched the query",
     responses={500: {"description": "Internal Server Error"}},
 )
@@ -44,16 +80,87 @@ async def retrieve_relevant_chunks(request: RetrieveRequest):
     """
     try:
         # Step 1: Call the service to get relevant chunks
-        relevant_chunks = retrieve_relevant_chunks_from_db(
-            request.document_id, request.query
+        if request.document_id is not None:
+            relevant_chunks = await retrieve_relevant_chunks_from_db_async(
+                request.document_id, request.query, top_k=request.top_k, mode=request.mode, hops=request.hops
+            )
+            return {
+                "success": True,
+                "data": {
+                    "document_id": request.document_id,
+                    "relevant_chunks": relevant_chunks,
+                },
+            }
+
+        # Step 2: Or search several documents together
+        doc_ids = resolve_documents(doc_ids=request.document_ids, collection_id=request.collection_id)
+        relevant_chunks, errors = await retrieve_relevant_chunks_multi_async(
+            doc_ids,
+            request.query,
+            top_k=request.top_k,
+            mode=request.mode,
+            hops=request.hops,
+            cross_document=request.cross_document,
         )
         return {
             "success": True,
             "data": {
-                "document_id": request.document_id,
+                "document_ids": doc_ids,
+                "collection_id": request.collection_id,
                 "relevant_chunks": relevant_chunks,
+                "errors": errors,
             },
         }
 
     except Exception as e:
-        return {"success": False, "error": {"message": str(e)}}
+        return {"success": False, "error": {"message": getattr(e, "detail", None) or str(e)}}
+
+
+class BatchQuery(BaseModel):
+    document_id: str = Field(..., pattern=DOC_ID_PATTERN)
+    query: str
+
+
+class RetrieveBatchRequest(BaseModel):
+    queries: List[BatchQuery] = Field(..., min_length=1, max_length=RETRIEVE_BATCH_MAX_QUERIES)
+    mode: RetrievalMode = "vector"
+    hops: int = Field(default=1, ge=1, le=3)
+    top_k: int = Field(default=3, ge=1, le=50)
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "queries": [
+                    {"document_id": "12345", "query": "What is the meaning of AI?"},
+                    {"document_id": "12345", "query": "Who coined the term?"},
+                ],
+                "mode": "vector",
+                "top_k": 3,
+            }
+        }
+
+
+@router.post(
+    "/batch",
+    response_model=RetrieveResponse,
+    summary="Retrieve relevant chunks for many queries at once",
+    description="Same as POST /retrieve for a list of (document_id, query) pairs, which may target several documents. "
+    "The queries are embedded together and each document is searched once for all its queries. "
+    "The results are returned in the order of the queries; a query whose document could not be searched has an `error` instead of `relevant_chunks`.",
+    responses={500: {"description": "Internal Server Error"}},
+)
+async def retrieve_relevant_chunks_batch(request: RetrieveBatchRequest):
+    """
+    Endpoint to retrieve the relevant chunks of many queries in one request.
+    """
+    try:
+        results = await retrieve_relevant_chunks_batch_async(
+            [(item.document_id, item.query) for item in request.queries],
+            top_k=request.top_k,
+            mode=request.mode,
+            hops=request.hops,
+        )
+        return {"success": True, "data": {"results": results}}
+
+    except Exception as e:
+        return {"success": False, "error": {"message": getattr(e, "detail", None) or str(e)}}
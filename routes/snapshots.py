@@ -0,0 +1,107 @@
+import os
+import tempfile
+import traceback
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Request
+from fastapi.responses import FileResponse, JSONResponse
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
+from utils.concurrency import run_blocking
+from utils.ingestion_jobs import UnknownDocument
+from utils.snapshots import (
+    SNAPSHOT_SUFFIX,
+    SNAPSHOT_UPLOAD_MAX_BYTES,
+    InvalidSnapshot,
+    export_document,
+    import_snapshots,
+)
+
+router = APIRouter()
+
+SNAPSHOT_MEDIA_TYPE = "application/vnd.apache.arrow.file"
+
+
+class SnapshotResponse(BaseModel):
+    success: bool
+    data: Optional[Dict[str, Any]] = None
+    error: Optional[Dict[str, Any]] = None
+
+
+def _remove(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _error(status_code: int, e: Exception):
+    return JSONResponse(
+        status_code=status_code,
+        content={"success": False, "data": None, "error": {"message": str(e), "type": type(e).__name__}},
+    )
+
+
+@router.get(
+    "/{document_id}",
+    response_class=FileResponse,
+    responses={200: {"content": {SNAPSHOT_MEDIA_TYPE: {}}}, 404: {"model": SnapshotResponse}},
+    summary="Export a document",
+    description="Returns the snapshot of a stored document: its chunks, their float32 vectors, its similarity graph "
+    "and cross-document edges, and its registry entry and collections, in one uncompressed Arrow IPC file. "
+    "It can be restored on any instance with POST /snapshots, without calling OpenAI.",
+)
+async def export_snapshot(document_id: str):
+    fd, path = tempfile.mkstemp(suffix=SNAPSHOT_SUFFIX)
+    os.close(fd)
+    try:
+        await run_blocking(export_document, document_id, path)
+    except UnknownDocument as e:
+        _remove(path)
+        return _error(404, e)
+    except Exception as e:
+        _remove(path)
+        print("ERROR:", e)
+        traceback.print_exc()
+        return _error(500, e)
+
+    # The file is deleted once it is sent
+    return FileResponse(
+        path,
+        media_type=SNAPSHOT_MEDIA_TYPE,
+        filename=document_id + SNAPSHOT_SUFFIX,
+        background=BackgroundTask(_remove, path),
+    )
+
+
+@router.post(
+    "",
+    response_model=SnapshotResponse,
+    summary="Restore a document",
+    description="Restores a document from its snapshot (see GET /snapshots/{document_id}), sent as the request body "
+    f"with Content-Type `{SNAPSHOT_MEDIA_TYPE}`. A stored document with the same ID is replaced. No OpenAI call is "
+    "made: the chunks and their vectors are bulk-loaded into LanceDB and the graphs are written as they are. "
+    "To restore many documents at once, use `python -m utils.snapshots import`.",
+)
+async def import_snapshot(request: Request):
+    fd, path = tempfile.mkstemp(suffix=SNAPSHOT_SUFFIX)
+    try:
+        # Step 1: Stream the body to a file, the snapshot is then memory-mapped from it
+        size = 0
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > SNAPSHOT_UPLOAD_MAX_BYTES:
+                    return _error(413, InvalidSnapshot(f"Snapshots are limited to {SNAPSHOT_UPLOAD_MAX_BYTES} bytes"))
+                f.write(chunk)
+
+        # Step 2: Restore it without blocking the event loop
+        data = await run_blocking(import_snapshots, [path])
+        return {"success": True, "data": data}
+
+    except InvalidSnapshot as e:
+        return _error(400, e)
+    except Exception as e:
+        print("ERROR:", e)
+        traceback.print_exc()
+        return _error(500, e)
+    finally:
+        _remove(path)
@@ -1,10 +1,13 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, HttpUrl
-from utils.pdf_processor import process_pdf, verify_pdf
-from utils.embeddings_generator import create_embeddings, store_embeddings
-from utils.Knowlege_graph import build_graph_and_store
+from utils.ingestion_jobs import (
+    submit_ingestion,
+    submit_update,
+    get_job,
+    UnknownDocument,
+    IngestionInProgress,
+)
 from typing import Dict, Any, Optional
-from uuid import uuid4
 import traceback
 
 router = APIRouter()
@@ -12,49 +15,85 @@ router = APIRouter()
 
 class UploadRequest(BaseModel):
     url: HttpUrl
+    # The collection to add the document to, see PUT /collections/{collection_id}
+    collection_id: Optional[str] = None
+
+
+class UpdateRequest(BaseModel):
+    url: HttpUrl
+    # The document to update, found by URL (then by content) when omitted
+    document_id: Optional[str] = None
 
 
 class UploadResponse(BaseModel):
     success: bool
     data: Optional[Dict[str, Any]] = None
+    error: Optional[Dict[str, Any]] = None
 
 
 @router.post(
     "/",
     response_model=UploadResponse,
     summary="Upload a PDF document",
-    description="Upload a PDF document from a provided URL and process it. The document will be processed, embeddings will be created, and a knowledge graph will be built and stored.",
+    description="Upload a PDF document from a provided URL and process it in the background. The document will be downloaded and parsed, embeddings will be created, and a knowledge graph will be built and stored. "
+    "The response contains the document ID and the ID of the ingestion job, whose progress can be followed with GET /upload/{job_id}. "
+    "With `collection_id`, the document is added to that collection and linked to its other documents once stored.",
 )
 async def upload_pdf(request: UploadRequest):
     try:
+        # Step 1: Queue the ingestion job (download → parse → embed → store → graph)
+        job = submit_ingestion(request.url, collection_id=request.collection_id)
 
-        # Step 1: Verify that the URL is valid and PDF
-        verify_pdf(request.url)
-
-        # Step 2: Process the PDF and extract text chunks
-        document_text = process_pdf(request.url)
-
-        # Step 3: Generate ID for the document
-        doc_id = str(uuid4())
+        # Step 2: Return the IDs right away, the document is queryable once the job succeeded
+        return {
+            "success": True,
+            "data": {
+                "document_id": job.doc_id,
+                "job_id": job.job_id,
+                "status": job.status,
+            },
+        }
 
-        # Step 4: Generate embeddings for each chunk
-        chunks = create_embeddings(document_text)
+    except Exception as e:
+        print("ERROR:", e)
+        traceback.print_exc()
+        return {
+            "success": False,
+            "data": None,
+            "error": {
+                "message": str(e),
+                "type": type(e).__name__,
+            },
+        }
 
-        # Step 5: Store embeddings in the vector database with the document ID in case we need it later
-        store_embeddings(doc_id, chunks)
 
-        # Step 6: Create and Store the knowledge graph
-        build_graph_and_store(doc_id, chunks)
+@router.post(
+    "/update",
+    response_model=UploadResponse,
+    summary="Update a document from a new version of its PDF",
+    description="Downloads the new version of a document and stores only what changed: its chunks are compared with the "
+    "stored ones by hash, new chunks are embedded and inserted, removed chunks are deleted, and only their graph edges "
+    "are recomputed. The document is identified by `document_id`, or else by the URL it was uploaded from, or else by "
+    "the content of the PDF; a URL matching no document is ingested as a new one. Progress and the number of added, "
+    "removed and unchanged chunks are available with GET /upload/{job_id}, whose document_id is the one updated.",
+)
+async def update_pdf(request: UpdateRequest):
+    try:
+        # Step 1: Queue the update job (download → parse → diff and embed → store → patch graph)
+        job = submit_update(request.url, request.document_id)
 
-        print("Knowledge Graph Created and stored")
-        print(doc_id)
+        # Step 2: Return the IDs right away, the previous version stays queryable until the job stored the new one
         return {
             "success": True,
             "data": {
-                "document_id": doc_id,
+                "document_id": job.doc_id,
+                "job_id": job.job_id,
+                "status": job.status,
             },
         }
 
+    except (UnknownDocument, IngestionInProgress) as e:
+        return {"success": False, "data": None, "error": {"message": str(e), "type": type(e).__name__}}
     except Exception as e:
         print("ERROR:", e)
         traceback.print_exc()
@@ -66,3 +105,20 @@ async def upload_pdf(request: UploadRequest):
                 "type": type(e).__name__,
             },
         }
+
+
+@router.get(
+    "/{job_id}",
+    response_model=UploadResponse,
+    summary="Get the status of an upload",
+    description="Returns the status of an ingestion job, with the progress and timing of each stage.",
+)
+async def upload_status(job_id: str):
+    job = get_job(job_id)
+    if job is None:
+        return {
+            "success": False,
+            "data": None,
+            "error": {"message": f"No upload job found with ID: {job_id}"},
+        }
+    return {"success": True, "data": job.to_dict()}
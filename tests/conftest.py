@@ -0,0 +1,37 @@
+"""
+The tests run offline: the stores are in a temporary directory and the OpenAI backends are the stubs of
+the benchmarks. The configuration is read when the application is imported, so it is set here, before
+any test module imports it.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_test import configure_offline_environment  # noqa: E402
+
+configure_offline_environment(tempfile.mkdtemp(prefix="tests-"), 0)
+# No index maintenance thread outliving the tests
+os.environ["VECTOR_INDEX_MIN_ROWS"] = str(10**9)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """
+    Points the chunks table, the graphs and the lexical indexes to an empty directory for one test.
+    """
+    from utils import Knowlege_graph, clients, graph_store, lexical_index
+    from utils.vector_index import wait_for_index_maintenance
+
+    monkeypatch.setattr(clients, "LANCEDB_URI", str(tmp_path / "lancedb"))
+    monkeypatch.delitem(clients._clients, "lancedb", raising=False)
+    monkeypatch.setattr(Knowlege_graph, "_migrated", False)
+    monkeypatch.setattr(graph_store, "GRAPH_STORE_DIR", str(tmp_path / "graphs"))
+    monkeypatch.setattr(lexical_index, "LEXICAL_INDEX_DIR", str(tmp_path / "lexical"))
+    yield tmp_path
+    wait_for_index_maintenance()
+    monkeypatch.delitem(clients._clients, "lancedb", raising=False)
@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from utils.answer_cache import AnswerCache, normalize_query, scope_key
+
+ANSWER = {"answer": "42", "relevant": True, "sources": []}
+
+
+def _unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_exact_hit_ignores_case_whitespace_and_punctuation():
+    cache = AnswerCache()
+    cache.put("doc", "What is  the answer?", None, ANSWER)
+
+    assert normalize_query(" what is the ANSWER ?! ") == "what is the answer"
+    assert cache.get_exact("doc", "what is the ANSWER") == ANSWER
+    assert cache.get_exact("other", "what is the answer", count_miss=True) is None
+    assert cache.stats()["exact_hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_semantic_hit_above_the_threshold_only():
+    cache = AnswerCache(similarity_threshold=0.95)
+    cache.put("doc", "first question", _unit(1, 0, 0), ANSWER)
+
+    assert cache.get_similar("doc", _unit(1, 0.1, 0)) == ANSWER
+    assert cache.get_similar("doc", _unit(1, 1, 0)) is None
+    assert cache.get_similar("doc", None) is None
+    stats = cache.stats()
+    assert stats["semantic_hits"] == 1 and stats["misses"] == 2
+
+
+def test_entries_expire():
+    cache = AnswerCache(ttl_s=-1)
+    cache.put("doc", "question", _unit(1, 0), ANSWER)
+
+    assert cache.get_exact("doc", "question") is None
+    assert cache.get_similar("doc", _unit(1, 0)) is None
+    assert cache.stats()["expirations"] == 1 and cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = AnswerCache(max_entries=2)
+    cache.put("doc", "a", _unit(1, 0), ANSWER)
+    cache.put("doc", "b", _unit(0, 1), ANSWER)
+    cache.get_exact("doc", "a")
+    cache.put("doc", "c", _unit(1, 1), ANSWER)
+
+    assert cache.get_exact("doc", "a") == ANSWER
+    assert cache.get_exact("doc", "b") is None
+    # The evicted query is no longer in the matrix of the semantic lookup
+    assert cache.get_similar("doc", _unit(0, 1)) is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidation_drops_the_answers_of_every_scope_of_the_document():
+    cache = AnswerCache()
+    cache.put("a", "question", None, ANSWER)
+    cache.put(scope_key(["b", "a"]), "question", None, ANSWER)
+    cache.put(scope_key(["b", "c"]), "question", None, ANSWER)
+
+    cache.invalidate("a")
+
+    assert scope_key(["a", "b"]) == scope_key(["b", "a", "b"]) == "documents:a|b"
+    assert scope_key(["a"]) == scope_key("a") == "a"
+    assert cache.get_exact("a", "question") is None
+    assert cache.get_exact(scope_key(["a", "b"]), "question") is None
+    assert cache.get_exact(scope_key(["b", "c"]), "question") == ANSWER
+
+
+def _events(response) -> list:
+    return [line[len("event: ") :] for line in response.text.splitlines() if line.startswith("event: ")]
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = AnswerCache()
+    monkeypatch.setattr("routes.answer.answer_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def client(cache):
+    from routes.answer import router
+
+    app = FastAPI()
+    app.include_router(router, prefix="/answer")
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("relevant", [True, False])
+def test_cached_stream_replays_the_events_of_the_live_stream(client, cache, monkeypatch, relevant):
+    async def stream(documents, query, mode="vector", cross_document=False):
+        yield "sources", [{"node_id": "streamed_node_0", "text": "The answer is 42", "similarity": 1.0}]
+        yield "token", "The answer "
+        yield "token", "is 42"
+        yield "relevance", {"content": "The answer is 42", "relevant": relevant}
+
+    async def fallback(documents, query, sources):
+        return "A fallback answer"
+
+    monkeypatch.setattr("routes.answer.stream_answer", stream)
+    monkeypatch.setattr("routes.answer.fallback_answer", fallback)
+    request = {"doc_id": "streamed", "query": "What is the answer?"}
+
+    live = _events(client.post("/answer/stream", json=request))
+    cached = _events(client.post("/answer/stream", json=request))
+
+    assert cache.stats()["exact_hits"] == 1
+    if relevant:
+        assert live == ["sources", "token", "token", "relevance"]
+        assert cached == ["sources", "token", "relevance"]
+    else:
+        assert live == ["sources", "token", "token", "relevance", "fallback"]
+        assert cached == ["sources", "relevance", "fallback"]
@@ -0,0 +1,122 @@
+from datetime import datetime
+
+import numpy as np
+import pyarrow as pa
+
+from utils.embeddings_generator import create_embeddings
+from utils.graph_store import load_graph
+from utils.Knowlege_graph import (
+    NODES_TABLE,
+    apply_chunk_diff,
+    build_graph_and_store,
+    compute_similarity_edges,
+    diff_document_chunks,
+    node_index,
+    open_nodes_table,
+    update_graph,
+)
+from utils.clients import get_db
+from utils.vector_index import wait_for_index_maintenance
+
+
+def _texts(n, version=0):
+    return [f"Section {i} v{version}: " + " ".join(f"term{(i * 7 + j) % 997}" for j in range(60)) for i in range(n)]
+
+
+def _update(doc_id, texts):
+    # The update stages of an ingestion job (see utils/ingestion_jobs.py)
+    diff = diff_document_chunks(doc_id, texts)
+    if len(diff.added):
+        diff.vectors[diff.added] = create_embeddings([diff.texts[p] for p in diff.added]).vectors
+    apply_chunk_diff(doc_id, diff)
+    return diff, update_graph(doc_id, diff, threshold=0.0)
+
+
+def _stored(doc_id):
+    rows = open_nodes_table().search().where(f"doc_id = '{doc_id}'").select(["id", "payload"]).limit(None).to_arrow()
+    return sorted(
+        (node_index(node_id), payload["content"])
+        for node_id, payload in zip(rows["id"].to_pylist(), rows["payload"].to_pylist())
+    )
+
+
+def _edges(graph):
+    sources = np.repeat(np.arange(graph.n_nodes), np.diff(np.asarray(graph.indptr)))
+    return {(int(s), int(t)) for s, t in zip(sources, np.asarray(graph.indices)) if s < t}
+
+
+def test_diff_of_a_new_document_adds_every_chunk(store):
+    diff = diff_document_chunks("new", _texts(3))
+
+    assert diff.added.tolist() == [0, 1, 2]
+    assert diff.nodes.tolist() == [0, 1, 2]
+    assert diff.removed.tolist() == [] and diff.removed_ids == []
+
+
+def test_update_keeps_unchanged_chunks_and_replaces_the_others(store):
+    texts = _texts(5)
+    build_graph_and_store("doc", create_embeddings(texts))
+
+    revised = texts[:2] + _texts(1, version=1) + texts[3:4]
+    diff, graph = _update("doc", revised)
+
+    assert diff.summary() == {"chunks": 4, "added": 1, "removed": 2, "unchanged": 3}
+    # Unchanged chunks keep their index, the added one gets the next free index
+    assert diff.nodes.tolist() == [0, 1, 5, 3]
+    assert sorted(diff.removed.tolist()) == [2, 4]
+    assert _stored("doc") == sorted(zip(diff.nodes.tolist(), revised))
+
+    # The patched graph is the one built from scratch on the new chunks
+    rows, cols, _ = compute_similarity_edges(diff.vectors, threshold=0.0)
+    expected = {tuple(sorted((int(diff.nodes[r]), int(diff.nodes[c])))) for r, c in zip(rows, cols)}
+    assert _edges(graph) == expected
+    assert _edges(load_graph("doc")) == expected
+
+
+def test_unchanged_document_is_not_rewritten(store):
+    texts = _texts(4)
+    build_graph_and_store("same", create_embeddings(texts))
+    wait_for_index_maintenance()
+    version = open_nodes_table().version
+
+    diff, _ = _update("same", texts)
+
+    assert diff.summary() == {"chunks": 4, "added": 0, "removed": 0, "unchanged": 4}
+    wait_for_index_maintenance()
+    assert open_nodes_table().version == version
+
+
+def test_update_of_a_legacy_document_stored_twice(store):
+    # A table in the schema of the first versions: no doc_id column, and IDs with a timestamp. The
+    # document was uploaded twice, so each chunk index has two rows.
+    texts = _texts(5)
+    vectors = create_embeddings(texts).vectors
+    meta = pa.struct([("doc_id", pa.string()), ("source", pa.string()), ("timestamp", pa.timestamp("us"))])
+    schema = pa.schema(
+        [
+            ("id", pa.string()),
+            ("vector", pa.list_(pa.float32(), vectors.shape[1])),
+            ("payload", pa.struct([("content", pa.string()), ("meta", meta)])),
+        ]
+    )
+    rows = []
+    for upload in range(2):
+        now = datetime(2024, 1, 1, upload)
+        rows += [
+            {
+                "id": f"legacy_node_{i}_{now}",
+                "vector": vectors[i].tolist(),
+                "payload": {"content": text, "meta": {"doc_id": "legacy", "source": "source_example", "timestamp": now}},
+            }
+            for i, text in enumerate(texts)
+        ]
+    get_db().create_table(NODES_TABLE, data=pa.Table.from_pylist(rows, schema=schema))
+
+    revised = texts[:4] + [texts[4] + " (revised)"]
+    diff = diff_document_chunks("legacy", revised)
+    apply_chunk_diff("legacy", diff)
+
+    # One copy of the unchanged chunks is kept, the duplicates and the revised chunk are deleted
+    assert diff.summary() == {"chunks": 5, "added": 1, "removed": 6, "unchanged": 4}
+    assert len(diff.removed_ids) == 6
+    assert _stored("legacy") == sorted(zip(diff.nodes.tolist(), revised))
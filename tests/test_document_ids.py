@@ -0,0 +1,44 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+FORGED = "docA' OR '1'='1"
+
+
+@pytest.fixture(scope="module")
+def client():
+    from routes.answer import router as answer_router
+    from routes.collections import router as collections_router
+    from routes.retrieve import router as retrieve_router
+
+    app = FastAPI()
+    app.include_router(retrieve_router, prefix="/retrieve")
+    app.include_router(answer_router, prefix="/answer")
+    app.include_router(collections_router, prefix="/collections")
+    return TestClient(app)
+
+
+@pytest.mark.parametrize(
+    "path, body",
+    [
+        ("/retrieve/", {"document_id": FORGED, "query": "q"}),
+        ("/retrieve/", {"document_ids": ["docA", FORGED], "query": "q"}),
+        ("/retrieve/batch", {"queries": [{"document_id": FORGED, "query": "q"}]}),
+        ("/answer/", {"doc_id": FORGED, "query": "q"}),
+        ("/answer/stream", {"doc_ids": [FORGED], "query": "q"}),
+        ("/answer/", {"doc_id": "../graphs", "query": "q"}),
+    ],
+)
+def test_invalid_document_ids_are_refused(client, path, body):
+    assert client.post(path, json=body).status_code == 422
+
+
+def test_invalid_document_ids_are_refused_in_collections(client):
+    assert client.put("/collections/course", json={"document_ids": [FORGED]}).status_code == 422
+
+
+def test_valid_document_ids_are_accepted():
+    from routes.retrieve import BatchQuery, RetrieveRequest
+
+    assert RetrieveRequest(document_ids=["doc-A_1", "12345"], query="q").document_ids == ["doc-A_1", "12345"]
+    assert BatchQuery(document_id="doc-A_1", query="q").document_id == "doc-A_1"
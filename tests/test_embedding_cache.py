@@ -0,0 +1,83 @@
+import threading
+
+import numpy as np
+import pytest
+
+from utils.embedding_cache import EmbeddingCache, cache_key
+from utils.vector_storage import EMBEDDING_DIMENSIONS
+
+MODEL = "text-embedding-test"
+
+
+def _vectors(n, seed=0):
+    return np.random.default_rng(seed).random((n, EMBEDDING_DIMENSIONS), dtype=np.float32)
+
+
+def _run(func, timeout=10):
+    # Runs func in a thread, and fails if it doesn't return in time
+    result = []
+    thread = threading.Thread(target=lambda: result.append(func()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert result, "timed out"
+    return result[0]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return EmbeddingCache(uri=str(tmp_path / "cache"), max_memory_entries=2)
+
+
+def test_keys_ignore_unicode_form_and_whitespace():
+    assert cache_key(MODEL, "café  au\nlait") == cache_key(MODEL, "café au lait")
+    assert cache_key(MODEL, "text") != cache_key("other-model", "text")
+
+
+def test_entries_are_read_back_from_disk(cache, tmp_path):
+    texts = ["a", "b", "c", "d"]
+    vectors = _vectors(4)
+    assert cache.get_many(MODEL, texts) == [None] * 4
+    cache.put_many(MODEL, texts, vectors)
+
+    # The memory tier holds 2 entries, the other ones are read from disk, as by a new process
+    for found in (cache.get_many(MODEL, texts), EmbeddingCache(uri=str(tmp_path / "cache")).get_many(MODEL, texts)):
+        np.testing.assert_array_equal(np.stack(found), vectors)
+    assert cache.stats()["disk_hits"] >= 2
+
+    # Entries written after the first lookup are found too
+    cache.put_many(MODEL, ["e"], _vectors(1, seed=1))
+    cache._memory.clear()
+    np.testing.assert_array_equal(cache.get_many(MODEL, ["e"])[0], _vectors(1, seed=1)[0])
+
+
+def test_disk_lookups_do_not_wait_for_a_write(cache):
+    cache.put_many(MODEL, ["a", "b", "c"], _vectors(3))
+    cache._memory.clear()
+
+    with cache._write_lock:
+        found = _run(lambda: cache.get_many(MODEL, ["a", "b", "c"]))
+    np.testing.assert_array_equal(np.stack(found), _vectors(3))
+
+
+def test_entries_being_written_are_found(cache, monkeypatch):
+    writing, release = threading.Event(), threading.Event()
+    disk_put = cache._disk_put
+
+    def slow_disk_put(*args):
+        writing.set()
+        release.wait(10)
+        disk_put(*args)
+
+    monkeypatch.setattr(cache, "_disk_put", slow_disk_put)
+    cache.put_many(MODEL, ["a", "b", "c"], _vectors(3), flush=False)
+    flusher = threading.Thread(target=cache.flush)
+    flusher.start()
+    writing.wait(10)
+
+    # "a" was evicted from memory, and is neither pending nor on disk yet
+    found = _run(lambda: cache.get_many(MODEL, ["a", "b", "c"]))
+    release.set()
+    flusher.join()
+
+    np.testing.assert_array_equal(np.stack(found), _vectors(3))
+    assert cache.stats()["misses"] == 0
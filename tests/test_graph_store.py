@@ -0,0 +1,94 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from utils.graph_store import CSRGraph, invalidate_graph, load_graph, save_graph
+
+
+def _graph(n_nodes, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, n_nodes, 4 * n_nodes)
+    cols = rng.integers(0, n_nodes, 4 * n_nodes)
+    keep = rows < cols
+    return CSRGraph.from_edges(n_nodes, rows[keep], cols[keep], rng.random(keep.sum()))
+
+
+def _assert_same(graph, expected):
+    for name in ("indptr", "indices", "weights"):
+        np.testing.assert_array_equal(getattr(graph, name), getattr(expected, name))
+
+
+def _entries(store):
+    return sorted(os.listdir(store / "graphs"))
+
+
+def test_saved_graph_is_memory_mapped(store):
+    graph = _graph(50)
+    save_graph("doc", graph)
+    invalidate_graph("doc")
+
+    loaded = load_graph("doc")
+    _assert_same(loaded, graph)
+    assert isinstance(loaded.indices, np.memmap)
+    assert load_graph("missing") is None
+    with pytest.raises(ValueError):
+        load_graph("../doc")
+
+
+def test_saving_again_replaces_the_version(store):
+    first, second = _graph(50), _graph(80, seed=1)
+    save_graph("doc", first)
+    loaded = load_graph("doc")
+    save_graph("doc", second)
+
+    _assert_same(load_graph("doc"), second)
+    # The previous version is deleted, a graph mapped before stays readable
+    assert len([entry for entry in _entries(store) if entry.startswith(".doc-")]) == 1
+    _assert_same(loaded, first)
+
+
+def test_graph_saved_as_a_plain_directory_is_replaced(store):
+    # The layout of the graphs saved before versions were linked
+    legacy = store / "graphs" / "legacy"
+    legacy.mkdir(parents=True)
+    old = _graph(10)
+    for name in ("indptr", "indices", "weights"):
+        np.save(legacy / f"{name}.npy", getattr(old, name))
+    _assert_same(load_graph("legacy"), old)
+
+    new = _graph(20, seed=1)
+    save_graph("legacy", new)
+
+    assert os.path.islink(legacy)
+    _assert_same(load_graph("legacy"), new)
+    assert len(_entries(store)) == 2
+
+
+def test_readers_always_find_a_graph_while_it_is_replaced(store):
+    graphs = [_graph(30, seed=seed) for seed in range(2)]
+    save_graph("doc", graphs[0])
+    done, failures = threading.Event(), []
+
+    def read():
+        while not done.is_set():
+            invalidate_graph("doc")
+            try:
+                graph = load_graph("doc")
+                if graph is None or graph.n_nodes != 30:
+                    failures.append(graph)
+            except Exception as e:
+                failures.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(2)]
+    for reader in readers:
+        reader.start()
+    for i in range(200):
+        save_graph("doc", graphs[i % 2])
+    done.set()
+    for reader in readers:
+        reader.join()
+
+    assert failures == []
+    assert load_graph("doc").n_nodes == 30
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from utils.json_stream import StreamingStringField
+
+
+def _feed(fragments, field="answer"):
+    decoder = StreamingStringField(field)
+    decoded = [decoder.feed(fragment) for fragment in fragments]
+    return decoder, decoded
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "plain text",
+        'quotes " and backslashes \\ and a slash /',
+        "lines\nand\ttabs\r\b\f",
+        "unicode é € and an emoji 😀",
+        "",
+    ],
+)
+def test_decodes_the_value_cut_at_every_position(value):
+    text = json.dumps({"answer": value, "relevant": True})
+    for cut in range(len(text) + 1):
+        decoder, decoded = _feed([text[:cut], text[cut:]])
+        assert "".join(decoded) == value
+        assert decoder.value == value
+        assert decoder.complete
+
+
+def test_decodes_character_by_character():
+    value = "a \\u00e9 \"b\" 😀 \n end"
+    text = json.dumps({"relevant": True, "answer": value})
+    decoder, decoded = _feed(list(text))
+    assert "".join(decoded) == value
+    assert decoder.complete
+
+
+def test_value_is_forwarded_before_the_object_is_complete():
+    decoder, decoded = _feed(['{"answer": "Hel', 'lo wor', 'ld", "rel'])
+    assert decoded == ["Hel", "lo wor", "ld"]
+    assert decoder.complete
+
+
+def test_other_fields_are_ignored():
+    decoder, decoded = _feed(['{"reason": "the \\"answer\\": \\"no\\"", ', '"answer": "yes"}'])
+    assert "".join(decoded) == "yes"
+
+
+def test_field_not_found():
+    decoder, decoded = _feed(['{"relevant": ', "false}"])
+    assert decoded == ["", ""]
+    assert not decoder.complete
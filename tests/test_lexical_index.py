@@ -0,0 +1,99 @@
+import math
+
+import numpy as np
+import pytest
+
+from utils.Knowlege_graph import reciprocal_rank_fusion
+from utils.lexical_index import BM25_B, BM25_K1, BM25Index, load_lexical_index, save_lexical_index, tokenize
+
+TEXTS = [
+    "CS101 covers algorithms and data structures",
+    "",  # Chunk index without a chunk (deleted by an update)
+    "Data structures: arrays, lists and trees. Trees are recursive data structures",
+    "The 2024 syllabus of CS101",
+    "Nothing relevant here",
+]
+
+
+def _reference_scores(texts, query):
+    # BM25 computed term by term, the chunks without tokens not counting in the statistics
+    documents = [tokenize(text) for text in texts]
+    indexed = [tokens for tokens in documents if tokens]
+    average_length = sum(map(len, indexed)) / len(indexed)
+    scores = {}
+    for term in set(tokenize(query)):
+        frequency = sum(term in tokens for tokens in indexed)
+        idf = math.log1p((len(indexed) - frequency + 0.5) / (frequency + 0.5))
+        for chunk, tokens in enumerate(documents):
+            count = tokens.count(term)
+            if count:
+                normalization = BM25_K1 * (1 - BM25_B + BM25_B * len(tokens) / average_length)
+                scores[chunk] = scores.get(chunk, 0.0) + idf * count * (BM25_K1 + 1) / (count + normalization)
+    return scores
+
+
+def test_tokenize_keeps_codes_and_numbers_whole():
+    assert tokenize("CS101, in 2024: Data-Structures!") == ["cs101", "in", "2024", "data", "structures"]
+
+
+@pytest.mark.parametrize("query", ["data structures", "CS101 2024", "trees", "recursive syllabus cs101"])
+def test_scores_match_the_bm25_formula(query):
+    hits = BM25Index.from_texts(TEXTS).search(query, top_k=10)
+    expected = _reference_scores(TEXTS, query)
+
+    assert {chunk for chunk, _ in hits} == set(expected)
+    for chunk, score in hits:
+        assert score == pytest.approx(expected[chunk], rel=1e-5)
+    assert [score for _, score in hits] == sorted((score for _, score in hits), reverse=True)
+
+
+def test_search_returns_the_top_k():
+    index = BM25Index.from_texts(TEXTS)
+    assert index.search("data structures cs101", top_k=2) == index.search("data structures cs101", top_k=10)[:2]
+    assert index.search("unknown words", top_k=3) == []
+
+
+def test_saved_index_gives_the_same_results(store):
+    index = BM25Index.from_texts(TEXTS)
+    save_lexical_index("lexical", index)
+    loaded = load_lexical_index("lexical")
+
+    assert isinstance(loaded.chunks, np.memmap)
+    for query in ["data structures", "CS101 2024", "trees"]:
+        assert loaded.search(query, top_k=5) == index.search(query, top_k=5)
+
+
+def test_invalid_document_id_is_refused(store):
+    with pytest.raises(ValueError):
+        load_lexical_index("../outside")
+
+
+def test_reciprocal_rank_fusion():
+    scores = reciprocal_rank_fusion(["a", "b", "c"], ["c", "a"], k=60)
+
+    assert scores == pytest.approx({"a": 1 / 61 + 1 / 62, "b": 1 / 62, "c": 1 / 63 + 1 / 61})
+    # Found by both rankings beats first in one only
+    assert sorted(scores, key=scores.get, reverse=True) == ["a", "c", "b"]
+    assert reciprocal_rank_fusion([], ["x"]) == {"x": pytest.approx(1 / 61)}
+
+
+def test_lexical_and_hybrid_retrieval(store):
+    from utils.embeddings_generator import create_embeddings, get_query_embedding
+    from utils.Knowlege_graph import build_graph_and_store, search_relevant_chunks
+
+    texts = [text for text in TEXTS if text]
+    build_graph_and_store("courses", create_embeddings(texts))
+    query = "syllabus CS101"
+
+    lexical = search_relevant_chunks("courses", None, 2, "lexical", 1, query)
+    assert [chunk["node_id"] for chunk in lexical] == ["courses_node_2", "courses_node_0"]
+    assert [chunk["text"] for chunk in lexical] == [texts[2], texts[0]]
+
+    embedding = np.asarray(get_query_embedding(query), dtype=np.float32)
+    hybrid = search_relevant_chunks("courses", embedding, 4, "hybrid", 1, query)
+    expected = reciprocal_rank_fusion(
+        [chunk["node_id"] for chunk in search_relevant_chunks("courses", None, 4, "lexical", 1, query)],
+        [chunk["node_id"] for chunk in search_relevant_chunks("courses", embedding, 4, "vector", 1, query)],
+    )
+    assert {chunk["node_id"]: chunk["similarity"] for chunk in hybrid} == pytest.approx(expected)
+    assert [chunk["similarity"] for chunk in hybrid] == sorted(expected.values(), reverse=True)
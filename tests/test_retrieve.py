@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from utils import Knowlege_graph
+from utils.embeddings_generator import create_embeddings
+from utils.Knowlege_graph import build_graph_and_store, retrieve_relevant_chunks_from_db_async
+
+TEXTS = ["CS101 covers algorithms", "Data structures and trees", "The 2024 syllabus"]
+
+
+@pytest.fixture
+def document(store):
+    build_graph_and_store("retrieved", create_embeddings(TEXTS))
+    return "retrieved"
+
+
+@pytest.mark.parametrize("mode", ["vector", "graph", "lexical", "hybrid"])
+def test_retrieval_modes(document, mode):
+    chunks = asyncio.run(retrieve_relevant_chunks_from_db_async(document, "syllabus 2024", top_k=2, mode=mode))
+
+    assert 0 < len(chunks) <= 2
+    assert {chunk["text"] for chunk in chunks} <= set(TEXTS)
+
+
+@pytest.mark.parametrize("mode", ["vector", "graph", "hybrid"])
+def test_query_that_could_not_be_embedded(document, monkeypatch, mode):
+    async def no_embedding(query):
+        return None
+
+    monkeypatch.setattr(Knowlege_graph, "get_query_embedding_async", no_embedding)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(retrieve_relevant_chunks_from_db_async(document, "syllabus", mode=mode))
+
+    assert error.value.status_code == 500
+    assert error.value.detail == "Error retrieving relevant chunks: the query could not be embedded"
+    # The lexical mode doesn't embed the query
+    assert asyncio.run(retrieve_relevant_chunks_from_db_async(document, "syllabus", mode="lexical"))
@@ -1,15 +1,65 @@
+from collections import deque
 from datetime import datetime
-import lancedb
+import hashlib
+import heapq
+import os
+import threading
+import time
 from lancedb.pydantic import LanceModel, Vector
 import numpy as np
+import pyarrow as pa
 from pydantic import BaseModel
-import networkx as nx
-from sklearn.metrics.pairwise import cosine_similarity
-from utils.embeddings_generator import get_query_embedding
+import asyncio
+from utils.embeddings_generator import get_query_embedding_async, get_query_embeddings_async
+from utils.clients import get_db
+from utils.concurrency import run_blocking, upstream_limit, lancedb_pool
+from utils.embedding_cache import normalize_text
+from utils.graph_store import (
+    CSRGraph,
+    CrossDocumentEdges,
+    save_graph,
+    load_graph,
+    save_cross_edges,
+    load_cross_edges,
+)
+from utils.lexical_index import BM25Index, save_lexical_index, load_lexical_index
+from utils.vector_index import ensure_doc_id_column, schedule_index_maintenance, vector_search
+from utils.vector_storage import EMBEDDING_DIMENSIONS, STORAGE_DTYPES, SEARCHABLE_STORAGE_DTYPE, vectors_from_arrow, vectors_to_arrow
+from utils.vector_cache import DocumentVectors, document_vectors
+from utils.tracing import span
 from fastapi import HTTPException
-from sklearn.metrics.pairwise import cosine_similarity
+from typing import Literal
 
-db = lancedb.connect("~/.lancedb")
+NODES_TABLE = "document_graph_nodes"
+
+# Only add a relation between two chunks if their similarity is greater than this (70% similarity)
+GRAPH_SIMILARITY_THRESHOLD = 0.7
+# Side of the square tiles of the similarity matrix, bounds memory to GRAPH_BLOCK_SIZE² floats
+GRAPH_BLOCK_SIZE = int(os.getenv("GRAPH_BLOCK_SIZE", "1024"))
+# Documents with more chunks than this use the approximate top-k neighbours mode
+GRAPH_APPROXIMATE_MIN_CHUNKS = int(os.getenv("GRAPH_APPROXIMATE_MIN_CHUNKS", "50000"))
+GRAPH_TOP_K = int(os.getenv("GRAPH_TOP_K", "16"))
+
+# Graph-expanded retrieval: score decay per hop and time budget of the expansion
+GRAPH_HOP_DECAY = float(os.getenv("GRAPH_HOP_DECAY", "0.85"))
+GRAPH_EXPANSION_BUDGET_MS = float(os.getenv("GRAPH_EXPANSION_BUDGET_MS", "50"))
+
+# Retrieval modes: "vector" (vector search), "graph" (vector hits expanded by their graph neighbours),
+# "lexical" (BM25 over the chunk text, no query embedding) and "hybrid" (vector and BM25 candidates
+# merged with reciprocal-rank fusion)
+RetrievalMode = Literal["vector", "graph", "lexical", "hybrid"]
+# Candidates taken from each ranking in hybrid mode, and the k constant of reciprocal-rank fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# Cross-document edges, computed when a document joins a collection: each chunk is linked to at most
+# CROSS_DOCUMENT_TOP_K chunks of the other documents whose similarity is greater than the threshold
+CROSS_DOCUMENT_SIMILARITY_THRESHOLD = float(os.getenv("CROSS_DOCUMENT_SIMILARITY_THRESHOLD", "0.85"))
+CROSS_DOCUMENT_TOP_K = int(os.getenv("CROSS_DOCUMENT_TOP_K", "4"))
+# Maximum number of documents searched by one multi-document query, and number of jobs of the LanceDB
+# thread pool searching them (each job searches its share of the documents in turn)
+MULTI_DOCUMENT_MAX_DOCUMENTS = int(os.getenv("MULTI_DOCUMENT_MAX_DOCUMENTS", "100"))
+MULTI_DOCUMENT_PARALLELISM = int(os.getenv("MULTI_DOCUMENT_PARALLELISM", "4"))
 
 
 # Define Metadata and Document schemas
@@ -26,8 +76,278 @@ class Document(BaseModel):
 
 class LanceSchema(LanceModel):
     id: str
-    vector: Vector(1536)
+    vector: Vector(1536, value_type=STORAGE_DTYPES[SEARCHABLE_STORAGE_DTYPE])
     payload: Document
+    # Copy of payload.meta.doc_id, as a top-level column it can be indexed and used as a prefilter
+    doc_id: str
+
+
+NODES_SCHEMA = LanceSchema.to_arrow_schema()
+
+
+def _normalize_rows(embeddings, dtype=np.float32):
+    # The graph edges are computed in float64 (see `compute_similarity_edges`), the searches in float32
+    matrix = np.asarray(embeddings, dtype=dtype)
+    norms = np.sqrt(np.einsum("ij,ij->i", matrix, matrix))[:, np.newaxis]
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _exact_similarity_edges(normalized, threshold, block_size):
+    """
+    Finds every pair (i < j) whose cosine similarity is greater than the threshold.
+
+    The similarity matrix is computed one block_size x block_size tile at a time, and only the tiles
+    on or above the diagonal, so memory stays bounded whatever the number of chunks.
+    """
+    n = len(normalized)
+    rows, cols, weights = [], [], []
+    for i_start in range(0, n, block_size):
+        block_i = normalized[i_start : i_start + block_size]
+        for j_start in range(i_start, n, block_size):
+            sims = block_i @ normalized[j_start : j_start + block_size].T
+            mask = sims > threshold
+            if i_start == j_start:
+                # Diagonal tile: keep the strict upper triangle only (j > i)
+                mask = np.triu(mask, k=1)
+            local_i, local_j = np.nonzero(mask)
+            rows.append(local_i + i_start)
+            cols.append(local_j + j_start)
+            weights.append(sims[local_i, local_j])
+    if not rows:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(weights)
+
+
+def _approximate_top_k_edges(normalized, threshold, top_k, n_probe=4, n_iter=5, seed=0):
+    """
+    Finds, for every chunk, up to top_k neighbours whose similarity is greater than the threshold,
+    without computing the full similarity matrix.
+
+    The chunks are clustered with a few iterations of spherical k-means (sqrt(n) clusters). Each cluster
+    is then only compared with the members of its n_probe closest clusters, which brings the work down
+    from O(n²) to about O(n * n_probe * sqrt(n)). Pairs that fall in clusters that are not probed are missed,
+    hence "approximate".
+    """
+    n = len(normalized)
+    n_lists = max(1, int(np.sqrt(n)))
+    rng = np.random.default_rng(seed)
+
+    # Step 1: Spherical k-means to partition the chunks
+    centroids = normalized[rng.choice(n, n_lists, replace=False)]
+    for _ in range(n_iter):
+        assignment = np.argmax(normalized @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, normalized)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # Keep the previous centroid of clusters that ended up empty
+        centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+    assignment = np.argmax(normalized @ centroids.T, axis=1)
+    members = [np.flatnonzero(assignment == c) for c in range(n_lists)]
+
+    # Step 2: Compare each cluster with its closest clusters only
+    n_probe = min(n_probe, n_lists)
+    closest = np.argsort(-(centroids @ centroids.T), axis=1)[:, :n_probe]
+    rows, cols, weights = [], [], []
+    for c in range(n_lists):
+        queries = members[c]
+        if len(queries) == 0:
+            continue
+        candidates = np.concatenate([members[p] for p in closest[c]])
+        sims = normalized[queries] @ normalized[candidates].T
+        sims[queries[:, None] == candidates[None, :]] = -np.inf  # no self-loops
+        k = min(top_k, len(candidates))
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        local_i, local_k = np.nonzero(top_sims > threshold)
+        rows.append(queries[local_i])
+        cols.append(candidates[top[local_i, local_k]])
+        weights.append(top_sims[local_i, local_k])
+    if not rows:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+
+    # Step 3: Store each undirected edge once, as (min, max)
+    rows, cols, weights = np.concatenate(rows), np.concatenate(cols), np.concatenate(weights)
+    pairs = np.stack([np.minimum(rows, cols), np.maximum(rows, cols)], axis=1)
+    pairs, first = np.unique(pairs, axis=0, return_index=True)
+    return pairs[:, 0], pairs[:, 1], weights[first]
+
+
+def compute_similarity_edges(
+    embeddings,
+    threshold: float = GRAPH_SIMILARITY_THRESHOLD,
+    block_size: int = GRAPH_BLOCK_SIZE,
+    top_k: int = None,
+):
+    """
+    Computes the edges of the similarity graph between chunks.
+
+    Parameters:
+    embeddings (list or np.ndarray): The embedding vectors of the chunks, one per row.
+    threshold (float): Only pairs with a cosine similarity greater than this are linked.
+    block_size (int): Tile size used to bound the memory of the exact mode.
+    top_k (int): If set, use the approximate mode that keeps at most top_k neighbours per chunk.
+    By default, the exact mode is used up to GRAPH_APPROXIMATE_MIN_CHUNKS chunks.
+
+    Returns:
+    tuple: Three arrays (rows, cols, weights), with rows < cols, describing the edges.
+    """
+    if len(embeddings) < 2:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+    if top_k is None and len(embeddings) > GRAPH_APPROXIMATE_MIN_CHUNKS:
+        top_k = GRAPH_TOP_K
+    if top_k:
+        return _approximate_top_k_edges(_normalize_rows(embeddings), threshold, top_k)
+    # In float64 like sklearn's cosine_similarity, so that the pairs close to the threshold are linked the
+    # same way. Tiling keeps the memory bounded, the matrix products take about twice as long as in float32.
+    return _exact_similarity_edges(_normalize_rows(embeddings, np.float64), threshold, block_size)
+
+
+_migrated = False
+
+
+def open_nodes_table():
+    """
+    Opens the table of the chunks, adding the top-level doc_id column to tables created without it.
+    """
+    global _migrated
+    table = get_db().open_table(NODES_TABLE)
+    if not _migrated:
+        ensure_doc_id_column(table)
+        _migrated = True
+    return table
+
+
+def nodes_record_batch(doc_id, texts, matrix, nodes=None):
+    """
+    Builds the rows of a document's chunks as a single Arrow RecordBatch, in the schema of LanceSchema.
+
+    The vector column is built from the float32 embedding matrix in one conversion (to the storage type,
+    see `utils.vector_storage`), and no per-row pydantic model is created.
+
+    Parameters:
+    doc_id (str): The identifier for the document.
+    texts (list): The text of the chunks.
+    matrix (np.ndarray): The embeddings of the chunks, one row per chunk.
+    nodes (list): The chunk index of each chunk, 0 to n - 1 by default.
+
+    Returns:
+    pa.RecordBatch: One row per chunk.
+    """
+    n = len(texts)
+    vectors, _ = vectors_to_arrow(matrix, SEARCHABLE_STORAGE_DTYPE)
+    doc_ids = pa.array([doc_id] * n, pa.string())
+    meta = pa.StructArray.from_arrays(
+        [
+            doc_ids,
+            pa.array(["source_example"] * n, pa.string()),
+            pa.array([datetime.now()] * n, pa.timestamp("us")),
+        ],
+        fields=list(NODES_SCHEMA.field("payload").type.field("meta").type),
+    )
+    payload = pa.StructArray.from_arrays(
+        [pa.array(texts, pa.string()), meta],
+        fields=list(NODES_SCHEMA.field("payload").type),
+    )
+    # The chunk index in the node ID maps the row to its node in the persisted graph
+    ids = pa.array([f"{doc_id}_node_{idx}" for idx in (range(n) if nodes is None else nodes)], pa.string())
+    return pa.RecordBatch.from_arrays([ids, vectors, payload, doc_ids], schema=NODES_SCHEMA)
+
+
+# Held while creating the table, so that concurrent ingestion jobs don't both try to create it
+_create_lock = threading.Lock()
+
+
+def _write_nodes(batch):
+    # A RecordBatch, or a Table of several of them written as one table version
+    data = batch if isinstance(batch, pa.Table) else pa.Table.from_batches([batch])
+    with span("lancedb.write", rows=data.num_rows):
+        if NODES_TABLE not in get_db().table_names():
+            with _create_lock:
+                if NODES_TABLE not in get_db().table_names():
+                    get_db().create_table(NODES_TABLE, data=data, schema=NODES_SCHEMA)
+                    return
+        tbl = open_nodes_table()
+        tbl.add(data.cast(tbl.schema))
+
+
+def store_graph_nodes(doc_id, chunks):
+    """
+    Store the chunks of a document as nodes (documents with metadata) in LanceDB.
+
+    This is the only copy of the chunks and their embeddings, written in one columnar batch
+    (see `nodes_record_batch`).
+
+    Parameters:
+    doc_id (str): The identifier for the document.
+    chunks (EmbeddedChunks): The text chunks and their embeddings (see `create_embeddings`).
+    """
+    # Step 1 : Prepare data for LanceDB
+    batch = nodes_record_batch(doc_id, chunks.texts, chunks.vectors)
+
+    # Step 2 : Create table in LanceDB if not exists and add data
+    _write_nodes(batch)
+    print(f"Inserted {batch.num_rows} nodes of document {doc_id} into '{NODES_TABLE}'.")
+
+    # Step 3 : Index the text of the chunks for lexical search, and keep their vectors in memory
+    with span("lexical.index"):
+        save_lexical_index(doc_id, BM25Index.from_texts(chunks.texts))
+    document_vectors.put(doc_id, DocumentVectors(np.arange(len(chunks)), chunks.vectors, chunks.texts))
+
+    # Step 4 : Create or update the indexes in the background
+    schedule_index_maintenance(open_nodes_table)
+
+
+def replace_documents_nodes(doc_ids, batches):
+    """
+    Replaces the stored chunks of several documents with new rows (see `nodes_record_batch`), with one
+    delete and one write for all of them instead of a new table version per document, e.g. when
+    restoring snapshots.
+
+    Parameters:
+    doc_ids (list): The documents whose stored chunks are deleted.
+    batches (list): The rows of their chunks, RecordBatches in the schema of LanceSchema.
+    """
+    if NODES_TABLE in get_db().table_names():
+        ids = ", ".join(f"'{doc_id}'" for doc_id in doc_ids)
+        with span("lancedb.delete", documents=len(doc_ids)):
+            open_nodes_table().delete(f"doc_id IN ({ids})")
+    data = pa.Table.from_batches(batches, schema=NODES_SCHEMA)
+    _write_nodes(data)
+    print(f"Inserted {data.num_rows} nodes of {len(doc_ids)} documents into '{NODES_TABLE}'.")
+
+
+def build_graph(doc_id, chunks):
+    """
+    Build a graph based on cosine similarity of embeddings and persist its edges.
+
+    - Nodes represent chunks of text, associated with a document ID, text, and an embedding.
+    - Edges link the chunks whose cosine similarity exceeds a threshold. The similarities are computed
+      as a tiled matrix product (see `compute_similarity_edges`).
+    - The edges are persisted as a CSR adjacency (see `utils.graph_store`), used by graph-expanded retrieval.
+
+    Parameters:
+    doc_id (str): The identifier for the document.
+    chunks (EmbeddedChunks): The text chunks and their embeddings (see `create_embeddings`).
+
+    Returns:
+    graph (networkx.Graph): A graph representing the document with nodes and edges based on cosine similarity.
+    """
+    import networkx as nx
+
+    # Step 1 : Initialize the graph (the node embeddings are views of the document's matrix)
+    graph = nx.Graph()
+    for idx, (text, embedding) in enumerate(chunks):
+        graph.add_node(idx, doc_id=doc_id, text=text, embedding=embedding)
+
+    # Step 2 : Add edges based on cosine similarity of embeddings
+    rows, cols, weights = compute_similarity_edges(chunks.vectors)
+    graph.add_weighted_edges_from(zip(rows.tolist(), cols.tolist(), weights.tolist()))
+
+    # Step 3 : Persist the edges so that retrieval can follow them
+    save_graph(doc_id, CSRGraph.from_edges(len(chunks), rows, cols, weights))
+
+    return graph
 
 
 def build_graph_and_store(doc_id, chunks):
@@ -35,132 +355,945 @@ def build_graph_and_store(doc_id, chunks):
     Build a graph based on cosine similarity of embeddings and store nodes as documents in LanceDB.
 
     This function:
-    - Creates a graph structure where nodes represent chunks of text.
-    - Each node is associated with a document ID, text, and an embedding.
-    - The function stores this data in a LanceDB table as documents with metadata.
-    - The graph is built by calculating cosine similarity between the embeddings of each pair of chunks and adding edges if the similarity exceeds a threshold.
-    - The table containing nodes and edges is created or updated in the LanceDB.
+    - Stores the chunks in a LanceDB table as documents with metadata (see `store_graph_nodes`).
+    - Builds the similarity graph of the chunks and persists its edges (see `build_graph`).
 
     Parameters:
     doc_id (str): The identifier for the document.
-    chunks (list): A list of tuples containing text chunks and their corresponding embeddings.
+    chunks (EmbeddedChunks): The text chunks and their embeddings (see `create_embeddings`).
 
     Returns:
     graph (networkx.Graph): A graph representing the document with nodes and edges based on cosine similarity.
     """
-    # Step 1 : Initialize the graph
-    graph = nx.Graph()
+    store_graph_nodes(doc_id, chunks)
+    return build_graph(doc_id, chunks)
 
-    # Step 2 : Prepare data for LanceDB
-    data = []
-    for idx, (text, embedding) in enumerate(chunks):
-        timestamp = datetime.now()
-        node_id = f"{doc_id}_node_{idx}_{timestamp}"
 
-        timestamp = datetime.now()
-        graph.add_node(idx, doc_id=doc_id, text=text, embedding=embedding)
+# --- Incremental update of a revised document ---------------------------------------------------------
+
+
+def chunk_hash(text: str) -> str:
+    """
+    Returns the content address of a chunk's text, used to match the chunks of a revised document
+    with the stored ones. Texts differing only in unicode form or whitespace have the same hash.
+    """
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def _texts_by_node(nodes, texts) -> list:
+    # The texts indexed by chunk index, with "" for the indices that have no chunk
+    by_node = [""] * (int(max(nodes)) + 1 if len(nodes) else 0)
+    for node, text in zip(nodes, texts):
+        by_node[node] = text
+    return by_node
+
+
+class ChunkDiff:
+    """
+    The changes between the stored chunks of a document and the chunks of its new version.
 
-        # Create LanceDB-compatible data entries
-        document_entry = LanceSchema(
-            id=node_id,
-            vector=np.array(embedding),
-            payload=Document(
-                content=text,
-                meta=Metadata(
-                    doc_id=doc_id, source="source_example", timestamp=timestamp
-                ),
-            ),
+    - texts, nodes: the new chunks, in document order, and their chunk index. An unchanged chunk keeps
+      the index it had, so its row, vector and graph node are kept as they are; added chunks get new
+      indices after the largest one.
+    - added: the positions in `texts` of the chunks that are not stored yet.
+    - removed: the chunk indices of the stored chunks that are no longer in the document.
+    - removed_ids: the IDs of their rows. A legacy document stored twice has two rows per chunk index,
+      which may be matched separately, so the rows are deleted by ID and never by chunk index.
+    - vectors: the embeddings of the new chunks, one row per position. The rows of the added chunks are
+      zeros until they are embedded.
+    """
+
+    def __init__(self, texts, nodes, added, removed, vectors, removed_ids=()):
+        self.texts = texts
+        self.nodes = nodes
+        self.added = added
+        self.removed = removed
+        self.vectors = vectors
+        self.removed_ids = list(removed_ids)
+
+    @property
+    def added_nodes(self):
+        return self.nodes[self.added]
+
+    def summary(self) -> dict:
+        return {
+            "chunks": len(self.texts),
+            "added": len(self.added),
+            "removed": len(self.removed),
+            "unchanged": len(self.texts) - len(self.added),
+        }
+
+
+def diff_document_chunks(doc_id: str, texts) -> ChunkDiff:
+    """
+    Compares the new chunks of a document with its stored chunks, by hash of their text (see `chunk_hash`).
+    A chunk repeated in the document is matched as many times as it is stored. A document that isn't
+    stored yet has only added chunks.
+
+    Parameters:
+    doc_id (str): The identifier for the document.
+    texts (list): The text of the new chunks, in document order.
+
+    Returns:
+    ChunkDiff: The diff, with the stored vectors of the unchanged chunks.
+    """
+    texts = list(texts)
+    vectors = np.zeros((len(texts), EMBEDDING_DIMENSIONS), dtype=np.float32)
+
+    # Step 1: Read the stored chunks of the document, grouped by hash
+    stored, stored_ids, stored_vectors, max_node = {}, [], None, -1
+    if NODES_TABLE in get_db().table_names():
+        rows = (
+            open_nodes_table()
+            .search()
+            .where(f"doc_id = '{doc_id}'")
+            .select(["id", "vector", "payload"])
+            .limit(None)
+            .to_arrow()
         )
-        data.append(document_entry)
+        stored_vectors = vectors_from_arrow(rows["vector"])
+        stored_ids = rows["id"].to_pylist()
+        for row, (node_id, payload) in enumerate(zip(stored_ids, rows["payload"].to_pylist())):
+            node = node_index(node_id)
+            stored.setdefault(chunk_hash(payload.get("content") or ""), deque()).append((node, row))
+            max_node = max(max_node, node)
+
+    # Step 2: Match each new chunk with a stored chunk of the same text, if there is one left
+    nodes = np.empty(len(texts), dtype=np.int64)
+    added = []
+    for position, text in enumerate(texts):
+        matches = stored.get(chunk_hash(text))
+        if matches:
+            nodes[position], row = matches.popleft()
+            vectors[position] = stored_vectors[row]
+        else:
+            added.append(position)
+    added = np.asarray(added, dtype=np.int64)
+    nodes[added] = np.arange(max_node + 1, max_node + 1 + len(added))
+
+    # Step 3: The stored rows that were not matched are removed
+    unmatched = sorted(match for matches in stored.values() for match in matches)
+    removed = np.asarray([node for node, _ in unmatched], dtype=np.int64)
+    return ChunkDiff(texts, nodes, added, removed, vectors, removed_ids=[stored_ids[row] for _, row in unmatched])
+
+
+def apply_chunk_diff(doc_id: str, diff: ChunkDiff):
+    """
+    Updates the stored chunks of a document: deletes the rows of the removed chunks and inserts the added
+    ones (whose vectors must be filled in), leaving the unchanged rows untouched. The lexical index and
+    the hot vector cache of the document are rebuilt from the new chunks, which doesn't call any API.
 
-    # Step 3 : Create table in LanceDB if not exists and add data
-    table_name = "document_graph_nodes"
-    if table_name not in db.table_names():
-        tbl = db.create_table(table_name, data=data)
+    Parameters:
+    doc_id (str): The identifier for the document.
+    diff (ChunkDiff): The diff computed by `diff_document_chunks`, with the vectors of the added chunks.
+    """
+    # Step 1: Delete the rows that were not matched, by ID
+    if diff.removed_ids:
+        ids = ", ".join(f"'{node_id}'" for node_id in diff.removed_ids)
+        with span("lancedb.delete", rows=len(diff.removed_ids)):
+            open_nodes_table().delete(f"id IN ({ids})")
+
+    # Step 2: Insert the rows of the added chunks
+    if len(diff.added):
+        _write_nodes(
+            nodes_record_batch(
+                doc_id, [diff.texts[p] for p in diff.added], diff.vectors[diff.added], nodes=diff.added_nodes
+            )
+        )
+    print(f"Updated document {doc_id} in '{NODES_TABLE}': {diff.summary()}.")
+
+    # Step 3: Index the text of the new version, and keep its vectors in memory
+    with span("lexical.index"):
+        save_lexical_index(doc_id, BM25Index.from_texts(_texts_by_node(diff.nodes, diff.texts)))
+    document_vectors.put(doc_id, DocumentVectors(diff.nodes, diff.vectors, diff.texts))
+
+    # Step 4: Update the indexes in the background (deleted rows are dropped from them when they are optimized)
+    schedule_index_maintenance(open_nodes_table)
+
+
+def _similarity_edges_from(normalized, sources, threshold, block_size):
+    """
+    Finds the pairs (source, j) whose cosine similarity is greater than the threshold, for the given source
+    rows against all the rows, tile by tile. A pair of two sources is returned once.
+    """
+    is_source = np.zeros(len(normalized), dtype=bool)
+    is_source[sources] = True
+    rows, cols, weights = [], [], []
+    for i_start in range(0, len(sources), block_size):
+        block = sources[i_start : i_start + block_size]
+        for j_start in range(0, len(normalized), block_size):
+            sims = normalized[block] @ normalized[j_start : j_start + block_size].T
+            targets = np.arange(j_start, j_start + sims.shape[1])
+            # No self-loops, and an edge between two sources only from the smaller one
+            mask = (sims > threshold) & ~(is_source[targets][None, :] & (targets[None, :] <= block[:, None]))
+            local_i, local_j = np.nonzero(mask)
+            rows.append(block[local_i])
+            cols.append(targets[local_j])
+            weights.append(sims[local_i, local_j])
+    if not rows:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(weights)
+
+
+def update_graph(
+    doc_id: str, diff: ChunkDiff, threshold: float = GRAPH_SIMILARITY_THRESHOLD, block_size: int = GRAPH_BLOCK_SIZE
+):
+    """
+    Patches the persisted graph of a document after `apply_chunk_diff`: the edges of the removed chunks
+    are dropped, the edges between unchanged chunks are kept as they are, and only the added chunks are
+    compared with the others (len(added) x len(chunks) similarities instead of len(chunks)²).
+    Documents without a stored graph get a full build.
+
+    Returns:
+    CSRGraph: The updated graph.
+    """
+    n_nodes = int(diff.nodes.max()) + 1 if len(diff.nodes) else 0
+    graph = load_graph(doc_id)
+    if graph is None:
+        rows, cols, weights = compute_similarity_edges(diff.vectors, threshold=threshold, block_size=block_size)
+        rows, cols = diff.nodes[rows], diff.nodes[cols]
     else:
-        tbl = db.open_table(table_name)
-        tbl.add(data)
-        print("Table after inserting new document:")
-        print(tbl.to_pandas().to_string())  # Ensure it actually exists
-
-    # Step 4 : Add edges based on cosine similarity of embeddings
-    for i in range(len(chunks)):
-        for j in range(i + 1, len(chunks)):
-            embedding_i = np.array(chunks[i][1]).reshape(1, -1)
-            embedding_j = np.array(chunks[j][1]).reshape(1, -1)
-            similarity = cosine_similarity(embedding_i, embedding_j)[0][0]
-
-            if (
-                similarity > 0.7
-            ):  # Adjust the threshold as needed : only add relation if similarity is greater than 0.7 (70% similarity)
-                graph.add_edge(i, j, weight=similarity)
+        # Step 1: Keep the stored edges whose both ends are unchanged chunks
+        unchanged = np.zeros(max(n_nodes, graph.n_nodes), dtype=bool)
+        unchanged[diff.nodes] = True
+        unchanged[diff.added_nodes] = False
+        sources = np.repeat(np.arange(graph.n_nodes), np.diff(np.asarray(graph.indptr)))
+        targets = np.asarray(graph.indices, dtype=np.int64)
+        keep = (sources < targets) & unchanged[sources] & unchanged[targets]
+        kept = (sources[keep], targets[keep], np.asarray(graph.weights)[keep])
+
+        # Step 2: Link the added chunks to the chunks they are similar to
+        rows, cols, weights = _similarity_edges_from(
+            _normalize_rows(diff.vectors, np.float64), diff.added, threshold, block_size
+        )
+        rows = np.concatenate([kept[0], diff.nodes[rows]])
+        cols = np.concatenate([kept[1], diff.nodes[cols]])
+        weights = np.concatenate([kept[2], weights])
 
+    graph = CSRGraph.from_edges(n_nodes, rows, cols, weights)
+    save_graph(doc_id, graph)
     return graph
 
 
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
+def node_index(node_id: str) -> int:
+    """
+    Returns the index of a chunk in its document (and in the document's graph) from its node ID.
+    """
+    return int(node_id.split("_node_")[1].split("_")[0])
 
 
-def retrieve_relevant_chunks_from_db(doc_id: str, query: str, top_k: int = 3):
+def node_document(node_id: str) -> str:
     """
-    Retrieve the most relevant document chunks from the database based on a query embedding,
-    manually calculating the cosine similarity between the query and each chunk.
+    Returns the document of a chunk from its node ID.
     """
-    try:
-        table_name = "document_graph_nodes"
-        table = db.open_table(table_name)
-
-        # Step 1: Generate embedding for the query
-        query_embedding = get_query_embedding(query)
-
-        # Step 2: Retrieve document chunks
-        results = (
-            table.search(query_embedding)
-            .where(f"payload['meta']['doc_id'] = '{doc_id}'")  # Filter by doc_id
-            .limit(top_k * 2)  # Fetch extra results to filter empty content
-            .to_list()
+    return node_id.rsplit("_node_", 1)[0]
+
+
+def stored_node_ids(table, doc_id: str, nodes) -> dict:
+    """
+    Returns the IDs of the stored rows of some chunks of a document, by chunk index.
+
+    The IDs are read rather than built from the chunk index: rows written before node IDs were
+    `{doc_id}_node_{n}` have IDs of the form `{doc_id}_node_{n}_{timestamp}`.
+
+    Returns:
+    dict: The list of row IDs of each chunk found (a list, as a legacy document may have been stored twice).
+    """
+    wanted = {int(node) for node in nodes}
+    rows = table.search().where(f"doc_id = '{doc_id}'").select(["id"]).limit(None).to_arrow()
+    ids = {}
+    for node_id in rows["id"].to_pylist():
+        node = node_index(node_id)
+        if node in wanted:
+            ids.setdefault(node, []).append(node_id)
+    return ids
+
+
+def expand_with_graph(
+    table,
+    doc_id: str,
+    chunks: list,
+    hops: int = 1,
+    limit: int = 10,
+    budget_ms: float = GRAPH_EXPANSION_BUDGET_MS,
+    document: DocumentVectors = None,
+):
+    """
+    Expands vector search hits with their k-hop neighbours in the document's similarity graph.
+
+    The score of a hit propagates to its neighbours as score * edge similarity * GRAPH_HOP_DECAY, and a node
+    keeps the best score it receives. The expansion stops when its time budget is spent, so it only adds a
+    bounded amount of latency; whatever was found so far is returned.
+
+    Parameters:
+    table: The LanceDB table holding the document's chunks.
+    doc_id (str): The identifier for the document.
+    chunks (list): The vector search hits, dicts with "node_id", "text" and "similarity".
+    hops (int): The maximum number of hops followed from each hit.
+    limit (int): The maximum number of neighbours added to the hits.
+    budget_ms (float): The time budget of the expansion, in milliseconds.
+    document (DocumentVectors): The document's chunks if they are in memory, to read the neighbours' text from.
+
+    Returns:
+    list: The hits and their neighbours, with a "hop" field (0 for the vector hits).
+    """
+    deadline = time.perf_counter() + budget_ms / 1000
+    graph = load_graph(doc_id)
+    if graph is None or not chunks:
+        return chunks
+
+    # Step 1: Propagate the scores hop by hop, best nodes first
+    scores = {node_index(chunk["node_id"]): chunk["similarity"] for chunk in chunks}
+    hop_of = dict.fromkeys(scores, 0)
+    frontier = dict(scores)
+    for hop in range(1, hops + 1):
+        next_frontier = {}
+        for node, score in sorted(frontier.items(), key=lambda item: -item[1]):
+            if time.perf_counter() > deadline:
+                break
+            neighbours, weights = graph.neighbours(node)
+            for neighbour, weight in zip(neighbours.tolist(), weights.tolist()):
+                propagated = score * weight * GRAPH_HOP_DECAY
+                if propagated > scores.get(neighbour, 0.0):
+                    scores[neighbour] = propagated
+                    hop_of.setdefault(neighbour, hop)
+                    next_frontier[neighbour] = propagated
+        frontier = next_frontier
+        if not frontier or time.perf_counter() > deadline:
+            break
+
+    # Step 2: Update the scores of the hits that were reached through a better neighbour
+    for chunk in chunks:
+        chunk["similarity"] = max(chunk["similarity"], scores[node_index(chunk["node_id"])])
+        chunk["hop"] = 0
+
+    # Step 3: Fetch the text of the best new neighbours
+    known = {node_index(chunk["node_id"]) for chunk in chunks}
+    new_nodes = sorted(
+        (node for node in scores if node not in known), key=lambda node: -scores[node]
+    )[:limit]
+    if not new_nodes or time.perf_counter() > deadline:
+        return chunks
+    for node, content in fetch_chunk_texts(table, doc_id, new_nodes, document).items():
+        chunks.append(
+            {
+                "node_id": f"{doc_id}_node_{node}",
+                "text": content,
+                "similarity": scores[node],
+                "hop": hop_of[node],
+            }
         )
+    return chunks
 
-        # Step 3: Calculate cosine similarity for each result and store it
-        relevant_chunks = []
-        for row in results:
-            content = (
-                row["payload"].get("content", "").strip()
-            )  # Get content if available
-            if content:
-                # Retrieve the embedding for the current chunk
-                chunk_embedding = np.array(row["vector"])
 
-                # Calculate cosine similarity
-                similarity = cosine_similarity([query_embedding], [chunk_embedding])[0][
-                    0
-                ]
+def fetch_chunk_texts(table, doc_id: str, nodes, document: DocumentVectors = None) -> dict:
+    """
+    Returns the non-empty text of some chunks of a document, by chunk index. The texts are read from
+    `document` when the document's chunks are in memory, from LanceDB otherwise.
+    """
+    if not nodes:
+        return {}
+    if document is not None:
+        texts = {node: document.text(node) for node in nodes}
+        return {node: text for node, text in texts.items() if text}
+
+    def read(ids):
+        rows = table.search().where(f"id IN ({ids})").select(["id", "payload"]).limit(None).to_list()
+        return {node_index(row["id"]): (row["payload"].get("content") or "").strip() for row in rows}
+
+    # Rows are looked up by their ID, and the chunks not found (stored with a legacy ID, see
+    # `stored_node_ids`) by the IDs actually stored for them
+    texts = read(", ".join(f"'{doc_id}_node_{node}'" for node in nodes))
+    missing = [node for node in nodes if node not in texts]
+    if missing:
+        legacy = stored_node_ids(table, doc_id, missing)
+        if legacy:
+            texts.update(read(", ".join(f"'{node_id}'" for node_ids in legacy.values() for node_id in node_ids)))
+    return {node: text for node, text in texts.items() if text}
+
+
+def get_lexical_index(table, doc_id: str):
+    """
+    Returns the lexical index of a document. Documents ingested before lexical search existed
+    are indexed on first use, from the chunks stored in LanceDB.
+    """
+    index = load_lexical_index(doc_id)
+    if index is None:
+        rows = table.search().where(f"doc_id = '{doc_id}'").select(["id", "payload"]).limit(None).to_arrow()
+        if rows.num_rows == 0:
+            return None
+        nodes = [node_index(node_id) for node_id in rows["id"].to_pylist()]
+        texts = [payload["content"] for payload in rows["payload"].to_pylist()]
+        index = BM25Index.from_texts(_texts_by_node(nodes, texts))
+        save_lexical_index(doc_id, index)
+    return index
+
+
+def reciprocal_rank_fusion(*rankings, k: int = RRF_K) -> dict:
+    """
+    Merges rankings (lists of items, best first) with reciprocal-rank fusion: an item scores
+    the sum of 1 / (k + rank) over the rankings it appears in.
+
+    Returns:
+    dict: The fused score of each item.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return scores
+
+
+def _lexical_chunks(table, doc_id: str, query: str, limit: int, document: DocumentVectors = None) -> list:
+    index = get_lexical_index(table, doc_id)
+    if index is None:
+        return []
+    hits = index.search(query, limit)
+    texts = fetch_chunk_texts(table, doc_id, [node for node, _ in hits], document)
+    return [
+        {"node_id": f"{doc_id}_node_{node}", "text": texts[node], "similarity": score}
+        for node, score in hits
+        if node in texts
+    ]
+
+
+def _hybrid_chunks(
+    table, doc_id: str, query: str, vector_chunks: list, limit: int, document: DocumentVectors = None
+) -> list:
+    lexical_chunks = _lexical_chunks(table, doc_id, query, limit, document)
+    # Lexical ranking first: on equal fused scores, the stable sort keeps exact term matches first
+    fused = reciprocal_rank_fusion(
+        [chunk["node_id"] for chunk in lexical_chunks], [chunk["node_id"] for chunk in vector_chunks]
+    )
+    chunks = {chunk["node_id"]: chunk for chunk in lexical_chunks + vector_chunks}
+    return [{**chunks[node_id], "similarity": score} for node_id, score in fused.items()]
+
+
+def load_document_vectors(table, doc_id: str):
+    """
+    Reads the vectors of all the chunks of a document.
+
+    Returns:
+    tuple: The chunk indices (np.ndarray) and the unit-normalized float32 vectors, one row per chunk.
+    """
+    rows = table.search().where(f"doc_id = '{doc_id}'").select(["id", "vector"]).limit(None).to_arrow()
+    nodes = np.fromiter((node_index(node_id) for node_id in rows["id"].to_pylist()), dtype=np.int64, count=rows.num_rows)
+    return nodes, _normalize_rows(vectors_from_arrow(rows["vector"]))
+
+
+def get_document_vectors(table, doc_id: str):
+    """
+    Returns the chunks of a document held in memory (see `utils.vector_cache`), reading them from
+    LanceDB on a cache miss.
+
+    Returns:
+    DocumentVectors or None: None if the document has no chunks, or is too large for the cache, in which
+    case the caller searches LanceDB instead.
+    """
+    document = document_vectors.get(doc_id)
+    if document is not None:
+        return document
+
+    # Don't read a document that the cache would refuse anyway (float32 vector + chunk index per row)
+    n_rows = table.count_rows(f"doc_id = '{doc_id}'")
+    if n_rows == 0 or n_rows * (EMBEDDING_DIMENSIONS * 4 + 8) > document_vectors.max_bytes:
+        return None
+    with span("retrieve.load_document", rows=n_rows):
+        rows = (
+            table.search()
+            .where(f"doc_id = '{doc_id}'")
+            .select(["id", "vector", "payload"])
+            .limit(None)
+            .to_arrow()
+        )
+        document = DocumentVectors(
+            [node_index(node_id) for node_id in rows["id"].to_pylist()],
+            vectors_from_arrow(rows["vector"]),
+            [payload.get("content") or "" for payload in rows["payload"].to_pylist()],
+        )
+    document_vectors.put(doc_id, document)
+    return document
+
+
+def search_relevant_chunks(
+    doc_id: str,
+    query_embedding,
+    top_k: int = 3,
+    mode: RetrievalMode = "vector",
+    hops: int = 1,
+    query: str = None,
+    table=None,
+):
+    """
+    Search the chunks of a document relevant to a query (blocking). The chunks are scored in memory
+    with the document's cached vectors (see `get_document_vectors`), or with the LanceDB search when
+    the document is too large for the cache, where the similarity of a chunk is 1 - its cosine distance.
 
+    With mode="graph", the vector hits are expanded by their neighbours in the document's
+    similarity graph (see `expand_with_graph`) before keeping the top_k chunks.
+    With mode="lexical", the chunks are ranked by the BM25 score of the query text instead, and
+    query_embedding is not used. With mode="hybrid", the vector and BM25 candidates are merged with
+    reciprocal-rank fusion. In these two modes, "similarity" holds the BM25 or fused score.
+
+    `table` is the opened chunks table, when the caller searches several documents.
+    """
+    if table is None:
+        table = open_nodes_table()
+    limit = max(top_k * 2, HYBRID_CANDIDATES) if mode == "hybrid" else top_k * 2
+
+    # Step 1: Retrieve document chunks, from memory when the document is in the hot vector cache.
+    # The lexical mode only needs the texts, so it doesn't load the vectors of a document.
+    document = get_document_vectors(table, doc_id) if mode != "lexical" else document_vectors.get(doc_id)
+    relevant_chunks = []
+    if mode != "lexical" and document is not None:
+        with span("retrieve.vector", source="memory"):
+            relevant_chunks = [
+                {"node_id": f"{doc_id}_node_{node}", "text": text, "similarity": similarity}
+                for node, text, similarity in document.top_k(query_embedding, limit)
+            ]
+    elif mode != "lexical":
+        results = vector_search(
+            table, query_embedding, doc_id, limit, columns=["id", "payload"]
+        )  # Fetch extra results to filter empty content
+
+        # Step 2: Convert the cosine distance of each result to a similarity
+        for row in results:
+            content = row["payload"].get("content", "").strip()  # Get content if available
+            if content:
                 relevant_chunks.append(
                     {
                         "node_id": row["id"],
                         "text": content,
-                        "similarity": similarity,  # Store similarity
+                        "similarity": 1.0 - row["_distance"],  # Store similarity
                     }
                 )
 
-        # Step 4: Sort the results by similarity in descending order
-        relevant_chunks.sort(key=lambda x: x["similarity"], reverse=True)
+    # Step 3: Add the graph neighbours of the hits, or the lexical matches
+    if mode == "graph":
+        with span("retrieve.graph", hops=hops):
+            relevant_chunks = expand_with_graph(
+                table, doc_id, relevant_chunks, hops=hops, limit=top_k * 2, document=document
+            )
+    elif mode == "lexical":
+        with span("retrieve.lexical"):
+            relevant_chunks = _lexical_chunks(table, doc_id, query, limit, document)
+    elif mode == "hybrid":
+        with span("retrieve.hybrid"):
+            relevant_chunks = _hybrid_chunks(table, doc_id, query, relevant_chunks, limit, document)
 
-        # Limit the number of top_k results
-        relevant_chunks = relevant_chunks[:top_k]
+    # Step 4: Sort the results by similarity in descending order
+    relevant_chunks.sort(key=lambda x: x["similarity"], reverse=True)
 
-        # Step 5: Handle case if no relevant chunks were found
-        if not relevant_chunks:
-            raise HTTPException(
-                status_code=404,
-                detail=f"No valid chunks found for document ID: {doc_id}",
-            )
+    # Limit the number of top_k results
+    relevant_chunks = relevant_chunks[:top_k]
+
+    # Step 5: Handle case if no relevant chunks were found
+    if not relevant_chunks:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No valid chunks found for document ID: {doc_id}",
+        )
+
+    return relevant_chunks
 
-        return relevant_chunks
+
+async def retrieve_relevant_chunks_from_db_async(
+    doc_id: str, query: str, top_k: int = 3, mode: RetrievalMode = "vector", hops: int = 1
+):
+    """
+    Retrieve the most relevant document chunks from the database based on a query, see
+    `search_relevant_chunks`. The query embedding uses the async OpenAI client and the search runs in
+    the LanceDB thread pool, so the request handlers don't block the event loop.
+    """
+    try:
+        # Step 1: Generate embedding for the query (the lexical mode doesn't need it)
+        query_embedding = await get_query_embedding_async(query) if mode != "lexical" else None
+        # None when the embedding failed, which the search can't use
+        if mode != "lexical" and query_embedding is None:
+            raise ValueError("the query could not be embedded")
+
+        # Step 2: Search the closest chunks without blocking the event loop
+        async with upstream_limit("lancedb"):
+            with span("retrieve.search", mode=mode):
+                return await run_blocking(
+                    search_relevant_chunks,
+                    doc_id,
+                    query_embedding,
+                    top_k,
+                    mode,
+                    hops,
+                    query,
+                    executor=lancedb_pool,
+                )
 
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error retrieving relevant chunks: {str(e)}"
         )
+
+
+def search_relevant_chunks_batch(doc_id: str, query_embeddings, top_k: int = 3):
+    """
+    Vector search of several queries on one document (blocking), as a single matrix product of the
+    query embeddings with the document's vectors instead of one LanceDB search per query.
+
+    Parameters:
+    doc_id (str): The identifier for the document.
+    query_embeddings (np.ndarray): The query embeddings, one row per query.
+    top_k (int): The number of chunks returned per query.
+
+    Returns:
+    list: For each query, in order, its top_k chunks as in `search_relevant_chunks`.
+    """
+    table = open_nodes_table()
+
+    # Step 1: Score every chunk of the document against every query
+    document = get_document_vectors(table, doc_id)
+    if document is not None:
+        nodes, vectors = document.nodes, document.vectors
+    else:
+        nodes, vectors = load_document_vectors(table, doc_id)
+    if len(nodes) == 0:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No valid chunks found for document ID: {doc_id}",
+        )
+    scores = _normalize_rows(query_embeddings) @ vectors.T
+
+    # Step 2: Keep the best candidates of each query (extra ones to filter empty content), best first
+    k = min(top_k * 2, len(nodes))
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top = np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+
+    # Step 3: Fetch the text of all the candidates at once
+    texts = fetch_chunk_texts(table, doc_id, np.unique(nodes[top]).tolist(), document)
+    results = []
+    for query_scores, candidates in zip(scores, top):
+        chunks = [
+            {
+                "node_id": f"{doc_id}_node_{nodes[c]}",
+                "text": texts[nodes[c]],
+                "similarity": float(query_scores[c]),
+            }
+            for c in candidates
+            if nodes[c] in texts
+        ]
+        results.append(chunks[:top_k])
+    return results
+
+
+def _search_document_batch(doc_id, queries, query_embeddings, top_k, mode, hops):
+    if mode == "vector":
+        return search_relevant_chunks_batch(doc_id, query_embeddings, top_k)
+    return [
+        search_relevant_chunks(
+            doc_id, None if query_embeddings is None else query_embeddings[i], top_k, mode, hops, query
+        )
+        for i, query in enumerate(queries)
+    ]
+
+
+async def retrieve_relevant_chunks_batch_async(
+    items: list, top_k: int = 3, mode: RetrievalMode = "vector", hops: int = 1
+):
+    """
+    Retrieves the relevant chunks of many (doc_id, query) pairs in one call: the queries are embedded
+    together (see `get_query_embeddings_async`), then each document is searched once for all its
+    queries, the documents concurrently in the LanceDB thread pool.
+
+    Parameters:
+    items (list): (doc_id, query) pairs.
+    top_k (int): The number of chunks returned per query.
+    mode (str): The retrieval mode, see `search_relevant_chunks`. The "vector" mode runs as one
+    matrix product per document, the other modes search each query in turn.
+    hops (int): The number of graph hops in "graph" mode.
+
+    Returns:
+    list: One result per item, in input order: {"document_id", "query", "relevant_chunks"}, or
+    {"document_id", "query", "error": {"message"}} if the search of that document failed.
+    """
+    # Step 1: Embed all the queries together (the lexical mode doesn't need them)
+    queries = [query for _, query in items]
+    try:
+        embeddings = await get_query_embeddings_async(queries) if mode != "lexical" else None
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error embedding the queries: {str(e)}")
+
+    # Step 2: Group the queries by document
+    by_document = {}
+    for idx, (doc_id, _) in enumerate(items):
+        by_document.setdefault(doc_id, []).append(idx)
+
+    async def search_document(doc_id, indices):
+        async with upstream_limit("lancedb"):
+            with span("retrieve.search", mode=mode, queries=len(indices)):
+                return await run_blocking(
+                    _search_document_batch,
+                    doc_id,
+                    [queries[idx] for idx in indices],
+                    None if embeddings is None else embeddings[indices],
+                    top_k,
+                    mode,
+                    hops,
+                    executor=lancedb_pool,
+                )
+
+    # Step 3: Search the documents concurrently and put the results back in input order
+    searches = await asyncio.gather(
+        *(search_document(doc_id, indices) for doc_id, indices in by_document.items()),
+        return_exceptions=True,
+    )
+    results = [None] * len(items)
+    for (doc_id, indices), chunks in zip(by_document.items(), searches):
+        for position, idx in enumerate(indices):
+            result = {"document_id": doc_id, "query": queries[idx]}
+            if isinstance(chunks, Exception):
+                result["error"] = {"message": getattr(chunks, "detail", None) or str(chunks)}
+            else:
+                result["relevant_chunks"] = chunks[position]
+            results[idx] = result
+    return results
+
+
+# --- Cross-document edges and multi-document retrieval -----------------------------------------------
+
+
+def _cross_similarity_edges(source, target, threshold, top_k, block_size):
+    """
+    Finds, for every row of `source`, up to top_k rows of `target` whose cosine similarity is greater than
+    the threshold. The similarities are computed one block_size x block_size tile at a time.
+    """
+    rows, cols, weights = [], [], []
+    for i_start in range(0, len(source), block_size):
+        block = source[i_start : i_start + block_size]
+        for j_start in range(0, len(target), block_size):
+            sims = block @ target[j_start : j_start + block_size].T
+            local_i, local_j = np.nonzero(sims > threshold)
+            rows.append(local_i + i_start)
+            cols.append(local_j + j_start)
+            weights.append(sims[local_i, local_j])
+    if not rows:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+    rows, cols, weights = np.concatenate(rows), np.concatenate(cols), np.concatenate(weights)
+
+    # Keep the top_k most similar targets of each source row
+    order = np.lexsort((-weights, rows))
+    rows, cols, weights = rows[order], cols[order], weights[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    keep = rank < top_k
+    return rows[keep], cols[keep], weights[keep]
+
+
+def _document_matrix(table, doc_id: str):
+    # The chunk indices and unit-normalized vectors of a document, from memory when it is cached
+    document = get_document_vectors(table, doc_id)
+    if document is not None:
+        return document.nodes, document.vectors
+    return load_document_vectors(table, doc_id)
+
+
+# Held while the cross-document edges are rewritten, as linking a document also updates the others' edges
+_link_lock = threading.Lock()
+
+
+def link_document(
+    doc_id: str,
+    others,
+    threshold: float = CROSS_DOCUMENT_SIMILARITY_THRESHOLD,
+    top_k: int = CROSS_DOCUMENT_TOP_K,
+    block_size: int = GRAPH_BLOCK_SIZE,
+) -> int:
+    """
+    Computes the cross-document edges between a document and other documents (e.g. the rest of its
+    collection), and persists them with the document's and the other documents' edges (see
+    `utils.graph_store.CrossDocumentEdges`). Each chunk of the document is linked to its top_k most similar
+    chunks of each other document above the threshold, and the edges are stored in both directions. The
+    previous edges between these documents are replaced, so a document is linked again after an update.
+
+    Parameters:
+    doc_id (str): The identifier for the document.
+    others (list): The documents to link it with.
+    threshold (float): Only chunks with a cosine similarity greater than this are linked.
+    top_k (int): The maximum number of edges from a chunk to each other document.
+    block_size (int): Tile size used to bound the memory of the similarity computation.
+
+    Returns:
+    int: The number of cross-document edges of the document.
+    """
+    others = [other for other in dict.fromkeys(others) if other != doc_id]
+    table = open_nodes_table()
+    nodes, vectors = _document_matrix(table, doc_id)
+
+    with _link_lock:
+        # Step 1: Forget the previous edges to these documents
+        edges = [edge for edge in load_cross_edges(doc_id).edges() if edge[1] not in others]
+
+        # Step 2: Compare the document with each other document, and store the edges of both
+        for other in others:
+            other_nodes, other_vectors = _document_matrix(table, other)
+            if len(nodes) and len(other_nodes):
+                rows, cols, weights = _cross_similarity_edges(vectors, other_vectors, threshold, top_k, block_size)
+            else:
+                rows, cols, weights = np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+            sources, targets, weights = nodes[rows].tolist(), other_nodes[cols].tolist(), weights.tolist()
+            edges += [(source, other, target, weight) for source, target, weight in zip(sources, targets, weights)]
+            reverse = [edge for edge in load_cross_edges(other).edges() if edge[1] != doc_id]
+            reverse += [(target, doc_id, source, weight) for source, target, weight in zip(sources, targets, weights)]
+            save_cross_edges(other, CrossDocumentEdges.from_edges(reverse))
+        save_cross_edges(doc_id, CrossDocumentEdges.from_edges(edges))
+    return len(edges)
+
+
+def expand_across_documents(table, chunks: list, doc_ids, limit: int = 10) -> list:
+    """
+    Adds to the hits of a multi-document search the chunks of the other searched documents that they are
+    linked to by cross-document edges (see `link_document`). A neighbour scores the hit's similarity *
+    edge similarity * GRAPH_HOP_DECAY, and keeps the best score it receives.
+
+    Parameters:
+    table: The LanceDB table holding the chunks.
+    chunks (list): The hits, dicts with "document_id", "node_id", "text" and "similarity".
+    doc_ids (list): The searched documents, the only ones whose chunks can be added.
+    limit (int): The maximum number of neighbours added to the hits.
+
+    Returns:
+    list: The hits and their neighbours, the neighbours with "hop" set to 1.
+    """
+    searched = set(doc_ids)
+    known = {(chunk["document_id"], node_index(chunk["node_id"])) for chunk in chunks}
+
+    # Step 1: Score the neighbours of the hits in the other documents
+    scores = {}
+    for chunk in chunks:
+        for document, node, weight in load_cross_edges(chunk["document_id"]).neighbours(
+            node_index(chunk["node_id"])
+        ):
+            if document in searched and (document, node) not in known:
+                score = chunk["similarity"] * weight * GRAPH_HOP_DECAY
+                if score > scores.get((document, node), 0.0):
+                    scores[(document, node)] = score
+    best = heapq.nlargest(limit, scores, key=scores.get)
+
+    # Step 2: Fetch the text of the best neighbours, one query per document
+    by_document = {}
+    for document, node in best:
+        by_document.setdefault(document, []).append(node)
+    for document, nodes in by_document.items():
+        for node, content in fetch_chunk_texts(table, document, nodes, document_vectors.get(document)).items():
+            chunks.append(
+                {
+                    "document_id": document,
+                    "node_id": f"{document}_node_{node}",
+                    "text": content,
+                    "similarity": scores[(document, node)],
+                    "hop": 1,
+                }
+            )
+    return chunks
+
+
+def _search_documents(doc_ids, query_embedding, top_k, mode, hops, query) -> list:
+    # Searches documents in turn (blocking) with the same table handle, keeping each one's chunks or error
+    table = open_nodes_table()
+    results = []
+    for doc_id in doc_ids:
+        try:
+            results.append(search_relevant_chunks(doc_id, query_embedding, top_k, mode, hops, query, table=table))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+async def retrieve_relevant_chunks_multi_async(
+    doc_ids: list,
+    query: str,
+    top_k: int = 3,
+    mode: RetrievalMode = "vector",
+    hops: int = 1,
+    cross_document: bool = False,
+):
+    """
+    Retrieves the chunks relevant to a query across several documents (e.g. a collection).
+
+    The query is embedded once, then each document is searched as in `search_relevant_chunks`, split in
+    MULTI_DOCUMENT_PARALLELISM jobs running concurrently in the LanceDB thread pool, and their top_k chunks
+    are merged into the overall top_k with a bounded heap. An in-memory document is searched in well under
+    a millisecond, so a job searches several documents rather than paying a thread hop for each of them.
+    In "lexical" and "hybrid" modes, the per-document scores are merged as they are.
+
+    With cross_document, the merged hits are expanded by the chunks of the other searched documents that
+    they are linked to (see `expand_across_documents`) before keeping the top_k chunks.
+
+    Parameters:
+    doc_ids (list): The documents to search, at most MULTI_DOCUMENT_MAX_DOCUMENTS.
+    query (str): The query text.
+    top_k (int): The number of chunks returned.
+    mode (str): The retrieval mode, see `search_relevant_chunks`.
+    hops (int): The number of graph hops in "graph" mode.
+    cross_document (bool): Whether to follow the cross-document edges.
+
+    Returns:
+    tuple: The chunks, best first, with the "document_id" of each one, and the error message of each
+    document that could not be searched ({doc_id: message}).
+    """
+    doc_ids = list(dict.fromkeys(doc_ids))
+    if not doc_ids or len(doc_ids) > MULTI_DOCUMENT_MAX_DOCUMENTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Between 1 and {MULTI_DOCUMENT_MAX_DOCUMENTS} documents can be searched at once",
+        )
+    try:
+        # Step 1: Generate embedding for the query once, as an array rather than converting it for each
+        # document (the lexical mode doesn't need it)
+        query_embedding = await get_query_embedding_async(query) if mode != "lexical" else None
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving relevant chunks: {str(e)}")
+    if mode != "lexical":
+        # None when the embedding failed: fail the request once instead of failing every document
+        if query_embedding is None:
+            raise HTTPException(
+                status_code=500, detail="Error retrieving relevant chunks: the query could not be embedded"
+            )
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+
+    async def search_group(group):
+        async with upstream_limit("lancedb"):
+            return await run_blocking(
+                _search_documents, group, query_embedding, top_k, mode, hops, query, executor=lancedb_pool
+            )
+
+    # Step 2: Search the groups of documents concurrently, a failed document doesn't fail the others
+    n_groups = min(len(doc_ids), max(1, MULTI_DOCUMENT_PARALLELISM))
+    groups = [doc_ids[start::n_groups] for start in range(n_groups)]
+    with span("retrieve.search", mode=mode, documents=len(doc_ids)):
+        results = await asyncio.gather(*(search_group(group) for group in groups), return_exceptions=True)
+    by_document = {}
+    for group, result in zip(groups, results):
+        by_document.update(zip(group, [result] * len(group) if isinstance(result, Exception) else result))
+    searches = [by_document[doc_id] for doc_id in doc_ids]
+    errors = {}
+    for doc_id, chunks in zip(doc_ids, searches):
+        if isinstance(chunks, Exception):
+            errors[doc_id] = getattr(chunks, "detail", None) or str(chunks)
+        else:
+            for chunk in chunks:
+                chunk["document_id"] = doc_id
+    if len(errors) == len(doc_ids):
+        raise HTTPException(
+            status_code=404, detail=f"No valid chunks found for documents: {', '.join(doc_ids)}"
+        )
+
+    # Step 3: Merge the per-document results into the overall top_k
+    candidates = (chunk for chunks in searches if not isinstance(chunks, Exception) for chunk in chunks)
+    relevant_chunks = heapq.nlargest(top_k, candidates, key=lambda chunk: chunk["similarity"])
+
+    # Step 4: Add the linked chunks of the other documents
+    if cross_document and len(doc_ids) > 1:
+        with span("retrieve.cross_document"):
+            relevant_chunks = await run_blocking(
+                lambda: expand_across_documents(open_nodes_table(), relevant_chunks, doc_ids, limit=top_k * 2),
+                executor=lancedb_pool,
+            )
+        relevant_chunks = heapq.nlargest(top_k, relevant_chunks, key=lambda chunk: chunk["similarity"])
+
+    return relevant_chunks, errors
@@ -0,0 +1,214 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.embedding_cache import normalize_text
+
+# Cached answers are reused for queries whose embedding is at least this similar to a cached query
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_S", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "10000"))
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a question for exact matching: case, whitespace and trailing punctuation are ignored.
+    """
+    return normalize_text(query).lower().rstrip(" ?!.")
+
+
+# Prefix of the keys of questions on several documents, followed by their sorted IDs
+_SCOPE_PREFIX = "documents:"
+
+
+def scope_key(doc_ids) -> str:
+    """
+    Returns the key under which the answers of a question on one document (doc_id) or on several documents
+    (list of doc_ids, in any order) are cached.
+    """
+    if isinstance(doc_ids, str):
+        return doc_ids
+    doc_ids = sorted(set(doc_ids))
+    return doc_ids[0] if len(doc_ids) == 1 else _SCOPE_PREFIX + "|".join(doc_ids)
+
+
+def _scope_documents(scope: str) -> list:
+    return scope[len(_SCOPE_PREFIX) :].split("|") if scope.startswith(_SCOPE_PREFIX) else [scope]
+
+
+class _Entry:
+    def __init__(self, answer, embedding, expires_at):
+        self.answer = answer
+        self.embedding = embedding
+        self.expires_at = expires_at
+
+
+class _DocumentAnswers:
+    """
+    The cached answers of one document, with their query embeddings stacked in a matrix
+    (rebuilt lazily after a change) so that a semantic lookup is a single matrix-vector product.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self._keys = None
+        self._matrix = None
+
+    def changed(self):
+        self._keys = self._matrix = None
+
+    def most_similar(self, embedding):
+        if self._keys is None:
+            self._keys = [key for key, entry in self.entries.items() if entry.embedding is not None]
+            self._matrix = (
+                np.stack([self.entries[key].embedding for key in self._keys]) if self._keys else None
+            )
+        if self._matrix is None:
+            return None, 0.0
+        similarities = self._matrix @ embedding
+        best = int(np.argmax(similarities))
+        return self._keys[best], float(similarities[best])
+
+
+class AnswerCache:
+    """
+    Per-document cache of generated answers. A question on several documents is cached under their
+    `scope_key`, like a single document.
+
+    A query hits the cache if its normalized text was already answered for the same document, or if its
+    embedding is at least ANSWER_CACHE_SIMILARITY_THRESHOLD similar to the embedding of an answered query.
+    Entries expire after ANSWER_CACHE_TTL_S, the least recently used ones are evicted beyond
+    ANSWER_CACHE_MAX_ENTRIES, and all the entries of a document are dropped when it is re-ingested.
+    """
+
+    def __init__(
+        self,
+        similarity_threshold: float = ANSWER_CACHE_SIMILARITY_THRESHOLD,
+        ttl_s: float = ANSWER_CACHE_TTL_S,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._lru = OrderedDict()  # (doc_id, normalized query) -> None, in LRU order
+        self._documents = {}
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _unit(embedding):
+        if embedding is None:
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _remove(self, doc_id, key):
+        self._lru.pop((doc_id, key), None)
+        document = self._documents.get(doc_id)
+        if document is not None and document.entries.pop(key, None) is not None:
+            document.changed()
+            if not document.entries:
+                del self._documents[doc_id]
+
+    def _hit(self, doc_id, key, entry):
+        if entry.expires_at < time.monotonic():
+            self._remove(doc_id, key)
+            self.expirations += 1
+            return None
+        self._lru.move_to_end((doc_id, key))
+        return entry.answer
+
+    def get_exact(self, doc_id: str, query: str, count_miss: bool = False):
+        """
+        Returns the cached answer of the same (normalized) query on this document, or None.
+        This lookup doesn't need the query embedding. With count_miss, a miss is counted when no
+        semantic lookup follows.
+        """
+        key = normalize_query(query)
+        with self._lock:
+            document = self._documents.get(doc_id)
+            entry = document.entries.get(key) if document else None
+            answer = self._hit(doc_id, key, entry) if entry else None
+            if answer is not None:
+                self.exact_hits += 1
+            elif count_miss:
+                self.misses += 1
+            return answer
+
+    def get_similar(self, doc_id: str, query_embedding):
+        """
+        Returns the cached answer of the most similar query on this document if its similarity is above
+        the threshold, or None. Counts a miss otherwise (call `get_exact` first).
+        """
+        embedding = self._unit(query_embedding)
+        with self._lock:
+            document = self._documents.get(doc_id)
+            if document is not None and embedding is not None:
+                key, similarity = document.most_similar(embedding)
+                if key is not None and similarity >= self.similarity_threshold:
+                    answer = self._hit(doc_id, key, document.entries[key])
+                    if answer is not None:
+                        self.semantic_hits += 1
+                        return answer
+            self.misses += 1
+            return None
+
+    def put(self, doc_id: str, query: str, query_embedding, answer: dict):
+        """
+        Caches the answer to a query on a document.
+        """
+        key = normalize_query(query)
+        entry = _Entry(answer, self._unit(query_embedding), time.monotonic() + self.ttl_s)
+        with self._lock:
+            document = self._documents.setdefault(doc_id, _DocumentAnswers())
+            document.entries[key] = entry
+            document.changed()
+            self._lru[(doc_id, key)] = None
+            self._lru.move_to_end((doc_id, key))
+            while len(self._lru) > self.max_entries:
+                (old_doc_id, old_key), _ = self._lru.popitem(last=False)
+                self._remove(old_doc_id, old_key)
+                self.evictions += 1
+
+    def invalidate(self, doc_id: str):
+        """
+        Drops all the cached answers of a document, including the ones of questions on several documents
+        that include it, e.g. when it is re-ingested.
+        """
+        with self._lock:
+            scopes = [scope for scope in self._documents if doc_id in _scope_documents(scope)]
+            for scope in scopes:
+                for key in self._documents.pop(scope).entries:
+                    self._lru.pop((scope, key), None)
+            if scopes:
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "entries": len(self._lru),
+                "documents": len(self._documents),
+                "max_entries": self.max_entries,
+                "similarity_threshold": self.similarity_threshold,
+                "ttl_s": self.ttl_s,
+            }
+
+
+answer_cache = AnswerCache()
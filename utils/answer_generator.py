@@ -1,127 +1,225 @@
+import json
 import os
-from openai import OpenAI
-from langchain_openai import OpenAI as langchain_openai
 
-from fastapi import HTTPException
-from utils.Knowlege_graph import retrieve_relevant_chunks_from_db
-from langchain.agents import initialize_agent, AgentType
-from langchain.llms import OpenAI as LangChainOpenAI
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
-from langchain.agents import Tool
-
-# Load OpenAI API key
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAI_API_KEY)
-# Set up LangChain OpenAI client for agent
-llm = langchain_openai(model_name="gpt-3.5-turbo-instruct", api_key=OPENAI_API_KEY)
+from utils.Knowlege_graph import (
+    retrieve_relevant_chunks_from_db_async,
+    retrieve_relevant_chunks_multi_async,
+)
+from utils.clients import get_async_chat_client
+from utils.concurrency import chat_flight, upstream_limit
+from utils.context_builder import ANSWER_CANDIDATES, build_context
+from utils.json_stream import StreamingStringField
+from utils.rate_limit import rate_governor
+from utils.tokens import estimate_chat_tokens
+from utils.tracing import span, record_tokens
+
+# Maximum length of an answer, in tokens
+ANSWER_MAX_TOKENS = int(os.getenv("ANSWER_MAX_TOKENS", "200"))
+
+
+# Instructions of the answer, kept short: they are sent with every question
+SYSTEM_PROMPT = (
+    "You are a supportive learning assistant for employees. Answer the question using only the context "
+    "from the document, in a friendly, motivational tone that encourages learning and exploration. If the "
+    "context doesn't answer it, say politely that the document doesn't cover it, suggest rephrasing, and "
+    "set relevant to false."
+)
 
 
-def generate_answer(doc_id: str, query: str):
+def _build_messages(query: str, relevant_chunks: list):
     """
-    Generate an answer based on document content and the given query by first retrieving relevant chunks
-    from the database and then passing them to OpenAI's GPT-4 model for a completion.
-
-    If the generated answer is irrelevant, fall back to an agent to generate an alternative response.
-
-    Parameters:
-    - doc_id (str): The document ID used to query and retrieve related chunks from the database.
-    - query (str): The question that the user has, which will be answered based on the document's content.
+    Builds the chat messages asking GPT-4 to answer the query from the relevant chunks, with the context
+    fitted in ANSWER_CONTEXT_TOKENS (see `build_context`).
 
     Returns:
-    - dict: A dictionary containing the generated answer and relevance status.
+    tuple: The messages, and the chunks used as context.
+    """
+    # Step 1: Fit the most relevant chunks in the token budget
+    with span("answer.context", candidates=len(relevant_chunks)) as context_span:
+        context, sources = build_context(relevant_chunks, model=COMPLETION_PARAMETERS["model"])
+        context_span.set(chunks=len(sources))
+
+    # Step 2: The question is sent once, after its context
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {query}"},
+    ]
+    return messages, sources
+
+
+# The answer is returned through a function call, whose arguments follow this schema, instead of
+# asking for free-form JSON in the prompt. "content" comes first so that it can be streamed.
+ANSWER_FUNCTION = {
+    "name": "submit_answer",
+    "description": "Submit the answer to the user's question.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "content": {"type": "string", "description": "The answer to the question."},
+            "relevant": {
+                "type": "boolean",
+                "description": "Whether the answer is based on the provided context.",
+            },
+        },
+        "required": ["content", "relevant"],
+    },
+}
+
+# Parameters of the chat completion request
+COMPLETION_PARAMETERS = {
+    "model": "gpt-4",
+    "temperature": 0.8,
+    "max_tokens": ANSWER_MAX_TOKENS,
+    "top_p": 1,
+    "tools": [{"type": "function", "function": ANSWER_FUNCTION}],
+    "tool_choice": {"type": "function", "function": {"name": ANSWER_FUNCTION["name"]}},
+}
+
+
+def _parse_answer_arguments(arguments: str) -> dict:
+    """
+    Parses the arguments of the submit_answer call into {"content", "relevant"}.
+
+    If the arguments are not valid JSON (e.g. the completion was cut by max_tokens), the answer text
+    decoded so far is kept rather than thrown away, and considered relevant if not empty.
     """
-    # Step 1: Retrieve relevant chunks from the database
     try:
-        relevant_chunks = retrieve_relevant_chunks_from_db(doc_id, query, top_k=3)
-    except HTTPException as e:
-        raise HTTPException(status_code=e.status_code, detail=e.detail)
+        parsed = json.loads(arguments)
+        return {"content": str(parsed.get("content", "")), "relevant": bool(parsed.get("relevant"))}
+    except (ValueError, AttributeError):
+        field = StreamingStringField("content")
+        field.feed(arguments)
+        return {"content": field.value, "relevant": bool(field.value.strip())}
 
-    # Step 2: Prepare the context by joining the relevant chunks' text
-    texts = [chunk["text"] for chunk in relevant_chunks]
-    context = " ".join(texts)
 
-    # Step 3: Prepare the prompt for the LLM
-    prompt = f"""
-        Context: {context}
+def _answer_from_response(response) -> dict:
+    # Extract the answer and its relevance from the function call
+    message = response.choices[0].message
+    if message.tool_calls:
+        return _parse_answer_arguments(message.tool_calls[0].function.arguments)
 
-        Question: {query}
+    # The model answered with plain text instead
+    answer_content = message.content or ""
+    return {"content": answer_content, "relevant": bool(answer_content.strip())}
 
-        Answer: Please answer the question based only on the information from the provided context. 
-        If the answer is not directly available or the context is not relevant, kindly explain that based on the document, you're unable to answer the question.
-        If you cannot provide a relevant answer, mark the response with "irrelevant: true" and kindly explain that based on the document, you're unable to answer the question. 
-        Additionally, please structure the response in JSON format as follows:
 
-        {{
-            "content": "<your generated text>",
-            "relevant": <true or false>
-        }}
+def _chat_tokens(messages) -> int:
+    return estimate_chat_tokens(messages, COMPLETION_PARAMETERS["model"], COMPLETION_PARAMETERS["max_tokens"])
 
-        If the answer is relevant, set "relevant" to true, otherwise set it to false. 
-        Keep the tone motivational, reflective, and encourage learning and exploration.
-    """
 
-    # Step 4: Make the LLM request using the correct chat completion endpoint
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a supportive learning assistant. Use the following principles in responding to employees:\n"
-                "    - Always maintain a friendly and motivational tone. Encourage employees to think critically and explore new ideas.\n"
-                "    - Base your responses only on the information provided within the context of the document.\n"
-                "    - If the context doesn't provide enough information or is not relevant to the question, inform the user politely that you cannot provide an answer.\n"
-                "    - Acknowledge the uncertainty if needed, and encourage users to rephrase their question for better clarity.\n"
-                "    - Foster an atmosphere of curiosity, guiding users to discover insights independently where possible.",
-            },
-            {
-                "role": "user",
-                "content": query,
-            },
-            {
-                "role": "system",
-                "content": prompt,
-            },
-        ],
-        temperature=0.8,
-        max_tokens=200,
-        top_p=1,
-    )
+def _flight_key(messages):
+    # Identical prompts make identical requests, the other parameters are fixed
+    return json.dumps(messages, sort_keys=True)
+
 
-    # Extract the answer and check if it's relevant
-    answer_content = response.choices[0].message.content
+async def _create_completion_async(messages):
+    # Wait for the rate governor before taking a slot, so that waiting calls don't hold one
+    await rate_governor("openai_chat").acquire_async(_chat_tokens(messages))
+    async with upstream_limit("openai_chat"):
+        with span("openai.chat"):
+            response = await get_async_chat_client().chat.completions.create(
+                messages=messages, **COMPLETION_PARAMETERS
+            )
+    record_tokens(COMPLETION_PARAMETERS["model"], getattr(response, "usage", None))
+    return response
 
-    # Check if the answer is relevant (e.g., empty or irrelevant content)
-    if "relevant" in answer_content.lower() or not answer_content.strip():
-        return {"content": answer_content, "relevant": True}
 
-    return {"content": answer_content, "relevant": False}
+async def _retrieve_candidates(doc_id, query: str, mode: str, cross_document: bool) -> list:
+    # One document, or the merged results of several documents (see `retrieve_relevant_chunks_multi_async`)
+    if isinstance(doc_id, str):
+        return await retrieve_relevant_chunks_from_db_async(doc_id, query, top_k=ANSWER_CANDIDATES, mode=mode)
+    relevant_chunks, _ = await retrieve_relevant_chunks_multi_async(
+        doc_id, query, top_k=ANSWER_CANDIDATES, mode=mode, cross_document=cross_document
+    )
+    return relevant_chunks
 
 
-def agent_start(query: str) -> str:
+async def generate_answer_async(doc_id, query: str, mode: str = "vector", cross_document: bool = False):
     """
-    Fallback agent function that can generate alternative answers when the document-based answer is irrelevant.
+    Generate an answer based on document content and the given query by first retrieving relevant chunks
+    from the database and then passing them to OpenAI's GPT-4 model for a completion.
+
+    Retrieval and the GPT-4 call don't block the event loop, and the GPT-4 calls are bounded by the
+    "openai_chat" upstream limit and rate governor. Identical concurrent questions share one GPT-4 call.
+    If the generated answer is irrelevant, the caller can answer with `utils.fallback.fallback_answer`.
 
     Parameters:
-    - query (str): The query from the user that the agent will handle if no relevant answer is found.
+    - doc_id (str or list): The document ID used to query and retrieve related chunks from the database,
+      or a list of documents (e.g. a collection), which are searched together, following the
+      cross-document edges between them with cross_document.
+    - query (str): The question that the user has, which will be answered based on the document's content.
+    - mode (str): The retrieval mode of the relevant chunks ("vector", "graph", "lexical" or "hybrid").
 
     Returns:
-    - str: The alternative response generated by the agent.
+    - dict: The generated answer ("content"), its relevance status ("relevant") and the relevant chunks
+      used as context ("sources").
     """
-    return f"Sorry, I couldn't find a relevant answer from the document. Here's an alternative answer to your question: {query}"
+    # Step 1: Retrieve relevant chunks from the database
+    relevant_chunks = await _retrieve_candidates(doc_id, query, mode, cross_document)
 
+    # Step 2: Prepare the prompt from the relevant chunks
+    messages, sources = _build_messages(query, relevant_chunks)
 
-# Define a tool for the agent (a simple fallback tool)
-fallback_tool = Tool(
-    name="FallbackAgent",
-    func=agent_start,
-    description="This tool provides alternative answers when the original answer is deemed irrelevant.",
-)
+    # Step 3: Make the LLM request, shared with the identical requests in flight
+    response = await chat_flight.do_async(_flight_key(messages), lambda: _create_completion_async(messages))
+
+    return {**_answer_from_response(response), "sources": sources}
+
+
+async def stream_answer(doc_id, query: str, mode: str = "vector", cross_document: bool = False):
+    """
+    Streaming version of `generate_answer_async`, yields (event, data) pairs:
+
+    - ("sources", list): The relevant chunks used as context, as soon as retrieval is done.
+    - ("token", str): Each new piece of the answer text, as GPT-4 generates it.
+    - ("relevance", dict): {"relevant": bool, "content": full answer} once the answer is complete.
+    """
+    # Step 1: Retrieve relevant chunks from the database and send the ones used as context first
+    relevant_chunks = await _retrieve_candidates(doc_id, query, mode, cross_document)
+    messages, sources = _build_messages(query, relevant_chunks)
+    yield "sources", sources
+
+    # Step 2: Stream the function call arguments, and forward the answer text as it is decoded.
+    # Streams are not shared between identical requests, each one is paced by the rate governor.
+    content = StreamingStringField("content")
+    arguments = []
+    await rate_governor("openai_chat").acquire_async(_chat_tokens(messages))
+    # The upstream slot is only held while the request is made: the stream is then read at the pace of the
+    # client, and a slow client must not keep the other questions waiting for a slot
+    async with upstream_limit("openai_chat"):
+        with span("openai.chat", stream=True):
+            # The last chunk carries the token usage, without choices
+            stream = await get_async_chat_client().chat.completions.create(
+                messages=messages, stream=True, stream_options={"include_usage": True}, **COMPLETION_PARAMETERS
+            )
+    try:
+        async for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                record_tokens(COMPLETION_PARAMETERS["model"], chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.tool_calls:
+                fragment = delta.tool_calls[0].function.arguments or ""
+            elif delta.content:
+                # Plain text answer, stream it as is
+                fragment = delta.content
+                content.value += fragment
+                yield "token", fragment
+                continue
+            else:
+                continue
+            arguments.append(fragment)
+            text = content.feed(fragment)
+            if text:
+                yield "token", text
+    finally:
+        await stream.close()
+
+    # Step 3: Send the relevance once the arguments are complete
+    if arguments:
+        answer = _parse_answer_arguments("".join(arguments))
+    else:
+        answer = {"content": content.value, "relevant": bool(content.value.strip())}
+    yield "relevance", answer
 
-# Set up LangChain Agent
-agent = initialize_agent(
-    tools=[fallback_tool],
-    agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-    llm=llm,
-    verbose=True,
-)
@@ -0,0 +1,262 @@
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# "openai" calls the real API, "stub" uses deterministic local vectors (offline benchmarks)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+# "openai" calls the real API, "stub" answers locally (offline benchmarks)
+CHAT_BACKEND = os.getenv("CHAT_BACKEND", "openai")
+LANCEDB_URI = os.getenv("LANCEDB_URI", "~/.lancedb")
+# Warm-up of the clients when the app starts: "background" (the app serves requests meanwhile, /ready
+# answers 503 until it is done), "blocking" (the app only starts once it is done) or "off" (on first use)
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "background")
+# Connection pool shared by all the clients: maximum connections, and idle ones kept open for reuse
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "64"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "32"))
+HTTP_KEEPALIVE_EXPIRY_S = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_S", "30"))
+
+# Clients shared by all the routers, created on first use rather than when their module is imported,
+# so that importing the app stays fast. See `get_client`.
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(name: str, factory):
+    """
+    Returns the shared client `name`, creating it with `factory()` on first use.
+    """
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+
+def get_db():
+    """
+    Returns the LanceDB connection of the chunks table.
+    """
+
+    def connect():
+        import lancedb
+
+        return lancedb.connect(LANCEDB_URI)
+
+    return get_client("lancedb", connect)
+
+
+def _http_limits():
+    import httpx
+
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_S,
+    )
+
+
+def get_openai_http_client():
+    """
+    Returns the pooled httpx client shared by the OpenAI clients, so that the embeddings and chat
+    requests reuse the same keep-alive connections.
+    """
+
+    def create():
+        from openai import DefaultHttpxClient
+
+        return DefaultHttpxClient(limits=_http_limits())
+
+    return get_client("openai_http", create)
+
+
+def get_async_openai_http_client():
+    """
+    Async version of `get_openai_http_client`, shared by the async OpenAI clients.
+    """
+
+    def create():
+        from openai import DefaultAsyncHttpxClient
+
+        return DefaultAsyncHttpxClient(limits=_http_limits())
+
+    return get_client("openai_http_async", create)
+
+
+def get_http_session():
+    """
+    Returns the pooled requests session of the other HTTP calls (e.g. the PDF downloads).
+    """
+
+    def create():
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS, pool_maxsize=HTTP_MAX_CONNECTIONS)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    return get_client("http_session", create)
+
+
+def _openai_factory(backend: str, asynchronous: bool, **options):
+    def create():
+        if backend == "stub":
+            from utils.stub_openai import StubAsyncOpenAI, StubOpenAI
+
+            return StubAsyncOpenAI() if asynchronous else StubOpenAI()
+        from openai import AsyncOpenAI, OpenAI
+
+        if asynchronous:
+            return AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=get_async_openai_http_client(), **options)
+        return OpenAI(api_key=OPENAI_API_KEY, http_client=get_openai_http_client(), **options)
+
+    return create
+
+
+def get_embeddings_client():
+    # Retries are handled by `_embed_batch` so that they can be spread with a jittered backoff
+    return get_client("embeddings", _openai_factory(EMBEDDING_BACKEND, False, max_retries=0))
+
+
+def get_async_embeddings_client():
+    # Used by the request handlers, so that waiting for OpenAI doesn't block the event loop
+    return get_client("embeddings_async", _openai_factory(EMBEDDING_BACKEND, True, max_retries=0))
+
+
+def get_chat_client():
+    return get_client("chat", _openai_factory(CHAT_BACKEND, False))
+
+
+def get_async_chat_client():
+    # Used by the request handlers, so that waiting for GPT-4 doesn't block the event loop
+    return get_client("chat_async", _openai_factory(CHAT_BACKEND, True))
+
+
+async def close_clients():
+    """
+    Closes the pooled HTTP connections, when the app shuts down. The clients using them are dropped
+    as well, they are created again on next use.
+    """
+    names = ("embeddings", "embeddings_async", "chat", "chat_async", "openai_http", "openai_http_async", "http_session")
+    with _clients_lock:
+        clients = {name: _clients.pop(name) for name in names if name in _clients}
+    for name in ("openai_http", "http_session"):
+        if name in clients:
+            clients[name].close()
+    if "openai_http_async" in clients:
+        await clients["openai_http_async"].aclose()
+
+
+def openai_retryable_errors() -> tuple:
+    """
+    Returns the OpenAI exceptions worth retrying: rate limits and transient errors.
+    """
+    from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+    return (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+
+# --- Warm-up and readiness ------------------------------------------------------------------------
+
+
+def _warm_lancedb():
+    from utils.Knowlege_graph import NODES_TABLE, open_nodes_table
+
+    if NODES_TABLE in get_db().table_names():
+        open_nodes_table()
+
+
+def _warm_openai():
+    get_embeddings_client()
+    get_async_embeddings_client()
+    get_chat_client()
+    get_async_chat_client()
+    get_http_session()
+    openai_retryable_errors()
+
+
+def _warm_pdf():
+    from utils.pdf_processor import warm_up_pdf_processing
+
+    warm_up_pdf_processing()
+
+
+def _warm_tokenizer():
+    from utils.answer_generator import COMPLETION_PARAMETERS
+    from utils.embeddings_generator import EMBEDDING_MODEL
+    from utils.tokens import get_token_counter
+
+    get_token_counter(EMBEDDING_MODEL)("warm-up")
+    get_token_counter(COMPLETION_PARAMETERS["model"])("warm-up")
+
+
+# Components warmed up before the app is ready, in order
+WARMUP_STEPS = [
+    ("lancedb", _warm_lancedb),
+    ("openai", _warm_openai),
+    ("pdf", _warm_pdf),
+    ("tokenizer", _warm_tokenizer),
+]
+
+_warmup = {"status": "pending", "components": {}, "duration_ms": None}
+# Held while warming up, so that concurrent calls wait for the running warm-up
+_warmup_lock = threading.Lock()
+
+
+def warm_up() -> dict:
+    """
+    Creates the shared clients and imports the heavy dependencies, so that the first requests don't pay
+    for them. Concurrent calls wait for the running warm-up, and calls once it succeeded return at once.
+
+    A component that fails to warm up is reported with its error and the app is not ready; the next call
+    tries again (and the component is created on its first use anyway).
+
+    Returns:
+    dict: The warm-up status (see `readiness`).
+    """
+    with _warmup_lock:
+        if _warmup["status"] == "ready":
+            return readiness()
+        _warmup["status"] = "warming"
+        start = time.perf_counter()
+        failed = False
+        for name, warm in WARMUP_STEPS:
+            step_start = time.perf_counter()
+            try:
+                warm()
+                _warmup["components"][name] = {"ms": round((time.perf_counter() - step_start) * 1000, 1)}
+            except Exception as e:
+                print(f"Warm-up of '{name}' failed: {e}")
+                _warmup["components"][name] = {"error": str(e)}
+                failed = True
+        _warmup["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        _warmup["status"] = "failed" if failed else "ready"
+    return readiness()
+
+
+def start_warm_up():
+    """
+    Warms up in a background thread, see `warm_up`.
+    """
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
+def readiness() -> dict:
+    """
+    Returns the warm-up status: "pending", "warming", "ready" or "failed", with the duration or error
+    of each component.
+    """
+    return {
+        "status": _warmup["status"],
+        "duration_ms": _warmup["duration_ms"],
+        "components": {name: dict(info) for name, info in _warmup["components"].items()},
+    }
@@ -0,0 +1,114 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Maximum number of concurrent calls per upstream service, further calls wait for a free slot
+UPSTREAM_CONCURRENCY = {
+    "openai_embeddings": int(os.getenv("OPENAI_EMBEDDINGS_CONCURRENCY", "16")),
+    "openai_chat": int(os.getenv("OPENAI_CHAT_CONCURRENCY", "8")),
+    "lancedb": int(os.getenv("LANCEDB_CONCURRENCY", "16")),
+}
+
+# Threads running blocking LanceDB calls for request handlers. LanceDB releases the GIL while searching,
+# so a pool sized to the search concurrency keeps the event loop free without oversubscribing the CPU.
+LANCEDB_THREADS = int(os.getenv("LANCEDB_THREADS", str(UPSTREAM_CONCURRENCY["lancedb"])))
+
+lancedb_pool = ThreadPoolExecutor(max_workers=LANCEDB_THREADS, thread_name_prefix="lancedb")
+
+_semaphores = {}
+
+
+def upstream_limit(name: str) -> asyncio.Semaphore:
+    """
+    Returns the semaphore bounding the concurrent calls to an upstream service.
+
+    The semaphores are created on first use, from inside the running event loop.
+    """
+    semaphore = _semaphores.get(name)
+    if semaphore is None:
+        semaphore = _semaphores[name] = asyncio.Semaphore(UPSTREAM_CONCURRENCY[name])
+    return semaphore
+
+
+async def run_blocking(func, *args, executor=None, **kwargs):
+    """
+    Runs a blocking function in a thread pool (the default one unless `executor` is given) and awaits
+    its result, so that it doesn't block the event loop. Context variables are propagated to the thread.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await loop.run_in_executor(executor, call)
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight calls: while a call with a key is running, the calls with the same key
+    wait for it and share its result (or exception) instead of calling the upstream service again.
+    Nothing is kept once the call is done, see the caches for that.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def _join(self, key, create):
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                return call, False
+            call = self._calls[key] = create()
+            return call, True
+
+    def _done(self, key):
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def do(self, key, func):
+        """
+        Returns `func()`, or the result of the running call with the same key (blocking).
+        """
+        # Blocking and async calls are not shared: a thread can't wait for a task, nor the reverse
+        key = ("blocking", key)
+        future, leader = self._join(key, Future)
+        if not leader:
+            return future.result()
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._done(key)
+        future.set_result(result)
+        return result
+
+    async def do_async(self, key, func):
+        """
+        Returns `await func()`, or the result of the running call with the same key.
+
+        The call runs in its own task, so that it isn't cancelled with the caller that started it
+        while other callers wait for it.
+        """
+        key = ("async", key)
+        task, leader = self._join(key, lambda: asyncio.ensure_future(func()))
+        if leader:
+            task.add_done_callback(lambda _: self._done(key))
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._calls)}
+
+
+# Identical concurrent embedding and chat completion requests share one upstream call
+embedding_flight = SingleFlight("openai_embeddings")
+chat_flight = SingleFlight("openai_chat")
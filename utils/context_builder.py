@@ -0,0 +1,154 @@
+import os
+
+from utils.embedding_cache import normalize_text
+from utils.graph_store import load_cross_edges, load_graph
+from utils.Knowlege_graph import node_document, node_index
+from utils.pdf_processor import CHUNK_OVERLAP
+from utils.tokens import get_token_counter
+
+# Maximum number of tokens of document context sent with a question
+ANSWER_CONTEXT_TOKENS = int(os.getenv("ANSWER_CONTEXT_TOKENS", "400"))
+# Number of chunks retrieved as candidates for the context, the budget decides how many are used
+ANSWER_CANDIDATES = int(os.getenv("ANSWER_CANDIDATES", "8"))
+
+# Shorter repeats are not taken for the splitter's overlap
+_MIN_OVERLAP = 10
+_SEPARATOR = "\n\n"
+
+
+def _node(chunk) -> int:
+    return node_index(chunk["node_id"])
+
+
+def _document(chunk) -> str:
+    return chunk.get("document_id") or node_document(chunk["node_id"])
+
+
+def strip_overlap(previous: str, text: str, max_overlap: int = CHUNK_OVERLAP) -> str:
+    """
+    Removes from the start of `text` what repeats the end of `previous`, i.e. the overlap that the text
+    splitter leaves between consecutive chunks of a page.
+    """
+    for size in range(min(len(previous), len(text), max_overlap), _MIN_OVERLAP - 1, -1):
+        if previous.endswith(text[:size]):
+            return text[size:].lstrip()
+    return text
+
+
+class Passage:
+    """
+    Consecutive chunks of a document, merged into one text without their overlaps.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.document = _document(chunks[0])
+        self.nodes = [_node(chunk) for chunk in chunks]
+        self.score = max(chunk["similarity"] for chunk in chunks)
+        parts = [chunks[0]["text"]]
+        for chunk in chunks[1:]:
+            parts.append(strip_overlap(parts[-1], chunk["text"]))
+        self.text = " ".join(part for part in parts if part)
+
+
+def _passages(chunks) -> list:
+    """
+    Groups chunks into passages of consecutive nodes of the same document, in document order.
+    """
+    passages, run = [], []
+    for chunk in sorted(chunks, key=lambda chunk: (_document(chunk), _node(chunk))):
+        if run and (_document(chunk) != _document(run[-1]) or _node(chunk) != _node(run[-1]) + 1):
+            passages.append(Passage(run))
+            run = []
+        run.append(chunk)
+    if run:
+        passages.append(Passage(run))
+    return passages
+
+
+def _link(graphs: dict, a: Passage, b: Passage) -> float:
+    """
+    Returns the strongest similarity edge between two passages, 0 if they are not neighbours. Passages
+    of different documents are linked by their cross-document edges (see `utils.graph_store`).
+    """
+    targets = set(b.nodes)
+    best = 0.0
+    if a.document != b.document:
+        edges = load_cross_edges(a.document)
+        for node in a.nodes:
+            for document, neighbour, weight in edges.neighbours(node):
+                if document == b.document and neighbour in targets and weight > best:
+                    best = weight
+        return best
+    graph = graphs.get(a.document)
+    if graph is None:
+        return best
+    for node in a.nodes:
+        neighbours, weights = graph.neighbours(node)
+        for neighbour, weight in zip(neighbours.tolist(), weights.tolist()):
+            if neighbour in targets and weight > best:
+                best = weight
+    return best
+
+
+def order_passages(passages, graphs: dict = None) -> list:
+    """
+    Orders passages by graph neighbourhood: starting from the most relevant one, each passage is followed
+    by its closest neighbour in the similarity graphs (by document), or by the most relevant remaining
+    passage when none of them is a neighbour. Related passages end up next to each other in the prompt.
+    """
+    remaining = sorted(passages, key=lambda passage: -passage.score)
+    if graphs is None or len(remaining) < 2:
+        return remaining
+    ordered = [remaining.pop(0)]
+    while remaining:
+        links = [_link(graphs, ordered[-1], passage) for passage in remaining]
+        best = max(range(len(remaining)), key=lambda idx: links[idx])
+        ordered.append(remaining.pop(best if links[best] > 0 else 0))
+    return ordered
+
+
+def build_context(chunks: list, budget: int = ANSWER_CONTEXT_TOKENS, model: str = "gpt-4"):
+    """
+    Builds the document context of a question from its retrieved chunks, within a token budget.
+
+    The chunks are taken by decreasing relevance as long as the context fits in `budget` tokens (counted
+    with the model's tiktoken encoding, see `get_token_counter`), so the number of chunks adapts to their length. Chunks repeating
+    the text of a more relevant one are dropped, consecutive chunks are merged without the overlap left by
+    the splitter, and the passages are ordered by graph neighbourhood (see `order_passages`). The most
+    relevant chunk is always kept, even if it doesn't fit in the budget on its own.
+
+    The chunks may come from several documents: the passages are made of chunks of the same document, and
+    ordered with the similarity graph of each document and the cross-document edges between them.
+
+    Parameters:
+    chunks (list): The retrieved chunks, dicts with "node_id", "text" and "similarity".
+    budget (int): The maximum number of tokens of the context.
+    model (str): The chat model, whose encoding counts the tokens.
+
+    Returns:
+    tuple: The context text, and the chunks it is made of, in context order.
+    """
+    # A context slightly over the budget is harmless, an estimate will do when tiktoken is unavailable
+    count_tokens = get_token_counter(model, upper_bound=False)
+    graphs = {document: load_graph(document) for document in {_document(chunk) for chunk in chunks}}
+
+    # Step 1: Drop the duplicated texts (e.g. a header repeated on each page), keeping the most relevant
+    candidates, seen = [], set()
+    for chunk in sorted(chunks, key=lambda chunk: -chunk["similarity"]):
+        key = normalize_text(chunk["text"])
+        if key and key not in seen:
+            seen.add(key)
+            candidates.append(chunk)
+
+    # Step 2: Add the chunks by decreasing relevance while the context fits in the budget
+    selected, passages = [], []
+    for chunk in candidates:
+        trial = order_passages(_passages(selected + [chunk]), graphs)
+        if selected and count_tokens(_SEPARATOR.join(passage.text for passage in trial)) > budget:
+            continue
+        selected.append(chunk)
+        passages = trial
+
+    context = _SEPARATOR.join(passage.text for passage in passages)
+    return context, [chunk for passage in passages for chunk in passage.chunks]
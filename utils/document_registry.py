@@ -0,0 +1,160 @@
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime
+
+DOCUMENT_REGISTRY_PATH = os.path.expanduser(os.getenv("DOCUMENT_REGISTRY_PATH", "~/.lancedb-documents.json"))
+# The document IDs accepted anywhere: they end up in file paths and in the filters of LanceDB queries, so
+# quotes, dots and slashes are refused
+DOC_ID_PATTERN = r"^[A-Za-z0-9_-]+$"
+
+
+class DocumentRegistry:
+    """
+    The stable identity of the ingested documents: for each doc_id, the URL it was downloaded from and
+    the SHA-256 of the PDF, so that a revised document can be updated in place (see `submit_update`)
+    instead of being ingested again under a new ID.
+
+    It also holds the collections (e.g. the documents of a course), which are searched together by
+    POST /retrieve and POST /answer.
+
+    The registry is small (one entry per document), it is kept in memory and rewritten atomically to a
+    JSON file on each change.
+    """
+
+    def __init__(self, path: str = DOCUMENT_REGISTRY_PATH):
+        self.path = path
+        self._data = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._data is None:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                data = {}
+            # Registries written before collections existed only hold the documents
+            if "documents" not in data:
+                data = {"documents": data}
+            data.setdefault("collections", {})
+            self._data = data
+        return self._data
+
+    def _documents(self) -> dict:
+        return self._load()["documents"]
+
+    def _collections(self) -> dict:
+        return self._load()["collections"]
+
+    def _save(self):
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, staging = tempfile.mkstemp(prefix=".documents-", suffix=".json", dir=directory)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self._data, f)
+        os.replace(staging, self.path)
+
+    def get(self, doc_id: str):
+        with self._lock:
+            document = self._documents().get(doc_id)
+            return dict(document) if document is not None else None
+
+    def find(self, url: str = None, content_hash: str = None):
+        """
+        Returns the ID of the most recently updated document with this URL or content hash, or None.
+        """
+        with self._lock:
+            matches = [
+                (document["updated_at"], doc_id)
+                for doc_id, document in self._documents().items()
+                if (url is not None and document["url"] == url)
+                or (content_hash is not None and document["content_hash"] == content_hash)
+            ]
+        return max(matches)[1] if matches else None
+
+    def register(self, doc_id: str, url: str, content_hash: str, chunks: int):
+        with self._lock:
+            self._documents()[doc_id] = {
+                "url": url,
+                "content_hash": content_hash,
+                "chunks": chunks,
+                "updated_at": datetime.now().isoformat(),
+            }
+            self._save()
+
+    def restore(self, documents: dict, collections: dict):
+        """
+        Adds restored documents (e.g. from snapshots) to the registry, with one write for all of them.
+
+        Parameters:
+        documents (dict): The entry of each document, by doc_id.
+        collections (dict): The documents to add to each collection, by collection_id.
+        """
+        with self._lock:
+            self._documents().update(documents)
+            for collection_id, doc_ids in collections.items():
+                members = self._collections().setdefault(collection_id, [])
+                members.extend(doc_id for doc_id in dict.fromkeys(doc_ids) if doc_id not in members)
+            self._save()
+
+    def add_to_collection(self, collection_id: str, doc_ids) -> list:
+        """
+        Adds documents to a collection, creating it if needed.
+
+        Returns:
+        list: The documents of the collection, in the order they were added.
+        """
+        with self._lock:
+            documents = self._collections().setdefault(collection_id, [])
+            documents.extend(doc_id for doc_id in dict.fromkeys(doc_ids) if doc_id not in documents)
+            self._save()
+            return list(documents)
+
+    def collection_documents(self, collection_id: str):
+        """
+        Returns the documents of a collection, or None if there is no such collection.
+        """
+        with self._lock:
+            documents = self._collections().get(collection_id)
+            return list(documents) if documents is not None else None
+
+    def collections_of(self, doc_id: str) -> list:
+        """
+        Returns the IDs of the collections that contain a document.
+        """
+        with self._lock:
+            return [
+                collection_id
+                for collection_id, documents in self._collections().items()
+                if doc_id in documents
+            ]
+
+
+document_registry = DocumentRegistry()
+
+
+class UnknownCollection(Exception):
+    pass
+
+
+def resolve_documents(doc_id: str = None, doc_ids: list = None, collection_id: str = None):
+    """
+    Returns the documents targeted by a query: its single doc_id, or its list of doc_ids, or the documents
+    of its collection.
+
+    Returns:
+    str or list: The doc_id of a single-document query, the doc_ids of a multi-document query.
+
+    Raises:
+    UnknownCollection: If the collection doesn't exist or has no documents.
+    """
+    if doc_id is not None:
+        return doc_id
+    if doc_ids is not None:
+        return list(dict.fromkeys(doc_ids))
+    documents = document_registry.collection_documents(collection_id)
+    if not documents:
+        raise UnknownCollection(f"No collection found with ID: {collection_id}")
+    return documents
@@ -0,0 +1,290 @@
+import hashlib
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import timedelta
+
+import lancedb
+import numpy as np
+import pyarrow as pa
+
+from utils.vector_storage import (
+    EMBEDDING_DIMENSIONS,
+    EMBEDDING_STORAGE_DTYPE,
+    STORAGE_DTYPES,
+    storage_dtype_of,
+    vectors_from_arrow,
+    vectors_to_arrow,
+)
+
+EMBEDDING_CACHE_URI = os.getenv("EMBEDDING_CACHE_URI", "~/.lancedb-cache")
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "10000"))
+
+# Maximum number of keys per `IN (...)` filter when looking up the on-disk tier
+_DISK_LOOKUP_BATCH = 512
+# Rebuild the scalar index on `key` after this many new rows, so lookups don't scan unindexed data
+_REINDEX_EVERY = 10000
+# Buffered entries are written to disk when there are this many of them, or after this many seconds
+_FLUSH_EVERY = 256
+_FLUSH_INTERVAL_S = 5.0
+
+
+def _schema(dtype: str):
+    fields = [
+        pa.field("key", pa.string()),
+        pa.field("model", pa.string()),
+        pa.field("vector", pa.list_(STORAGE_DTYPES[dtype], EMBEDDING_DIMENSIONS)),
+    ]
+    if dtype == "int8":
+        fields.append(pa.field("scale", pa.float32()))
+    return pa.schema(fields)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes a text before hashing, so that texts differing only in unicode form or whitespace
+    share the same cache entry.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model: str, text: str) -> str:
+    """
+    Returns the content address of a text for a given embedding model.
+    """
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache keyed by (model, normalized text hash).
+
+    - An in-memory LRU holds the most recently used vectors as float32 arrays.
+    - A LanceDB table persists every vector ever computed, so re-ingesting a document after a restart
+      doesn't cost any embedding call. Vectors are stored as EMBEDDING_STORAGE_DTYPE (an existing table
+      keeps the type it was created with).
+    """
+
+    def __init__(
+        self,
+        uri: str = EMBEDDING_CACHE_URI,
+        table_name: str = "embedding_cache",
+        max_memory_entries: int = EMBEDDING_CACHE_MEMORY_ENTRIES,
+    ):
+        self.uri = uri
+        self.table_name = table_name
+        self.max_memory_entries = max_memory_entries
+        self.storage_dtype = EMBEDDING_STORAGE_DTYPE
+        self._db = None
+        self._table = None
+        self._read_table = None
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        # Entries not written to disk yet, the ones being written, and the lock serializing the writes to
+        # the table (concurrent commits conflict)
+        self._pending = {}
+        self._flushing = {}
+        self._write_lock = threading.Lock()
+        self._flusher = None
+        self._rows_since_index = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    # --- on-disk tier -------------------------------------------------------------------------
+
+    def _open_table(self, create: bool = False):
+        if self._table is None:
+            if self._db is None:
+                self._db = lancedb.connect(self.uri)
+            if self.table_name in self._db.table_names():
+                self._table = self._db.open_table(self.table_name)
+                self.storage_dtype = storage_dtype_of(self._table.schema.field("vector").type)
+            elif create:
+                self._table = self._db.create_table(self.table_name, schema=_schema(self.storage_dtype))
+        return self._table
+
+    def _open_read_table(self):
+        # Lookups use their own table handle, which checks for new versions on each read: they read a
+        # snapshot instead of waiting for the writes, and a read on the writer's handle fails while it
+        # commits or rebuilds the index
+        if self._read_table is None:
+            db = lancedb.connect(self.uri, read_consistency_interval=timedelta(0))
+            if self.table_name not in db.table_names():
+                return None
+            table = db.open_table(self.table_name)
+            self.storage_dtype = storage_dtype_of(table.schema.field("vector").type)
+            self._read_table = table
+        return self._read_table
+
+    def _disk_get(self, keys):
+        table = self._open_read_table()
+        if table is None or not keys:
+            return {}
+        found = {}
+        columns = ["key", "vector", "scale"] if self.storage_dtype == "int8" else ["key", "vector"]
+        for start in range(0, len(keys), _DISK_LOOKUP_BATCH):
+            batch = keys[start : start + _DISK_LOOKUP_BATCH]
+            in_list = ", ".join(f"'{key}'" for key in batch)
+            rows = (
+                table.search()
+                .where(f"key IN ({in_list})")
+                .select(columns)
+                .limit(len(batch))
+                .to_arrow()
+            )
+            vectors = vectors_from_arrow(rows["vector"], rows["scale"] if "scale" in columns else None)
+            for key, vector in zip(rows["key"].to_pylist(), vectors):
+                found[key] = vector.copy()
+        return found
+
+    def _disk_put(self, keys, models, vectors):
+        table = self._open_table(create=True)
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(-1, EMBEDDING_DIMENSIONS)
+        vector_column, scales = vectors_to_arrow(matrix, self.storage_dtype)
+        columns = [pa.array(keys, pa.string()), pa.array(models, pa.string()), vector_column]
+        if scales is not None:
+            columns.append(scales)
+        batch = pa.Table.from_arrays(columns, schema=_schema(self.storage_dtype))
+        # Concurrent uploads of the same document may race on the same keys, only insert new ones
+        table.merge_insert("key").when_not_matched_insert_all().execute(batch)
+
+        self._rows_since_index += len(keys)
+        if self._rows_since_index >= _REINDEX_EVERY:
+            table.create_scalar_index("key", replace=True)
+            self._rows_since_index = 0
+
+    # --- in-memory tier -----------------------------------------------------------------------
+
+    def _memory_put(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    # --- public API ---------------------------------------------------------------------------
+
+    def get_many(self, model: str, texts):
+        """
+        Looks up the embeddings of several texts.
+
+        Parameters:
+        model (str): The embedding model the vectors must come from.
+        texts (list): The texts to look up.
+
+        Returns:
+        list: One float32 array per text, or None where the text is not cached.
+        """
+        keys = [cache_key(model, text) for text in texts]
+        results = [None] * len(keys)
+        missing = {}
+        with self._lock:
+            for idx, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                else:
+                    # Evicted from memory before it was written to disk
+                    entry = self._pending.get(key) or self._flushing.get(key)
+                    if entry is not None:
+                        vector = entry[1]
+                        self._memory_put(key, vector)
+                if vector is not None:
+                    results[idx] = vector
+                    self.memory_hits += 1
+                else:
+                    missing.setdefault(key, []).append(idx)
+
+        if missing:
+            try:
+                found = self._disk_get(list(missing))
+            except Exception as e:
+                print(f"Error reading embeddings from the cache: {e}")
+                found = {}
+            with self._lock:
+                for key, indices in missing.items():
+                    vector = found.get(key)
+                    if vector is None:
+                        self.misses += len(indices)
+                        continue
+                    self._memory_put(key, vector)
+                    self.disk_hits += len(indices)
+                    for idx in indices:
+                        results[idx] = vector
+        return results
+
+    def put_many(self, model: str, texts, vectors, flush: bool = True):
+        """
+        Stores the embeddings of several texts in both tiers.
+
+        Parameters:
+        model (str): The embedding model the vectors come from.
+        texts (list): The embedded texts.
+        vectors (list): The embedding vectors, in the same order as `texts`.
+        flush (bool): Write to disk before returning. Otherwise the entries are buffered and written
+        in batches by a background thread, which is what the query path uses to stay non-blocking.
+        """
+        if not texts:
+            return
+        entries = {}
+        for text, vector in zip(texts, vectors):
+            # Copy, a row of a document's matrix would otherwise keep the whole matrix alive
+            entries[cache_key(model, text)] = np.array(vector, dtype=np.float32)
+        with self._lock:
+            for key, vector in entries.items():
+                self._memory_put(key, vector)
+            self._pending.update((key, (model, vector)) for key, vector in entries.items())
+            flush = flush or len(self._pending) >= _FLUSH_EVERY
+            if not flush and self._flusher is None:
+                self._flusher = threading.Thread(
+                    target=self._flush_periodically, name="embedding-cache-flush", daemon=True
+                )
+                self._flusher.start()
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered entries to the on-disk tier.
+        """
+        with self._write_lock:
+            with self._lock:
+                # Still found by the lookups while they are written
+                pending, self._pending = self._pending, {}
+                self._flushing = pending
+            if not pending:
+                return
+            try:
+                models, vectors = zip(*pending.values())
+                self._disk_put(list(pending), list(models), list(vectors))
+            except Exception as e:
+                # The cache is an optimization, a failed write must not fail the upload
+                print(f"Error writing embeddings to the cache: {e}")
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(_FLUSH_INTERVAL_S)
+            self.flush()
+
+    def stats(self) -> dict:
+        """
+        Returns the hit/miss counters of the cache.
+        """
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "max_memory_entries": self.max_memory_entries,
+            }
+
+
+embedding_cache = EmbeddingCache()
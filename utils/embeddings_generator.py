@@ -1,115 +1,428 @@
-from openai import OpenAI
+import asyncio
+import base64
 import os
-from dotenv import load_dotenv
-import lancedb
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from utils.clients import get_async_embeddings_client, get_embeddings_client, openai_retryable_errors
+from utils.embedding_cache import embedding_cache, cache_key
+from utils.vector_storage import EMBEDDING_DIMENSIONS
+from utils.concurrency import embedding_flight, run_blocking, upstream_limit, lancedb_pool
+from utils.rate_limit import rate_governor
+from utils.tracing import span, record_tokens
+from utils.tokens import get_token_counter
 
 
-db = lancedb.connect("~/.lancedb-tabs")
+EMBEDDING_MODEL = "text-embedding-3-small"
 
-load_dotenv()
+# Request limits of the embeddings endpoint: at most 2048 inputs and 300k tokens per request.
+# We stay below the token limit to leave room for tokenizer differences.
+EMBEDDING_BATCH_MAX_INPUTS = int(os.getenv("EMBEDDING_BATCH_MAX_INPUTS", "2048"))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "250000"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+# Number of chunks sent per request by EmbeddingStream, as soon as that many chunks are produced
+EMBEDDING_STREAM_BATCH = int(os.getenv("EMBEDDING_STREAM_BATCH", "256"))
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Bounded pool shared by all uploads, so concurrent uploads cannot flood the API with requests
+_embedding_pool = ThreadPoolExecutor(
+    max_workers=EMBEDDING_MAX_CONCURRENCY, thread_name_prefix="embeddings"
+)
 
 
-def create_embeddings(text_chunks):
+class EmbeddedChunks:
     """
-    Generates embeddings for a list of text chunks using OpenAI's text-embedding-3-small model.
+    The chunks of a document and their embeddings, stored as one contiguous float32 matrix
+    (one row per chunk) rather than as lists of floats.
+
+    Iterating yields (text, vector) pairs, the vectors being rows (views) of the matrix. `pages` holds
+    the page number of each chunk when it is known (see `EmbeddingStream`), otherwise None.
+    """
+
+    def __init__(self, texts, vectors, pages=None):
+        self.texts = list(texts)
+        self.vectors = np.asarray(vectors, dtype=np.float32).reshape(len(self.texts), EMBEDDING_DIMENSIONS)
+        self.pages = list(pages) if pages is not None else None
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __iter__(self):
+        return zip(self.texts, self.vectors)
+
+
+def _decode_embeddings(response):
+    """
+    Returns the embeddings of a response as a float32 matrix, in input order.
+
+    The embeddings are requested base64-encoded: the response then carries their float32 bytes,
+    which are decoded straight into the matrix without going through Python floats.
+    """
+    data = sorted(response.data, key=lambda d: d.index)
+    matrix = np.empty((len(data), EMBEDDING_DIMENSIONS), dtype=np.float32)
+    for row, item in enumerate(data):
+        if isinstance(item.embedding, str):
+            matrix[row] = np.frombuffer(base64.b64decode(item.embedding), dtype="<f4")
+        else:
+            matrix[row] = item.embedding
+    return matrix
+
+
+def _get_token_counter():
+    return get_token_counter(EMBEDDING_MODEL)
+
+
+def _batch_chunks(text_chunks):
+    """
+    Groups text chunks into batches that respect the per-request input and token limits.
 
     Parameters:
-    text_chunks (list): A list of strings, where each string represents a chunk of text.
+    text_chunks (list): A list of strings to embed.
 
     Returns:
-    list: A list of tuples, where each tuple contains the original text chunk and its corresponding embedding vector.
-    """
-    embeddings = []
-    for chunk in text_chunks:
-        response = (
-            client.embeddings.create(
-                input=[chunk],
-                model="text-embedding-3-small",
-            )
-            .data[0]
-            .embedding
-        )
+    list: A list of lists of chunk indices, in chunk order.
+    """
+    count_tokens = _get_token_counter()
+    batches = []
+    current, current_tokens = [], 0
+    for idx, chunk in enumerate(text_chunks):
+        n_tokens = count_tokens(chunk)
+        if current and (
+            len(current) >= EMBEDDING_BATCH_MAX_INPUTS
+            or current_tokens + n_tokens > EMBEDDING_BATCH_MAX_TOKENS
+        ):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(idx)
+        current_tokens += n_tokens
+    if current:
+        batches.append(current)
+    return batches
 
-        embeddings.append((chunk, response))
-    return embeddings
 
+def _batch_tokens(batch) -> int:
+    # An estimate is enough to pace the requests, see `rate_governor`
+    count_tokens = get_token_counter(EMBEDDING_MODEL, upper_bound=False)
+    return sum(count_tokens(text) for text in batch)
 
-def store_embeddings(doc_id, embeddings):
+
+def _retry_delay(error, attempt):
+    """
+    Returns how long to wait before retrying a failed request: the server's Retry-After hint if it
+    sent one, otherwise an exponential backoff with full jitter.
     """
-    Stores embeddings into a database after validating the format and creating the necessary table.
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return random.uniform(0, min(60.0, 0.5 * 2**attempt))
+
+
+def _backoff(error, attempt) -> float:
+    """
+    Returns the delay before retrying a failed embedding request. A rate limit also holds the other
+    embedding requests for that long, instead of letting them hit the limit in turn.
+    """
+    delay = _retry_delay(error, attempt)
+    if getattr(error, "status_code", None) == 429:
+        rate_governor("openai_embeddings").pause(delay)
+    print(f"Embedding request failed ({type(error).__name__}), retrying in {delay:.1f}s")
+    return delay
+
+
+def _embed_batch(batch):
+    """
+    Embeds one batch of texts, retrying with backoff on rate limits and transient errors. Requests are
+    paced to OPENAI_EMBEDDINGS_RPM/TPM by the rate governor.
 
     Parameters:
-    doc_id (str): The unique identifier for the document whose embeddings are being stored.
-    embeddings (list): A list of tuples, where each tuple contains a text chunk and its corresponding embedding.
+    batch (list): A list of strings to embed in a single request.
 
     Returns:
-    None: The function inserts the embeddings into a database table, but does not return any value.
-    It prints status messages indicating whether the table was created, if any errors occurred,
-    and the number of records successfully inserted.
+    np.ndarray: The float32 embedding vectors, one row per text of the batch.
+    """
+    tokens = _batch_tokens(batch)
+    for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+        rate_governor("openai_embeddings").acquire(tokens)
+        try:
+            with span("openai.embeddings", inputs=len(batch), attempt=attempt):
+                response = get_embeddings_client().embeddings.create(
+                    input=batch, model=EMBEDDING_MODEL, encoding_format="base64"
+                )
+            record_tokens(EMBEDDING_MODEL, getattr(response, "usage", None))
+            return _decode_embeddings(response)
+        except openai_retryable_errors() as e:
+            if attempt == EMBEDDING_MAX_RETRIES:
+                raise
+            time.sleep(_backoff(e, attempt))
 
-    Notes:
-    - If the database table does not already exist, it will be created with the columns: "doc_id", "text", and "embedding".
-    - The embeddings are inserted in batches to optimize database interaction.
-    - If an item in the embeddings list does not match the expected format (tuple of two elements), an error message will be printed.
+
+def _embed_texts(texts):
     """
-    # Step 1: Try to create the table if it doesn't already exist
-    table_name = "embeddings"
-    try:
-        db.create_table(table_name, ["doc_id", "text", "embedding"])
-        print(f"Table '{table_name}' created.")
-    except Exception as e:
-        # If the table exists or there is any other error, log it
-        print(f"Table '{table_name}' already exists or error: {e}")
+    Embeds texts in batches through the bounded pool.
 
-    # Step 2: Initialize an empty list to store the records (dictionaries) to insert into the database
-    records_to_insert = []
+    Parameters:
+    texts (list): A list of strings to embed.
 
-    # Loop through each item in the embeddings
-    for item in embeddings:
+    Returns:
+    np.ndarray: The float32 embedding vectors, one row per text.
+    """
+    # Step 1: Split the texts into batches that fit in one request
+    batches = _batch_chunks(texts)
+
+    # Step 2: Embed the batches concurrently, map() yields the results in submission order
+    results = _embedding_pool.map(
+        _embed_batch, [[texts[idx] for idx in batch] for batch in batches]
+    )
+
+    # Step 3: Reassemble the embeddings in text order
+    vectors = np.empty((len(texts), EMBEDDING_DIMENSIONS), dtype=np.float32)
+    for batch, batch_vectors in zip(batches, results):
+        vectors[batch] = batch_vectors
+    return vectors
+
+
+async def _embed_batch_async(batch):
+    """
+    Async version of `_embed_batch`, bounded by the "openai_embeddings" upstream limit.
+    """
+    tokens = _batch_tokens(batch)
+    for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+        # Wait for the rate governor before taking a slot, so that waiting calls don't hold one
+        await rate_governor("openai_embeddings").acquire_async(tokens)
         try:
-            # Ensure the item is a tuple with exactly 2 elements (text and embedding)
-            if isinstance(item, tuple) and len(item) == 2:
-                text, embedding = (
-                    item  # Unpack the tuple into text and embedding variables
-                )
-                # Create a dictionary with doc_id, text, and embedding, and append it to the records list
-                record = {"doc_id": doc_id, "text": text, "embedding": embedding}
-                records_to_insert.append(record)
-            else:
-                # If the item is not a tuple or has an incorrect number of elements, print an error message
-                print(f"Invalid item format (expected tuple of 2 elements): {item}")
-        except Exception as e:
-            # Print an error message if there is an issue processing the chunk
-            print(f"Error processing chunk: {item}\nError: {e}")
-
-    # Step 3: Attempt to insert the list of records into the database
-    try:
-        # Open the table where the records will be inserted
-        tbl = db.open_table(table_name)
-        # Add the list of records to the table
-        tbl.add(records_to_insert)
+            async with upstream_limit("openai_embeddings"):
+                with span("openai.embeddings", inputs=len(batch), attempt=attempt):
+                    response = await get_async_embeddings_client().embeddings.create(
+                        input=batch, model=EMBEDDING_MODEL, encoding_format="base64"
+                    )
+            record_tokens(EMBEDDING_MODEL, getattr(response, "usage", None))
+            return _decode_embeddings(response)
+        except openai_retryable_errors() as e:
+            if attempt == EMBEDDING_MAX_RETRIES:
+                raise
+            await asyncio.sleep(_backoff(e, attempt))
 
-        # Step 4: Print how many records were successfully inserted
-        print(f"Inserted {len(records_to_insert)} records into '{table_name}'.")
-    except Exception as e:
-        # If there's an error inserting records, print the error message
-        print(f"Error inserting records into the database: {e}")
+
+def create_embeddings(text_chunks):
+    """
+    Generates embeddings for a list of text chunks using OpenAI's text-embedding-3-small model.
+
+    Embeddings already in the embedding cache are reused, so re-ingesting an unchanged document doesn't
+    call the API at all. The remaining chunks are grouped into batches that respect the API's token and
+    request-size limits, and the batches are sent concurrently through a bounded pool. Rate-limited
+    batches are retried with backoff.
+
+    Parameters:
+    text_chunks (list): A list of strings, where each string represents a chunk of text.
+
+    Returns:
+    EmbeddedChunks: The chunks and their embeddings as a float32 matrix, in the same order as `text_chunks`.
+    Iterating over it yields (text, vector) tuples.
+    """
+    text_chunks = list(text_chunks)
+    matrix = np.empty((len(text_chunks), EMBEDDING_DIMENSIONS), dtype=np.float32)
+    if not text_chunks:
+        return EmbeddedChunks(text_chunks, matrix)
+
+    # Step 1: Look up the chunks in the cache
+    missing = {}
+    with span("embedding.cache", chunks=len(text_chunks)):
+        cached = embedding_cache.get_many(EMBEDDING_MODEL, text_chunks)
+    for idx, vector in enumerate(cached):
+        if vector is None:
+            missing.setdefault(cache_key(EMBEDDING_MODEL, text_chunks[idx]), []).append(idx)
+        else:
+            matrix[idx] = vector
+
+    # Step 2: Embed the missing chunks, once per distinct cache key
+    if missing:
+        texts = [text_chunks[indices[0]] for indices in missing.values()]
+        new_vectors = _embed_texts(texts)
+        embedding_cache.put_many(EMBEDDING_MODEL, texts, new_vectors)
+        for indices, vector in zip(missing.values(), new_vectors):
+            matrix[indices] = vector
+
+    return EmbeddedChunks(text_chunks, matrix)
+
+
+def _embed_cached_batch(texts):
+    """
+    Embeds one batch of texts in a single request, reusing the cached embeddings.
+    The batch must fit in one request (see `_batch_chunks`).
+    """
+    matrix = np.empty((len(texts), EMBEDDING_DIMENSIONS), dtype=np.float32)
+    with span("embedding.cache", chunks=len(texts)):
+        cached = embedding_cache.get_many(EMBEDDING_MODEL, texts)
+    missing = [idx for idx, vector in enumerate(cached) if vector is None]
+    for idx, vector in enumerate(cached):
+        if vector is not None:
+            matrix[idx] = vector
+    if missing:
+        new_vectors = _embed_batch([texts[idx] for idx in missing])
+        # Buffered, the stream writes the cache to disk once all the batches are embedded
+        embedding_cache.put_many(EMBEDDING_MODEL, [texts[idx] for idx in missing], new_vectors, flush=False)
+        matrix[missing] = new_vectors
+    return matrix
+
+
+class EmbeddingStream:
+    """
+    Embeds chunks while they are being produced, e.g. while the later pages of a PDF are still parsed
+    (see `PDFChunkStream`): every EMBEDDING_STREAM_BATCH chunks added, a batch is sent through the
+    bounded pool, and `result()` waits for the last ones. The cache is used as in `create_embeddings`.
+
+    Usage:
+        stream = EmbeddingStream()
+        for chunk in chunks:
+            stream.add(chunk.text, chunk.page)
+        embedded = stream.result()
+    """
+
+    def __init__(self, batch_size: int = EMBEDDING_STREAM_BATCH):
+        self.batch_size = max(1, min(batch_size, EMBEDDING_BATCH_MAX_INPUTS))
+        self.texts = []
+        self.pages = []
+        self._sent = 0
+        self._batch_tokens = 0
+        self._futures = []
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, text: str, page: int = None):
+        n_tokens = _get_token_counter()(text)
+        if self._batch_tokens + n_tokens > EMBEDDING_BATCH_MAX_TOKENS:
+            self._send()
+        self.texts.append(text)
+        self.pages.append(page)
+        self._batch_tokens += n_tokens
+        if len(self.texts) - self._sent >= self.batch_size:
+            self._send()
+
+    def _send(self):
+        if self._sent == len(self.texts):
+            return
+        start, stop = self._sent, len(self.texts)
+        self._futures.append((start, stop, _embedding_pool.submit(_embed_cached_batch, self.texts[start:stop])))
+        self._sent, self._batch_tokens = stop, 0
+
+    def result(self) -> EmbeddedChunks:
+        """
+        Sends the remaining chunks and returns all the chunks with their embeddings, in the order added.
+        """
+        self._send()
+        matrix = np.empty((len(self.texts), EMBEDDING_DIMENSIONS), dtype=np.float32)
+        for start, stop, future in self._futures:
+            matrix[start:stop] = future.result()
+        embedding_cache.flush()
+        pages = self.pages if any(page is not None for page in self.pages) else None
+        return EmbeddedChunks(self.texts, matrix, pages)
+
+    def cancel(self):
+        """
+        Drops the batches not sent yet to the API, e.g. when the producer failed.
+        """
+        for _, _, future in self._futures:
+            future.cancel()
+        self._futures = []
 
 
 def get_query_embedding(query):
     """
-    Generates an embedding vector for a given query using OpenAI's API.
+    Generates an embedding vector for a given query using OpenAI's API, or returns it from the
+    embedding cache when the same query was embedded before. The vector is a float32 array.
     """
     try:
-        response = client.embeddings.create(
-            input=[query],
-            model="text-embedding-3-small",
+        with span("embedding.cache") as cache_span:
+            cached = embedding_cache.get_many(EMBEDDING_MODEL, [query])[0]
+            cache_span.set(hit=cached is not None)
+        if cached is not None:
+            return cached
+        # Concurrent requests for the same query share one API call
+        embedding = embedding_flight.do(
+            cache_key(EMBEDDING_MODEL, query), lambda: _embed_batch([query])[0]
         )
-        embedding = response.data[0].embedding
+        embedding_cache.put_many(EMBEDDING_MODEL, [query], [embedding], flush=False)
+        return embedding
+    except Exception as e:
+        print(f"Error generating embedding: {e}")
+        return None
+
+
+async def get_query_embedding_async(query):
+    """
+    Async version of `get_query_embedding`, for the request handlers.
+    """
+    try:
+        # The cache may read its on-disk tier, keep that off the event loop
+        with span("embedding.cache") as cache_span:
+            cached = (
+                await run_blocking(
+                    embedding_cache.get_many, EMBEDDING_MODEL, [query], executor=lancedb_pool
+                )
+            )[0]
+            cache_span.set(hit=cached is not None)
+        if cached is not None:
+            return cached
+
+        # Concurrent requests for the same query share one API call
+        async def embed():
+            return (await _embed_batch_async([query]))[0]
+
+        embedding = await embedding_flight.do_async(cache_key(EMBEDDING_MODEL, query), embed)
+        # Only buffered, the cache writes it to disk in the background
+        embedding_cache.put_many(EMBEDDING_MODEL, [query], [embedding], flush=False)
         return embedding
     except Exception as e:
         print(f"Error generating embedding: {e}")
         return None
+
+
+async def get_query_embeddings_async(queries):
+    """
+    Embeds several queries at once, for batch retrieval: cached queries are served from the embedding
+    cache and the others are embedded in as few requests as the batch limits allow (see `_batch_chunks`),
+    instead of one request per query.
+
+    Parameters:
+    queries (list): The query strings.
+
+    Returns:
+    np.ndarray: The float32 query embeddings, one row per query.
+    """
+    matrix = np.empty((len(queries), EMBEDDING_DIMENSIONS), dtype=np.float32)
+
+    # Step 1: Look up the queries in the cache (it may read its on-disk tier, keep that off the event loop)
+    with span("embedding.cache", queries=len(queries)):
+        cached = await run_blocking(
+            embedding_cache.get_many, EMBEDDING_MODEL, queries, executor=lancedb_pool
+        )
+    missing = {}
+    for idx, vector in enumerate(cached):
+        if vector is None:
+            missing.setdefault(cache_key(EMBEDDING_MODEL, queries[idx]), []).append(idx)
+        else:
+            matrix[idx] = vector
+    if not missing:
+        return matrix
+
+    # Step 2: Embed the missing queries, once per distinct cache key, the batches concurrently
+    texts = [queries[indices[0]] for indices in missing.values()]
+    batches = _batch_chunks(texts)
+    results = await asyncio.gather(
+        *(_embed_batch_async([texts[idx] for idx in batch]) for batch in batches)
+    )
+    new_vectors = np.empty((len(texts), EMBEDDING_DIMENSIONS), dtype=np.float32)
+    for batch, batch_vectors in zip(batches, results):
+        new_vectors[batch] = batch_vectors
+    for indices, vector in zip(missing.values(), new_vectors):
+        matrix[indices] = vector
+
+    # Only buffered, the cache writes them to disk in the background
+    embedding_cache.put_many(EMBEDDING_MODEL, texts, new_vectors, flush=False)
+    return matrix
@@ -0,0 +1,189 @@
+import asyncio
+import os
+
+from utils.answer_cache import ANSWER_CACHE_MAX_ENTRIES, AnswerCache, scope_key
+from utils.clients import get_async_chat_client
+from utils.concurrency import chat_flight, upstream_limit
+from utils.context_builder import build_context
+from utils.Knowlege_graph import retrieve_relevant_chunks_from_db_async, retrieve_relevant_chunks_multi_async
+from utils.rate_limit import rate_governor
+from utils.tokens import estimate_chat_tokens
+from utils.tracing import record_tokens, span
+
+# Strategies tried in order when an answer is not relevant, until one of them returns an answer
+# (see FALLBACK_STRATEGIES). The templated response is the last resort in any case.
+ANSWER_FALLBACK_STRATEGIES = [
+    name.strip() for name in os.getenv("ANSWER_FALLBACK_STRATEGIES", "graph,template").split(",") if name.strip()
+]
+# Fallback answers are cached per (document, question) for this long, and dropped when the document
+# is re-ingested
+FALLBACK_CACHE_TTL_S = float(os.getenv("FALLBACK_CACHE_TTL_S", "86400"))
+
+# "graph": chunks retrieved with their graph neighbours, over a wider top_k than the answer's context
+FALLBACK_GRAPH_TOP_K = int(os.getenv("FALLBACK_GRAPH_TOP_K", "24"))
+FALLBACK_GRAPH_HOPS = int(os.getenv("FALLBACK_GRAPH_HOPS", "2"))
+FALLBACK_GRAPH_CONTEXT_TOKENS = int(os.getenv("FALLBACK_GRAPH_CONTEXT_TOKENS", "200"))
+# "completion": a single short completion, without the document
+FALLBACK_COMPLETION_MODEL = os.getenv("FALLBACK_COMPLETION_MODEL", "gpt-3.5-turbo")
+FALLBACK_COMPLETION_MAX_TOKENS = int(os.getenv("FALLBACK_COMPLETION_MAX_TOKENS", "150"))
+
+FALLBACK_PREFIX = "Sorry, I couldn't find a relevant answer from the document."
+FALLBACK_TEMPLATE = (
+    FALLBACK_PREFIX + " Try rephrasing your question, or ask about a topic that the document covers."
+)
+FALLBACK_COMPLETION_PROMPT = (
+    "The user's document doesn't answer their question. Answer it briefly from general knowledge, in a "
+    "friendly tone, without claiming that the answer comes from the document."
+)
+
+fallback_cache = AnswerCache(ttl_s=FALLBACK_CACHE_TTL_S, max_entries=ANSWER_CACHE_MAX_ENTRIES)
+
+
+def _timeout_s(name: str, default: float) -> float:
+    return float(os.getenv(f"FALLBACK_{name.upper()}_TIMEOUT_S", str(default)))
+
+
+class FallbackStrategy:
+    """
+    A way of answering a question that the document's context didn't answer.
+
+    `run(doc_id, query, sources)` is a coroutine returning the answer text, or None to let the next
+    strategy answer. doc_id is a document ID or a list of them, and `sources` are the chunks already used
+    as context for the irrelevant answer.
+    It is cancelled after `timeout_s` (FALLBACK_<NAME>_TIMEOUT_S).
+    """
+
+    def __init__(self, name: str, run, timeout_s: float):
+        self.name = name
+        self.run = run
+        self.timeout_s = timeout_s
+
+
+async def _template_fallback(doc_id: str, query: str, sources: list):
+    return FALLBACK_TEMPLATE
+
+
+async def _graph_fallback(doc_id: str, query: str, sources: list):
+    # Step 1: Retrieve a wider neighbourhood of the question in the similarity graph (and across documents)
+    if isinstance(doc_id, str):
+        chunks = await retrieve_relevant_chunks_from_db_async(
+            doc_id, query, top_k=FALLBACK_GRAPH_TOP_K, mode="graph", hops=FALLBACK_GRAPH_HOPS
+        )
+    else:
+        chunks, _ = await retrieve_relevant_chunks_multi_async(
+            doc_id, query, top_k=FALLBACK_GRAPH_TOP_K, mode="graph", hops=FALLBACK_GRAPH_HOPS, cross_document=True
+        )
+
+    # Step 2: Keep the chunks that were not already judged irrelevant
+    used = {chunk["node_id"] for chunk in sources}
+    chunks = [chunk for chunk in chunks if chunk["node_id"] not in used]
+    if not chunks:
+        return None
+    context, _ = build_context(chunks, budget=FALLBACK_GRAPH_CONTEXT_TOKENS)
+    return f"{FALLBACK_PREFIX} These passages of the document may be related:\n\n{context}"
+
+
+async def _completion_fallback(doc_id: str, query: str, sources: list):
+    messages = [
+        {"role": "system", "content": FALLBACK_COMPLETION_PROMPT},
+        {"role": "user", "content": query},
+    ]
+
+    async def complete():
+        tokens = estimate_chat_tokens(messages, FALLBACK_COMPLETION_MODEL, FALLBACK_COMPLETION_MAX_TOKENS)
+        await rate_governor("openai_chat").acquire_async(tokens)
+        async with upstream_limit("openai_chat"):
+            with span("openai.chat", model=FALLBACK_COMPLETION_MODEL):
+                response = await get_async_chat_client().chat.completions.create(
+                    messages=messages, model=FALLBACK_COMPLETION_MODEL, max_tokens=FALLBACK_COMPLETION_MAX_TOKENS
+                )
+        record_tokens(FALLBACK_COMPLETION_MODEL, getattr(response, "usage", None))
+        return response
+
+    # Identical questions in flight share one completion
+    response = await chat_flight.do_async((FALLBACK_COMPLETION_MODEL, query), complete)
+    content = (response.choices[0].message.content or "").strip()
+    if not content:
+        return None
+    return f"{FALLBACK_PREFIX} Here's an alternative answer to your question: {content}"
+
+
+# Available strategies, by name (see ANSWER_FALLBACK_STRATEGIES and `register_fallback_strategy`)
+FALLBACK_STRATEGIES = {}
+
+
+def register_fallback_strategy(strategy: FallbackStrategy):
+    """
+    Makes a strategy available to ANSWER_FALLBACK_STRATEGIES, replacing the one with the same name.
+    """
+    FALLBACK_STRATEGIES[strategy.name] = strategy
+
+
+register_fallback_strategy(FallbackStrategy("template", _template_fallback, _timeout_s("template", 1)))
+register_fallback_strategy(FallbackStrategy("graph", _graph_fallback, _timeout_s("graph", 2)))
+register_fallback_strategy(FallbackStrategy("completion", _completion_fallback, _timeout_s("completion", 5)))
+
+
+async def fallback_answer(doc_id, query: str, sources: list = ()) -> str:
+    """
+    Answers a question that the document's context didn't answer, with the ANSWER_FALLBACK_STRATEGIES
+    in order: the first answer returned within its strategy's timeout is used, and cached for the same
+    question on the same documents. A strategy that fails or times out is skipped, and the templated
+    response is returned if none of them answered.
+
+    Each strategy runs in its own span ("answer.fallback.<name>"), so their latency and errors are
+    reported separately in /metrics.
+
+    Parameters:
+    doc_id (str or list): The document that was searched, or the documents searched together.
+    query (str): The question.
+    sources (list): The chunks used as context for the irrelevant answer.
+
+    Returns:
+    str: The fallback answer.
+    """
+    with span("answer.fallback") as fallback_span:
+        # Step 1: Reuse the fallback answer of the same question
+        cached = fallback_cache.get_exact(scope_key(doc_id), query, count_miss=True)
+        if cached is not None:
+            fallback_span.set(strategy=cached["strategy"], cached=True)
+            return cached["answer"]
+
+        # Step 2: Try the strategies in order
+        for name in ANSWER_FALLBACK_STRATEGIES:
+            strategy = FALLBACK_STRATEGIES.get(name)
+            if strategy is None:
+                print(f"Unknown fallback strategy '{name}', skipped.")
+                continue
+            try:
+                with span(f"answer.fallback.{name}"):
+                    answer = await asyncio.wait_for(strategy.run(doc_id, query, list(sources)), strategy.timeout_s)
+            except asyncio.TimeoutError:
+                print(f"Fallback strategy '{name}' timed out after {strategy.timeout_s}s.")
+                continue
+            except Exception as e:
+                print(f"Fallback strategy '{name}' failed: {e}")
+                continue
+            if answer:
+                fallback_span.set(strategy=name, cached=False)
+                fallback_cache.put(scope_key(doc_id), query, None, {"answer": answer, "strategy": name})
+                return answer
+
+        # Not cached: the strategies may answer next time
+        fallback_span.set(strategy=None, cached=False)
+        return FALLBACK_TEMPLATE
+
+
+def fallback_status() -> dict:
+    """
+    Returns the configured strategies with their timeout, and the fallback cache statistics.
+    """
+    return {
+        "strategies": [
+            {"name": name, "timeout_s": FALLBACK_STRATEGIES[name].timeout_s}
+            for name in ANSWER_FALLBACK_STRATEGIES
+            if name in FALLBACK_STRATEGIES
+        ],
+        "available": sorted(FALLBACK_STRATEGIES),
+        "cache": fallback_cache.stats(),
+    }
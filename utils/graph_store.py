@@ -0,0 +1,284 @@
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.document_registry import DOC_ID_PATTERN
+
+GRAPH_STORE_DIR = os.path.expanduser(os.getenv("GRAPH_STORE_DIR", "~/.lancedb-graphs"))
+# Number of graphs kept open in memory
+GRAPH_CACHE_SIZE = int(os.getenv("GRAPH_CACHE_SIZE", "64"))
+
+
+
+class CSRGraph:
+    """
+    Undirected weighted graph stored as a CSR adjacency: the neighbours of node i are
+    indices[indptr[i]:indptr[i + 1]], with the similarities in the same slice of weights.
+
+    The arrays may be memory-mapped, so opening a graph only reads the pages that are used.
+    """
+
+    def __init__(self, indptr, indices, weights):
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.indptr) - 1
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.indices) // 2
+
+    def neighbours(self, node: int):
+        """
+        Returns the (indices, weights) arrays of the neighbours of a node.
+        """
+        if node < 0 or node >= self.n_nodes:
+            return self.indices[:0], self.weights[:0]
+        start, end = self.indptr[node], self.indptr[node + 1]
+        return self.indices[start:end], self.weights[start:end]
+
+    @classmethod
+    def from_edges(cls, n_nodes, rows, cols, weights):
+        """
+        Builds the CSR adjacency from a list of undirected edges.
+
+        Parameters:
+        n_nodes (int): The number of nodes (chunks) of the document.
+        rows, cols (np.ndarray): The two ends of each edge.
+        weights (np.ndarray): The similarity of each edge.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float32)
+
+        # Each edge is stored in both directions, sorted by source node then destination node
+        sources = np.concatenate([rows, cols])
+        targets = np.concatenate([cols, rows])
+        order = np.lexsort((targets, sources))
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n_nodes), out=indptr[1:])
+        return cls(
+            indptr,
+            targets[order].astype(np.int32),
+            np.concatenate([weights, weights])[order],
+        )
+
+
+def _graph_dir(doc_id: str) -> str:
+    # doc_id ends up in a path, refuse anything that could escape the store directory
+    if not re.match(DOC_ID_PATTERN, doc_id):
+        raise ValueError(f"Invalid document ID: {doc_id!r}")
+    return os.path.join(GRAPH_STORE_DIR, doc_id)
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+# Reads of a graph whose version is replaced while it is read are retried
+_LOAD_ATTEMPTS = 3
+
+
+def save_graph(doc_id: str, graph: CSRGraph):
+    """
+    Persists the graph of a document as three .npy files, replacing any previous version atomically.
+
+    Each version is written to its own directory, and the document's path is a symlink to the current
+    one, swapped with a rename: a reader finds either version, never a missing or partial graph. The
+    previous version is deleted once it is unlinked (graphs already memory-mapped stay readable).
+    """
+    target = _graph_dir(doc_id)
+    os.makedirs(GRAPH_STORE_DIR, exist_ok=True)
+
+    # Step 1: Write the new version
+    version = tempfile.mkdtemp(prefix=f".{doc_id}-", dir=GRAPH_STORE_DIR)
+    np.save(os.path.join(version, "indptr.npy"), graph.indptr)
+    np.save(os.path.join(version, "indices.npy"), graph.indices)
+    np.save(os.path.join(version, "weights.npy"), graph.weights)
+
+    # Step 2: Point the document's path to it
+    previous = None
+    if os.path.islink(target):
+        previous = os.path.join(GRAPH_STORE_DIR, os.readlink(target))
+    elif os.path.isdir(target):
+        # Graphs saved before versions were linked are plain directories, which a link can't replace
+        previous = version + ".previous"
+        os.replace(target, previous)
+    link = version + ".link"
+    os.symlink(os.path.basename(version), link)
+    os.replace(link, target)
+    invalidate_graph(doc_id)
+
+    # Step 3: Delete the previous version
+    if previous is not None:
+        shutil.rmtree(previous, ignore_errors=True)
+
+
+def load_graph(doc_id: str):
+    """
+    Returns the graph of a document, memory-mapped from disk on first use and then kept in an LRU.
+
+    Returns:
+    CSRGraph or None: None if no graph was stored for this document.
+    """
+    with _cache_lock:
+        graph = _cache.get(doc_id)
+        if graph is not None:
+            _cache.move_to_end(doc_id)
+            return graph
+
+    directory = _graph_dir(doc_id)
+    for attempt in range(_LOAD_ATTEMPTS):
+        # The three files are read from the same version, which is deleted if a new one is saved meanwhile
+        version = os.path.realpath(directory)
+        try:
+            graph = CSRGraph(
+                np.load(os.path.join(version, "indptr.npy"), mmap_mode="r"),
+                np.load(os.path.join(version, "indices.npy"), mmap_mode="r"),
+                np.load(os.path.join(version, "weights.npy"), mmap_mode="r"),
+            )
+            break
+        except FileNotFoundError:
+            if not os.path.lexists(directory):
+                return None
+            if attempt == _LOAD_ATTEMPTS - 1:
+                raise
+
+    with _cache_lock:
+        _cache[doc_id] = graph
+        _cache.move_to_end(doc_id)
+        while len(_cache) > GRAPH_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return graph
+
+
+def invalidate_graph(doc_id: str):
+    """
+    Drops a document's graph from the in-memory LRU, so the next load reads it from disk again.
+    """
+    with _cache_lock:
+        _cache.pop(doc_id, None)
+
+
+class CrossDocumentEdges:
+    """
+    The edges from the chunks of a document to highly similar chunks of other documents (e.g. of the same
+    collection), sorted by source node: edge i goes from `nodes[i]` to chunk `target_nodes[i]` of document
+    `documents[target_documents[i]]`, with similarity `weights[i]`.
+    """
+
+    def __init__(self, documents, nodes, target_documents, target_nodes, weights):
+        order = np.argsort(nodes, kind="stable")
+        self.documents = list(documents)
+        self.nodes = np.asarray(nodes, dtype=np.int64)[order]
+        self.target_documents = np.asarray(target_documents, dtype=np.int32)[order]
+        self.target_nodes = np.asarray(target_nodes, dtype=np.int64)[order]
+        self.weights = np.asarray(weights, dtype=np.float32)[order]
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], [], [], [])
+
+    def neighbours(self, node: int) -> list:
+        """
+        Returns the (doc_id, node, weight) chunks of other documents linked to a node.
+        """
+        start, end = np.searchsorted(self.nodes, [node, node + 1])
+        return [
+            (self.documents[document], int(target), float(weight))
+            for document, target, weight in zip(
+                self.target_documents[start:end], self.target_nodes[start:end], self.weights[start:end]
+            )
+        ]
+
+    def edges(self):
+        """
+        Yields the (node, doc_id, target node, weight) edges.
+        """
+        for node, document, target, weight in zip(self.nodes, self.target_documents, self.target_nodes, self.weights):
+            yield int(node), self.documents[document], int(target), float(weight)
+
+    @classmethod
+    def from_edges(cls, edges):
+        """
+        Builds the edges from (node, doc_id, target node, weight) tuples.
+        """
+        edges = list(edges)
+        documents = sorted({edge[1] for edge in edges})
+        position = {doc_id: idx for idx, doc_id in enumerate(documents)}
+        return cls(
+            documents,
+            [edge[0] for edge in edges],
+            [position[edge[1]] for edge in edges],
+            [edge[2] for edge in edges],
+            [edge[3] for edge in edges],
+        )
+
+
+def _cross_edges_path(doc_id: str) -> str:
+    # Kept outside of the graph's versions, which are replaced when the graph is saved. No doc_id can
+    # start with a dot, so the directory can't clash with a graph's.
+    _graph_dir(doc_id)
+    return os.path.join(GRAPH_STORE_DIR, ".cross-document", f"{doc_id}.npz")
+
+
+def save_cross_edges(doc_id: str, edges: CrossDocumentEdges):
+    """
+    Persists the cross-document edges of a document, replacing any previous version atomically.
+    """
+    path = _cross_edges_path(doc_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, staging = tempfile.mkstemp(prefix=f".{doc_id}-", suffix=".npz", dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        np.savez(
+            f,
+            documents=np.array(edges.documents, dtype=str),
+            nodes=edges.nodes,
+            target_documents=edges.target_documents,
+            target_nodes=edges.target_nodes,
+            weights=edges.weights,
+        )
+    os.replace(staging, path)
+    with _cache_lock:
+        _cache.pop(("cross", doc_id), None)
+
+
+def load_cross_edges(doc_id: str) -> CrossDocumentEdges:
+    """
+    Returns the cross-document edges of a document (none if it was never linked), kept in the graphs' LRU.
+    """
+    key = ("cross", doc_id)
+    with _cache_lock:
+        edges = _cache.get(key)
+        if edges is not None:
+            _cache.move_to_end(key)
+            return edges
+
+    path = _cross_edges_path(doc_id)
+    if not os.path.exists(path):
+        edges = CrossDocumentEdges.empty()
+    else:
+        with np.load(path) as arrays:
+            edges = CrossDocumentEdges(
+                arrays["documents"].tolist(),
+                arrays["nodes"],
+                arrays["target_documents"],
+                arrays["target_nodes"],
+                arrays["weights"],
+            )
+
+    with _cache_lock:
+        _cache[key] = edges
+        _cache.move_to_end(key)
+        while len(_cache) > GRAPH_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return edges
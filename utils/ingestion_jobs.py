@@ -0,0 +1,477 @@
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+import traceback
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from uuid import uuid4
+
+from utils.pdf_processor import PDFChunkStream, download_pdf
+from utils.embeddings_generator import EmbeddingStream, create_embeddings
+from utils.Knowlege_graph import (
+    NODES_TABLE,
+    apply_chunk_diff,
+    build_graph,
+    diff_document_chunks,
+    link_document,
+    store_graph_nodes,
+    update_graph,
+)
+from utils.answer_cache import answer_cache
+from utils.clients import get_db
+from utils.document_registry import DOC_ID_PATTERN, document_registry
+from utils.fallback import fallback_cache
+from utils.tracing import span
+
+# Ingestion runner: "thread" (pipelined in-process worker pool) or "inline" (runs in the caller's thread)
+INGESTION_RUNNER = os.getenv("INGESTION_RUNNER", "thread")
+# Number of worker threads per stage of the pipeline
+INGESTION_WORKERS_PER_STAGE = int(os.getenv("INGESTION_WORKERS_PER_STAGE", "2"))
+# Capacity of the queues between stages, a full queue blocks the previous stage (backpressure)
+INGESTION_STAGE_QUEUE_SIZE = int(os.getenv("INGESTION_STAGE_QUEUE_SIZE", "4"))
+# Maximum number of jobs waiting for the first stage, further uploads are rejected
+INGESTION_MAX_PENDING = int(os.getenv("INGESTION_MAX_PENDING", "100"))
+# Number of finished jobs whose status is kept
+INGESTION_JOB_HISTORY = int(os.getenv("INGESTION_JOB_HISTORY", "1000"))
+
+
+class IngestionQueueFull(Exception):
+    pass
+
+
+class UnknownDocument(Exception):
+    pass
+
+
+class IngestionInProgress(Exception):
+    pass
+
+
+class IngestionJob:
+    """
+    An upload being processed: its identifiers, overall status and per-stage progress and timings.
+
+    Intermediate results (the downloaded buffer, the chunks, the embeddings) are kept in `context`
+    while the job moves through the pipeline, and released when it finishes.
+
+    An update job (`update=True`) stores only the differences with the stored version of the document,
+    see `submit_update`. `pinned` is False when its doc_id was not given explicitly, in which case a
+    stored document with the same content can be adopted as the one being updated.
+
+    A job with a `collection_id` adds the document to that collection once it is stored.
+    """
+
+    def __init__(
+        self, url: str, doc_id: str = None, update: bool = False, pinned: bool = True, collection_id: str = None
+    ):
+        self.job_id = str(uuid4())
+        self.doc_id = doc_id or str(uuid4())
+        self.url = str(url)
+        self.update = update
+        self.pinned = pinned
+        self.collection_id = collection_id
+        self.content_hash = None
+        # Set by a stage when the remaining stages have nothing to do
+        self.done = False
+        self.status = "queued"
+        self.error = None
+        self.created_at = datetime.now()
+        self.finished_at = None
+        self.stages = OrderedDict((stage.name, {"status": "pending"}) for stage in STAGES)
+        self.context = {}
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "document_id": self.doc_id,
+            "url": self.url,
+            "kind": "update" if self.update else "upload",
+            "collection_id": self.collection_id,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "stages": {name: dict(info) for name, info in self.stages.items()},
+        }
+
+
+class Stage:
+    def __init__(self, name: str, run):
+        self.name = name
+        self.run = run
+
+
+# --- Pipeline stages: each one reads its inputs from job.context and writes its outputs back -------
+
+
+def _content_hash(buffer) -> str:
+    digest = hashlib.sha256()
+    for block in iter(lambda: buffer.read(1024 * 1024), b""):
+        digest.update(block)
+    buffer.seek(0)
+    return digest.hexdigest()
+
+
+def _download(job):
+    job.context["buffer"] = download_pdf(job.url)
+    job.content_hash = _content_hash(job.context["buffer"])
+    if not job.update:
+        return
+
+    # An update whose PDF is the one already stored has nothing to do
+    if not job.pinned:
+        job.doc_id = document_registry.find(content_hash=job.content_hash) or job.doc_id
+    stored = document_registry.get(job.doc_id)
+    if stored is not None and stored["content_hash"] == job.content_hash:
+        job.stages["download"]["unchanged"] = True
+        job.done = True
+
+
+def _parse(job):
+    with job.context.pop("buffer") as buffer:
+        stream = PDFChunkStream(buffer)
+    with stream:
+        job.stages["parse"]["pages"] = stream.page_count
+        if job.update:
+            # The chunks to embed are only known once they are diffed with the stored ones
+            job.context["text_chunks"] = [chunk.text for chunk in stream]
+            job.stages["parse"]["chunks"] = len(job.context["text_chunks"])
+            return
+
+        # The chunks are embedded as the pages are parsed, the embed stage waits for the last batches
+        job.context["embedding"] = embedding = EmbeddingStream()
+        for chunk in stream:
+            embedding.add(chunk.text, chunk.page)
+    job.stages["parse"]["chunks"] = len(embedding)
+
+
+def _embed(job):
+    if not job.update:
+        job.context["chunks"] = job.context.pop("embedding").result()
+        return
+
+    # Only the chunks that are not stored yet are embedded
+    diff = diff_document_chunks(job.doc_id, job.context.pop("text_chunks"))
+    if len(diff.added):
+        diff.vectors[diff.added] = create_embeddings([diff.texts[p] for p in diff.added]).vectors
+    job.context["diff"] = diff
+    job.stages["embed"].update(diff.summary())
+
+
+def _store(job):
+    if job.update:
+        apply_chunk_diff(job.doc_id, job.context["diff"])
+    else:
+        store_graph_nodes(job.doc_id, job.context["chunks"])
+    # Answers cached for a previous version of the document are stale
+    answer_cache.invalidate(job.doc_id)
+    fallback_cache.invalidate(job.doc_id)
+
+
+def _graph(job):
+    if job.update:
+        graph = update_graph(job.doc_id, job.context.pop("diff"))
+        job.stages["graph"]["edges"] = graph.n_edges
+        return
+    graph = build_graph(job.doc_id, job.context.pop("chunks"))
+    job.stages["graph"]["edges"] = graph.number_of_edges()
+
+
+def _link(job):
+    # Add the document to its collection, then compute its cross-document edges with the other documents
+    # of all its collections (again after an update, as its chunks changed)
+    if job.collection_id is not None:
+        document_registry.add_to_collection(job.collection_id, [job.doc_id])
+    others = {
+        doc_id
+        for collection_id in document_registry.collections_of(job.doc_id)
+        for doc_id in document_registry.collection_documents(collection_id)
+    }
+    others.discard(job.doc_id)
+    if not others:
+        return
+    job.stages["link"]["documents"] = len(others)
+    job.stages["link"]["edges"] = link_document(job.doc_id, sorted(others))
+    # Answers cached for questions on several documents may have used the previous edges
+    for doc_id in others:
+        answer_cache.invalidate(doc_id)
+        fallback_cache.invalidate(doc_id)
+
+
+STAGES = [
+    Stage("download", _download),
+    Stage("parse", _parse),
+    Stage("embed", _embed),
+    Stage("store", _store),
+    Stage("graph", _graph),
+    Stage("link", _link),
+]
+
+
+def _run_stage(job, stage) -> bool:
+    """
+    Runs one stage of a job, recording its status and timing. Returns False if the stage failed.
+    """
+    info = job.stages[stage.name]
+    info["status"] = "running"
+    info["started_at"] = datetime.now().isoformat()
+    job.status = "running"
+    start = time.perf_counter()
+    try:
+        with span(f"ingest.{stage.name}"):
+            stage.run(job)
+        info["status"] = "succeeded"
+        return True
+    except Exception as e:
+        print(f"Ingestion job {job.job_id} failed at stage '{stage.name}': {e}")
+        traceback.print_exc()
+        info["status"] = "failed"
+        job.status = "failed"
+        job.error = {"stage": stage.name, "message": getattr(e, "detail", None) or str(e), "type": type(e).__name__}
+        return False
+    finally:
+        info["duration_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+
+def _finish(job):
+    if job.status != "failed":
+        job.status = "succeeded"
+        for info in job.stages.values():
+            if info["status"] == "pending":
+                info["status"] = "skipped"
+        if not job.done:
+            # The stored version of the document is now this one
+            document_registry.register(
+                job.doc_id, job.url, job.content_hash, job.stages["parse"].get("chunks", 0)
+            )
+    job.finished_at = datetime.now()
+    # Close the download buffer if the job failed before parsing it
+    buffer = job.context.get("buffer")
+    if buffer is not None:
+        buffer.close()
+    # Don't embed the rest of a document that failed while being parsed
+    embedding = job.context.get("embedding")
+    if embedding is not None:
+        embedding.cancel()
+    job.context.clear()
+
+
+class JobRunner(ABC):
+    """
+    Interface of the ingestion runners. A runner takes jobs through all the STAGES and calls _finish().
+
+    The in-process runners below are enough for a single server; a runner backed by an external queue
+    only needs to implement `submit`.
+    """
+
+    @abstractmethod
+    def submit(self, job: IngestionJob):
+        """
+        Takes a job through the pipeline, or hands it to the workers that will.
+        """
+
+
+class InlineRunner(JobRunner):
+    """
+    Runs the whole pipeline in the caller's thread, when submit() returns the job is finished.
+    """
+
+    def submit(self, job: IngestionJob):
+        for stage in STAGES:
+            if not _run_stage(job, stage) or job.done:
+                break
+        _finish(job)
+
+
+class ThreadedPipelineRunner(JobRunner):
+    """
+    In-process worker pool running the stages as a pipeline: each stage has its own worker threads
+    and bounded queues connect consecutive stages, so different uploads can be downloaded, embedded
+    and stored at the same time, and a slow stage slows down the ones before it instead of piling
+    up jobs in memory.
+    """
+
+    def __init__(
+        self,
+        workers_per_stage: int = INGESTION_WORKERS_PER_STAGE,
+        queue_size: int = INGESTION_STAGE_QUEUE_SIZE,
+        max_pending: int = INGESTION_MAX_PENDING,
+    ):
+        self.workers_per_stage = workers_per_stage
+        self.queues = [queue.Queue(maxsize=max_pending)] + [
+            queue.Queue(maxsize=queue_size) for _ in STAGES[1:]
+        ]
+        self._started = False
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._started:
+                return
+            for idx, stage in enumerate(STAGES):
+                for n in range(self.workers_per_stage):
+                    threading.Thread(
+                        target=self._work,
+                        args=(idx,),
+                        name=f"ingestion-{stage.name}-{n}",
+                        daemon=True,
+                    ).start()
+            self._started = True
+
+    def _work(self, idx: int):
+        stage = STAGES[idx]
+        inbox = self.queues[idx]
+        outbox = self.queues[idx + 1] if idx + 1 < len(STAGES) else None
+        while True:
+            job = inbox.get()
+            try:
+                if _run_stage(job, stage) and outbox is not None and not job.done:
+                    # Blocks while the next stage is saturated
+                    outbox.put(job)
+                else:
+                    _finish(job)
+            finally:
+                inbox.task_done()
+
+    def submit(self, job: IngestionJob):
+        self._start()
+        try:
+            self.queues[0].put_nowait(job)
+        except queue.Full:
+            raise IngestionQueueFull("Too many uploads are waiting to be processed, retry later.")
+
+
+INGESTION_RUNNERS = {"thread": ThreadedPipelineRunner, "inline": InlineRunner}
+
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+_runner = None
+
+
+def get_job_runner() -> JobRunner:
+    global _runner
+    if _runner is None:
+        _runner = INGESTION_RUNNERS[INGESTION_RUNNER]()
+    return _runner
+
+
+def set_job_runner(runner: JobRunner):
+    """
+    Replaces the runner used for new uploads.
+    """
+    global _runner
+    _runner = runner
+
+
+def submit_ingestion(url: str, doc_id: str = None, collection_id: str = None) -> IngestionJob:
+    """
+    Creates an ingestion job for a PDF URL and hands it to the runner.
+
+    Parameters:
+    url (str): The URL of the PDF document.
+    doc_id (str): The identifier to give to the document, a new one is generated by default.
+    collection_id (str): The collection to add the document to, linking it to the other documents of the
+    collection (see `link_document`).
+
+    Returns:
+    IngestionJob: The job, whose status can be followed with `get_job`.
+    """
+    return _submit(IngestionJob(url, doc_id, collection_id=collection_id))
+
+
+def _submit(job: IngestionJob) -> IngestionJob:
+    with _jobs_lock:
+        _jobs[job.job_id] = job
+        # Forget the oldest finished jobs
+        finished = [job_id for job_id, j in _jobs.items() if j.finished_at is not None]
+        for job_id in finished[: max(0, len(_jobs) - INGESTION_JOB_HISTORY)]:
+            del _jobs[job_id]
+    try:
+        get_job_runner().submit(job)
+    except Exception:
+        with _jobs_lock:
+            _jobs.pop(job.job_id, None)
+        raise
+    return job
+
+
+def _document_exists(doc_id: str) -> bool:
+    if document_registry.get(doc_id) is not None:
+        return True
+    if NODES_TABLE not in get_db().table_names():
+        return False
+    return get_db().open_table(NODES_TABLE).count_rows(f"doc_id = '{doc_id}'") > 0
+
+
+def submit_update(url: str, doc_id: str = None) -> IngestionJob:
+    """
+    Creates a job updating a stored document from a new version of its PDF, and hands it to the runner.
+
+    The document is identified by `doc_id` if given, otherwise by the URL it was uploaded from, otherwise
+    by the content of the PDF (once downloaded). The new version is chunked and its chunks are matched with
+    the stored ones by hash: only the new chunks are embedded and inserted, the chunks that disappeared are
+    deleted, and only the graph edges of the changed chunks are recomputed. A PDF identical to the stored
+    version finishes right after the download. A URL that matches no document is ingested as a new one.
+
+    Parameters:
+    url (str): The URL of the new version of the PDF.
+    doc_id (str): The identifier of the document to update.
+
+    Returns:
+    IngestionJob: The job, whose status can be followed with `get_job`. Its document_id is the one updated.
+
+    Raises:
+    UnknownDocument: If doc_id is given but no such document is stored.
+    IngestionInProgress: If the document is already being ingested or updated.
+    """
+    url = str(url)
+    pinned = doc_id is not None
+    if pinned and not (re.match(DOC_ID_PATTERN, doc_id) and _document_exists(doc_id)):
+        raise UnknownDocument(f"No document found with ID: {doc_id}")
+    doc_id = doc_id or document_registry.find(url=url)
+    with _jobs_lock:
+        if doc_id is not None and any(j.doc_id == doc_id and j.finished_at is None for j in _jobs.values()):
+            raise IngestionInProgress(f"Document {doc_id} is already being ingested, retry when it is done.")
+    return _submit(IngestionJob(url, doc_id, update=True, pinned=doc_id is not None))
+
+
+def get_job(job_id: str):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def add_to_collection(collection_id: str, doc_ids: list) -> dict:
+    """
+    Adds stored documents to a collection (created if needed), and links each of them to the other
+    documents of the collection (see `link_document`). Documents uploaded with a collection_id are added
+    by their ingestion job instead.
+
+    Parameters:
+    collection_id (str): The identifier of the collection.
+    doc_ids (list): The documents to add.
+
+    Returns:
+    dict: The documents of the collection, and the number of cross-document edges of each added document.
+
+    Raises:
+    UnknownDocument: If one of the documents is not stored.
+    """
+    for doc_id in doc_ids:
+        if not (re.match(DOC_ID_PATTERN, doc_id) and _document_exists(doc_id)):
+            raise UnknownDocument(f"No document found with ID: {doc_id}")
+    documents = document_registry.add_to_collection(collection_id, doc_ids)
+
+    # Link the added documents to the rest of the collection, the edges are stored in both directions
+    edges = {}
+    for doc_id in dict.fromkeys(doc_ids):
+        with span("collection.link", documents=len(documents)):
+            edges[doc_id] = link_document(doc_id, documents)
+    # Answers cached for questions on several documents may have used the previous edges
+    for doc_id in documents:
+        answer_cache.invalidate(doc_id)
+        fallback_cache.invalidate(doc_id)
+    return {"collection_id": collection_id, "document_ids": documents, "edges": edges}
@@ -0,0 +1,72 @@
+import re
+
+
+class StreamingStringField:
+    """
+    Incrementally decodes the value of one string field of a JSON object that arrives in fragments,
+    such as the arguments of a streamed function call.
+
+    Each call to `feed` returns the part of the decoded value that became available, so the text can be
+    forwarded to the client while the rest of the object is still being generated.
+    """
+
+    _ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self, field: str):
+        self._start_pattern = re.compile(r'(?<!\\)"' + re.escape(field) + r'"\s*:\s*"')
+        self._buffer = ""
+        self._position = None  # Index in the buffer of the next undecoded character of the value
+        self.value = ""
+        self.complete = False
+
+    def feed(self, fragment: str) -> str:
+        """
+        Adds a fragment of the JSON text and returns the newly decoded part of the field's value.
+        """
+        self._buffer += fragment
+        if self.complete:
+            return ""
+        if self._position is None:
+            match = self._start_pattern.search(self._buffer)
+            if match is None:
+                return ""
+            self._position = match.end()
+
+        decoded = []
+        buffer, i = self._buffer, self._position
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                self.complete = True
+                i += 1
+                break
+            if char != "\\":
+                decoded.append(char)
+                i += 1
+                continue
+            # Escape sequence: wait for the rest of it if it was cut between fragments
+            if i + 1 >= len(buffer):
+                break
+            escape = buffer[i + 1]
+            if escape != "u":
+                decoded.append(self._ESCAPES.get(escape, escape))
+                i += 2
+                continue
+            if i + 6 > len(buffer):
+                break
+            code = int(buffer[i + 2 : i + 6], 16)
+            if 0xD800 <= code < 0xDC00:
+                # High surrogate, combine it with the low surrogate that follows
+                if i + 12 > len(buffer):
+                    break
+                low = int(buffer[i + 8 : i + 12], 16)
+                decoded.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                i += 12
+            else:
+                decoded.append(chr(code))
+                i += 6
+
+        self._position = i
+        text = "".join(decoded)
+        self.value += text
+        return text
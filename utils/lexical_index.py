@@ -0,0 +1,185 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from utils.document_registry import DOC_ID_PATTERN
+from utils.embedding_cache import normalize_text
+
+LEXICAL_INDEX_DIR = os.path.expanduser(os.getenv("LEXICAL_INDEX_DIR", "~/.lancedb-lexical"))
+# Number of indexes kept open in memory
+LEXICAL_INDEX_CACHE_SIZE = int(os.getenv("LEXICAL_INDEX_CACHE_SIZE", "64"))
+# BM25 parameters: term frequency saturation and document length normalization
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list:
+    """
+    Splits a text into lowercase word tokens. Course codes, numbers and names are kept whole
+    ("CS101", "2024"), which is what the lexical search is for.
+    """
+    return _TOKEN_PATTERN.findall(normalize_text(text).lower())
+
+
+class BM25Index:
+    """
+    Inverted index of the chunks of one document, scored with BM25.
+
+    The postings are stored as a CSR structure: the chunks containing term t are
+    chunks[indptr[t]:indptr[t + 1]], with the term frequencies in the same slice of frequencies.
+    The arrays may be memory-mapped, so opening an index only reads the postings that are used.
+    """
+
+    def __init__(self, terms, indptr, chunks, frequencies, lengths):
+        self.terms = terms
+        self.indptr = indptr
+        self.chunks = chunks
+        self.frequencies = frequencies
+        self.lengths = lengths
+        self.n_chunks = len(lengths)
+        # Chunk indices may have gaps (chunks deleted by an update), which have no tokens and don't count
+        indexed = np.asarray(lengths) > 0
+        n_indexed = int(indexed.sum())
+        self.average_length = float(np.asarray(lengths)[indexed].mean()) if n_indexed else 0.0
+        document_frequencies = np.diff(np.asarray(indptr))
+        self.idf = np.log1p((n_indexed - document_frequencies + 0.5) / (document_frequencies + 0.5))
+
+    @classmethod
+    def from_texts(cls, texts):
+        """
+        Builds the index of a document from the text of its chunks, indexed by chunk index (missing
+        chunks as empty strings).
+        """
+        terms = {}
+        term_ids, chunk_ids, frequencies = [], [], []
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for chunk, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[chunk] = len(tokens)
+            for term, frequency in Counter(tokens).items():
+                term_ids.append(terms.setdefault(term, len(terms)))
+                chunk_ids.append(chunk)
+                frequencies.append(frequency)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=indptr[1:])
+        return cls(
+            terms,
+            indptr,
+            np.asarray(chunk_ids, dtype=np.int32)[order],
+            np.asarray(frequencies, dtype=np.float32)[order],
+            lengths,
+        )
+
+    def search(self, query: str, top_k: int):
+        """
+        Returns the chunks matching the query terms, best first.
+
+        Returns:
+        list: (chunk index, BM25 score) pairs, at most top_k of them.
+        """
+        scores = np.zeros(self.n_chunks, dtype=np.float32)
+        normalization = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths / max(self.average_length, 1e-9))
+        for term in set(tokenize(query)):
+            term_id = self.terms.get(term)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            chunks = self.chunks[start:end]
+            frequencies = self.frequencies[start:end]
+            # A chunk appears once per term, so the fancy-indexed += is safe
+            scores[chunks] += self.idf[term_id] * frequencies * (BM25_K1 + 1) / (frequencies + normalization[chunks])
+
+        matches = np.flatnonzero(scores)
+        if len(matches) > top_k:
+            matches = matches[np.argpartition(-scores[matches], top_k - 1)[:top_k]]
+        matches = matches[np.argsort(-scores[matches], kind="stable")]
+        return [(int(chunk), float(scores[chunk])) for chunk in matches]
+
+
+def _index_dir(doc_id: str) -> str:
+    # doc_id ends up in a path, refuse anything that could escape the index directory
+    if not re.match(DOC_ID_PATTERN, doc_id):
+        raise ValueError(f"Invalid document ID: {doc_id!r}")
+    return os.path.join(LEXICAL_INDEX_DIR, doc_id)
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def save_lexical_index(doc_id: str, index: BM25Index):
+    """
+    Persists the lexical index of a document, replacing any previous version atomically.
+    """
+    target = _index_dir(doc_id)
+    os.makedirs(LEXICAL_INDEX_DIR, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=f".{doc_id}-", dir=LEXICAL_INDEX_DIR)
+    with open(os.path.join(staging, "terms.json"), "w", encoding="utf-8") as f:
+        json.dump(sorted(index.terms, key=index.terms.get), f)
+    np.save(os.path.join(staging, "indptr.npy"), index.indptr)
+    np.save(os.path.join(staging, "chunks.npy"), index.chunks)
+    np.save(os.path.join(staging, "frequencies.npy"), index.frequencies)
+    np.save(os.path.join(staging, "lengths.npy"), index.lengths)
+
+    if os.path.exists(target):
+        shutil.rmtree(target)
+    os.replace(staging, target)
+    with _cache_lock:
+        _cache.pop(doc_id, None)
+
+
+def delete_lexical_index(doc_id: str):
+    """
+    Deletes the lexical index of a document, e.g. when its chunks are restored from a snapshot: it is
+    rebuilt from the stored chunks on the next lexical query.
+    """
+    target = _index_dir(doc_id)
+    if os.path.exists(target):
+        shutil.rmtree(target)
+    with _cache_lock:
+        _cache.pop(doc_id, None)
+
+
+def load_lexical_index(doc_id: str):
+    """
+    Returns the lexical index of a document, loaded from disk on first use and then kept in an LRU.
+
+    Returns:
+    BM25Index or None: None if no index was stored for this document.
+    """
+    with _cache_lock:
+        index = _cache.get(doc_id)
+        if index is not None:
+            _cache.move_to_end(doc_id)
+            return index
+
+    directory = _index_dir(doc_id)
+    if not os.path.isdir(directory):
+        return None
+    with open(os.path.join(directory, "terms.json"), encoding="utf-8") as f:
+        terms = {term: term_id for term_id, term in enumerate(json.load(f))}
+    index = BM25Index(
+        terms,
+        np.load(os.path.join(directory, "indptr.npy"), mmap_mode="r"),
+        np.load(os.path.join(directory, "chunks.npy"), mmap_mode="r"),
+        np.load(os.path.join(directory, "frequencies.npy"), mmap_mode="r"),
+        np.load(os.path.join(directory, "lengths.npy")),
+    )
+
+    with _cache_lock:
+        _cache[doc_id] = index
+        _cache.move_to_end(doc_id)
+        while len(_cache) > LEXICAL_INDEX_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return index
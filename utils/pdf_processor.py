@@ -1,54 +1,232 @@
-import requests
-from io import BytesIO
-from langchain.document_loaders import PyMuPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
 from fastapi import HTTPException
-from PyPDF2 import PdfReader
+from utils.clients import get_http_session
 
+# Maximum size of a downloaded PDF, larger files are rejected while downloading
+PDF_MAX_BYTES = int(os.getenv("PDF_MAX_BYTES", str(100 * 1024 * 1024)))
+# Downloads are kept in memory up to this size, then spooled to a temporary file
+PDF_SPOOL_MAX_MEMORY = int(os.getenv("PDF_SPOOL_MAX_MEMORY", str(16 * 1024 * 1024)))
+PDF_DOWNLOAD_TIMEOUT = float(os.getenv("PDF_DOWNLOAD_TIMEOUT", "30"))
+_DOWNLOAD_BLOCK_SIZE = 64 * 1024
 
-def verify_pdf(url: str) -> bool:
+# Number of processes extracting the text of large PDFs, 0 extracts in the calling thread.
+# One core is left to the server, a single-core host extracts in-process.
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, (os.cpu_count() or 1) - 1))))
+# PDFs with fewer pages are extracted in the calling thread, the process pool isn't worth it
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32"))
+# Number of consecutive pages extracted by one task of the pool
+PDF_EXTRACT_PAGES_PER_TASK = int(os.getenv("PDF_EXTRACT_PAGES_PER_TASK", "16"))
+
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+
+
+def download_pdf(url: str):
     """
-    Verifies that the URL points to a valid PDF file.
-    Returns True if the file is a valid PDF, raises an HTTPException otherwise.
+    Downloads a PDF with a single streaming request into a spooled buffer, through the pooled HTTP
+    session (see `get_http_session`).
+
+    Returns the buffer positioned at the start, raises an HTTPException if the URL doesn't point
+    to a PDF or if the file is larger than PDF_MAX_BYTES.
     """
     try:
-        # Step 1: Request the file from the URL
-        response = requests.get(url, stream=True)
-        print(response)
-        # Step 2: Check if the response is a PDF by verifying the content type
-        if "pdf" not in response.headers.get("Content-Type", "").lower():
-            raise ValueError("The document is not a valid PDF.")
-
-        # Step 3: Try reading the PDF content using PyPDF2
-        pdf_file = BytesIO(response.content)
-        pdf_reader = PdfReader(pdf_file)
-
-        # If no pages are found, it's not a valid PDF
-        if len(pdf_reader.pages) < 1:
-            raise ValueError("The PDF file is empty or invalid.")
-
-        return True
+        with get_http_session().get(str(url), stream=True, timeout=PDF_DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+
+            # Step 1: Check if the response is a PDF by verifying the content type
+            if "pdf" not in response.headers.get("Content-Type", "").lower():
+                raise ValueError("The document is not a valid PDF.")
+
+            # Step 2: Reject files that announce a size above the cap before reading them
+            content_length = int(response.headers.get("Content-Length") or 0)
+            if content_length > PDF_MAX_BYTES:
+                raise ValueError(f"The PDF file is larger than {PDF_MAX_BYTES} bytes.")
+
+            # Step 3: Stream the body into the buffer, enforcing the cap as we go
+            buffer = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_MEMORY)
+            size = 0
+            for block in response.iter_content(chunk_size=_DOWNLOAD_BLOCK_SIZE):
+                size += len(block)
+                if size > PDF_MAX_BYTES:
+                    buffer.close()
+                    raise ValueError(f"The PDF file is larger than {PDF_MAX_BYTES} bytes.")
+                buffer.write(block)
+            buffer.seek(0)
+            return buffer
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid PDF file: {str(e)}")
 
 
-def process_pdf(pdf_file):
+class Chunk(NamedTuple):
+    """
+    A chunk of text and the number (1-based) of the page it comes from.
+    """
+
+    text: str
+    page: int
+
+
+def _text_splitter():
+    # LangChain and PyMuPDF are imported on first use (or by `warm_up_pdf_processing`), they are slow to import
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    return RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+
+def warm_up_pdf_processing():
+    """
+    Imports PyMuPDF and the text splitter, and starts the extraction processes if there are any.
+    """
+    import fitz  # noqa: F401
+
+    _text_splitter()
+    if PDF_EXTRACT_WORKERS > 0:
+        _get_extract_pool().submit(os.getpid).result()
+
+
+def split_pages(pages):
+    """
+    Splits the text of each page into chunks, as the pages come.
+
+    Parameters:
+    pages (iterable): (page_number, text) pairs, in page order.
+
+    Returns:
+    generator: The Chunk of each page, yielded as soon as the page is split.
+    """
+    text_splitter = _text_splitter()
+    # Pages are split separately, so that a chunk never spans two pages
+    for page_number, text in pages:
+        for text_chunk in text_splitter.split_text(text):
+            yield Chunk(text_chunk, page_number)
+
+
+# --- Page extraction in a process pool ------------------------------------------------------------
+
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+# In a worker process: the PDF opened by the previous task, reused by the next tasks of the same file
+_worker_document = None
+_worker_document_key = None
+
+
+def _get_extract_pool():
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            # Forking a process that runs threads (the server, LanceDB) can deadlock the child, spawn instead
+            _extract_pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _extract_pool
+
+
+def _extract_page_range(path: str, start: int, stop: int):
+    """
+    Runs in a worker process: returns the (page_number, text) of the pages [start, stop) of a PDF file.
     """
-    Processes a PDF file and extracts text chunks.
-    Returns a list of text chunks from the PDF.
+    global _worker_document, _worker_document_key
+    import fitz
+
+    # Temporary paths can be reused, the file is identified by its inode and modification time too
+    stat = os.stat(path)
+    key = (path, stat.st_ino, stat.st_mtime_ns)
+    if _worker_document_key != key:
+        if _worker_document is not None:
+            _worker_document.close()
+        _worker_document = fitz.open(path)
+        _worker_document_key = key
+    return [(n + 1, _worker_document[n].get_text()) for n in range(start, stop)]
+
+
+def extract_pages(path: str, page_count: int):
+    """
+    Extracts the text of each page of a PDF file.
+
+    Large PDFs are extracted by a pool of PDF_EXTRACT_WORKERS processes, PDF_EXTRACT_PAGES_PER_TASK
+    pages per task. At most two tasks per worker are in flight, so the text of a 1000-page PDF is not
+    extracted ahead of a slow consumer.
+
+    Parameters:
+    path (str): The path of the PDF file.
+    page_count (int): The number of pages of the PDF.
+
+    Returns:
+    generator: (page_number, text) pairs, in page order, yielded as soon as each page is extracted.
     """
+    if PDF_EXTRACT_WORKERS < 1 or page_count < PDF_PARALLEL_MIN_PAGES:
+        import fitz
+
+        with fitz.open(path) as document:
+            for page in document:
+                yield page.number + 1, page.get_text()
+        return
+
+    pool = _get_extract_pool()
+    ranges = deque(
+        (start, min(start + PDF_EXTRACT_PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, PDF_EXTRACT_PAGES_PER_TASK)
+    )
+    in_flight = deque()
     try:
-        # Step 1: Load the PDF and convert to documents
-        loader = PyMuPDFLoader(pdf_file)
-        documents = loader.load()
+        while ranges or in_flight:
+            while ranges and len(in_flight) < 2 * PDF_EXTRACT_WORKERS:
+                in_flight.append(pool.submit(_extract_page_range, path, *ranges.popleft()))
+            yield from in_flight.popleft().result()
+    finally:
+        # The consumer stopped early (e.g. an error downstream)
+        for future in in_flight:
+            future.cancel()
 
-        # Step 2: Chunk the document using RecursiveCharacterTextSplitter
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-        text_chunks = text_splitter.split_documents(documents)
 
-        # Return only the content of the chunks
-        return [chunk.page_content for chunk in text_chunks]
+class PDFChunkStream:
+    """
+    The chunks of a downloaded PDF, produced page by page.
+
+    The PDF is copied from the download buffer to a temporary file, which the extraction processes
+    read directly; only its page count is parsed up front, which also validates it. Iterating yields
+    the Chunk of each page as soon as the page is extracted and split, so downstream work (e.g.
+    embedding) can start while the later pages are still being parsed, and the text of the whole
+    document is never held at once.
+
+    Use it as a context manager, the temporary file is deleted on exit.
+    """
+
+    def __init__(self, buffer):
+        import fitz
+
+        self._file = tempfile.NamedTemporaryFile(suffix=".pdf")
+        try:
+            shutil.copyfileobj(buffer, self._file, _DOWNLOAD_BLOCK_SIZE)
+            self._file.flush()
+            try:
+                with fitz.open(self._file.name) as document:
+                    self.page_count = document.page_count
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Invalid PDF file: {str(e)}")
+            # If no pages are found, it's not a valid PDF
+            if self.page_count < 1:
+                raise HTTPException(status_code=400, detail="Invalid PDF file: The PDF file is empty or invalid.")
+        except BaseException:
+            self._file.close()
+            raise
+
+    def __iter__(self):
+        return split_pages(extract_pages(self._file.name, self.page_count))
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return []
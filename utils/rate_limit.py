@@ -0,0 +1,134 @@
+import asyncio
+import os
+import threading
+import time
+
+# Requests and tokens per minute allowed per upstream service, 0 for no limit. Set them to the limits
+# of the OpenAI account: calls over the limit wait for their turn instead of being rejected with a 429.
+UPSTREAM_RATE_LIMITS = {
+    "openai_embeddings": (
+        int(os.getenv("OPENAI_EMBEDDINGS_RPM", "0")),
+        int(os.getenv("OPENAI_EMBEDDINGS_TPM", "0")),
+    ),
+    "openai_chat": (
+        int(os.getenv("OPENAI_CHAT_RPM", "0")),
+        int(os.getenv("OPENAI_CHAT_TPM", "0")),
+    ),
+}
+
+
+class TokenBucket:
+    """
+    A bucket of `per_minute` units, refilled continuously.
+
+    `reserve` takes units at once, even if the bucket doesn't hold them yet, and returns how long the
+    caller has to wait for the bucket to cover them: later callers queue behind the earlier reservations,
+    in order, without polling. A reservation larger than the bucket is capped to its size, so that it
+    waits for a full bucket rather than forever.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        self.level -= min(amount, self.capacity)
+        return -self.level / self.rate if self.level < 0 else 0.0
+
+
+class RateGovernor:
+    """
+    Paces the calls to an upstream service to its requests and tokens per minute (0 for no limit).
+
+    A call reserves one request and its estimated tokens, then waits until both buckets cover them
+    (see `TokenBucket`). When the service rate-limits a call anyway, `pause` holds all the following
+    calls for the Retry-After delay, instead of each of them failing in turn.
+    """
+
+    def __init__(self, name: str, rpm: int = 0, tpm: int = 0):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = TokenBucket(rpm) if rpm > 0 else None
+        self._tokens = TokenBucket(tpm) if tpm > 0 else None
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.delayed = 0
+        self.wait_s = 0.0
+        self.pauses = 0
+
+    def _reserve(self, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._paused_until - now)
+            if self._requests is not None:
+                wait = max(wait, self._requests.reserve(1, now))
+            if self._tokens is not None and tokens:
+                wait = max(wait, self._tokens.reserve(tokens, now))
+            self.calls += 1
+            if wait > 0:
+                self.delayed += 1
+                self.wait_s += wait
+            return wait
+
+    def acquire(self, tokens: int = 0):
+        """
+        Waits (blocking) until a call of `tokens` tokens is allowed.
+        """
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int = 0):
+        """
+        Async version of `acquire`, waits without blocking the event loop.
+        """
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """
+        Holds the calls to the service for `seconds`, e.g. after a 429 with a Retry-After delay.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self.pauses += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "calls": self.calls,
+                "delayed": self.delayed,
+                "wait_s": round(self.wait_s, 3),
+                "pauses": self.pauses,
+                "paused_for_s": round(max(0.0, self._paused_until - time.monotonic()), 3),
+            }
+
+
+_governors = {}
+_governors_lock = threading.Lock()
+
+
+def rate_governor(name: str) -> RateGovernor:
+    """
+    Returns the governor of an upstream service, see UPSTREAM_RATE_LIMITS.
+    """
+    governor = _governors.get(name)
+    if governor is None:
+        with _governors_lock:
+            governor = _governors.get(name)
+            if governor is None:
+                governor = _governors[name] = RateGovernor(name, *UPSTREAM_RATE_LIMITS[name])
+    return governor
+
+
+def rate_limit_stats() -> dict:
+    return {name: rate_governor(name).stats() for name in UPSTREAM_RATE_LIMITS}
@@ -0,0 +1,442 @@
+"""
+Snapshots of ingested documents: everything needed to serve a document (its chunks, their float32
+vectors, its similarity graph and cross-document edges, its registry entry and collections) in one
+uncompressed Arrow IPC file, which is memory-mapped when it is read back.
+
+Restoring a snapshot doesn't call OpenAI: the rows are bulk-loaded into the chunks table and the graphs
+are written as they are, so rebuilding a node or a staging environment is limited by the disk.
+
+Usage:
+    python -m utils.snapshots export snapshots/                 # every stored document
+    python -m utils.snapshots export snapshots/ --documents 12345 67890
+    python -m utils.snapshots import snapshots/
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+
+from utils.answer_cache import answer_cache
+from utils.clients import get_db
+from utils.document_registry import DOC_ID_PATTERN, document_registry
+from utils.embeddings_generator import EMBEDDING_MODEL
+from utils.fallback import fallback_cache
+from utils.ingestion_jobs import UnknownDocument
+from utils.graph_store import CSRGraph, CrossDocumentEdges, load_cross_edges, load_graph, save_cross_edges, save_graph
+from utils.Knowlege_graph import (
+    NODES_TABLE,
+    node_index,
+    nodes_record_batch,
+    open_nodes_table,
+    replace_documents_nodes,
+)
+from utils.lexical_index import delete_lexical_index
+from utils.tracing import span
+from utils.vector_cache import document_vectors
+from utils.vector_index import schedule_index_maintenance, wait_for_index_maintenance
+from utils.vector_storage import EMBEDDING_DIMENSIONS, vectors_from_arrow
+
+# Threads reading and writing snapshot files, and rows of chunks written to LanceDB at once on import
+SNAPSHOT_WORKERS = int(os.getenv("SNAPSHOT_WORKERS", "4"))
+SNAPSHOT_IMPORT_BATCH_ROWS = int(os.getenv("SNAPSHOT_IMPORT_BATCH_ROWS", "65536"))
+# Largest snapshot accepted by POST /snapshots, in bytes
+SNAPSHOT_UPLOAD_MAX_BYTES = int(os.getenv("SNAPSHOT_UPLOAD_MAX_BYTES", str(1024**3)))
+
+SNAPSHOT_FORMAT = "lancedb-graph-snapshot"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_SUFFIX = ".arrow"
+
+# One row per chunk, sorted by chunk index. The graph is stored as the neighbours of each chunk, so that
+# the lists' values are the CSR indices and weights of the graph.
+CROSS_EDGE_TYPE = pa.struct([("document", pa.string()), ("node", pa.int64()), ("weight", pa.float32())])
+SNAPSHOT_SCHEMA = pa.schema(
+    [
+        ("node", pa.int64()),
+        ("text", pa.string()),
+        ("vector", pa.list_(pa.float32(), EMBEDDING_DIMENSIONS)),
+        ("neighbours", pa.list_(pa.int32())),
+        ("weights", pa.list_(pa.float32())),
+        ("cross_edges", pa.list_(CROSS_EDGE_TYPE)),
+    ]
+)
+
+
+class InvalidSnapshot(Exception):
+    pass
+
+
+# --- Export ---------------------------------------------------------------------------------------------
+
+
+def stored_documents() -> list:
+    """
+    Returns the IDs of all the documents stored in the chunks table.
+    """
+    if NODES_TABLE not in get_db().table_names():
+        return []
+    rows = open_nodes_table().search().select(["doc_id"]).limit(None).to_arrow()
+    return sorted(set(rows["doc_id"].to_pylist()))
+
+
+def _graph_lists(graph, nodes):
+    # The neighbours and weights of each node, as list arrays sharing the graph's CSR arrays
+    if graph is None:
+        empty = pa.array(np.zeros(len(nodes) + 1, dtype=np.int32))
+        return (
+            pa.ListArray.from_arrays(empty, pa.array([], pa.int32())),
+            pa.ListArray.from_arrays(empty, pa.array([], pa.float32())),
+        )
+    indptr = np.asarray(graph.indptr)
+    inside = nodes < graph.n_nodes
+    starts = np.where(inside, indptr[np.minimum(nodes, graph.n_nodes - 1)], 0)
+    ends = np.where(inside, indptr[np.minimum(nodes, graph.n_nodes - 1) + 1], 0)
+    # Rows are sorted by node, so the neighbour slices follow each other when no node is missing
+    lengths = ends - starts
+    offsets = np.zeros(len(nodes) + 1, dtype=np.int32)
+    np.cumsum(lengths, out=offsets[1:])
+    take = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)]) if len(nodes) else []
+    take = np.asarray(take, dtype=np.int64)
+    indices = np.asarray(graph.indices)[take].astype(np.int32)
+    weights = np.asarray(graph.weights)[take].astype(np.float32)
+    return (
+        pa.ListArray.from_arrays(pa.array(offsets), pa.array(indices)),
+        pa.ListArray.from_arrays(pa.array(offsets), pa.array(weights)),
+    )
+
+
+def _cross_edge_lists(edges: CrossDocumentEdges, nodes):
+    by_node = {}
+    for node, document, target, weight in edges.edges():
+        by_node.setdefault(node, []).append({"document": document, "node": target, "weight": weight})
+    return pa.array([by_node.get(int(node), []) for node in nodes], pa.list_(CROSS_EDGE_TYPE))
+
+
+def export_document(doc_id: str, path: str) -> dict:
+    """
+    Writes the snapshot of a stored document to an Arrow IPC file, replacing it atomically.
+
+    Parameters:
+    doc_id (str): The identifier for the document.
+    path (str): The snapshot file.
+
+    Returns:
+    dict: The document ID, the number of chunks and the size of the file in bytes.
+
+    Raises:
+    UnknownDocument: If the document has no stored chunks.
+    """
+    if not re.match(DOC_ID_PATTERN, doc_id) or NODES_TABLE not in get_db().table_names():
+        raise UnknownDocument(f"No document found with ID: {doc_id}")
+
+    # Step 1: Read the chunks of the document, in chunk order
+    with span("snapshot.read", doc_id=doc_id):
+        rows = (
+            open_nodes_table()
+            .search()
+            .where(f"doc_id = '{doc_id}'")
+            .select(["id", "vector", "payload"])
+            .limit(None)
+            .to_arrow()
+        )
+    if rows.num_rows == 0:
+        raise UnknownDocument(f"No document found with ID: {doc_id}")
+    nodes = np.fromiter((node_index(node_id) for node_id in rows["id"].to_pylist()), np.int64, rows.num_rows)
+    order = np.argsort(nodes, kind="stable")
+    nodes = nodes[order]
+    vectors = vectors_from_arrow(rows["vector"])[order]
+    texts = rows["payload"].combine_chunks().field("content").take(pa.array(order)).fill_null("")
+
+    # Step 2: Add the graph, the cross-document edges and the metadata of the document
+    graph = load_graph(doc_id)
+    neighbours, weights = _graph_lists(graph, nodes)
+    metadata = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "doc_id": doc_id,
+        "embedding_model": EMBEDDING_MODEL,
+        "dimensions": EMBEDDING_DIMENSIONS,
+        "graph_nodes": graph.n_nodes if graph is not None else None,
+        "document": document_registry.get(doc_id),
+        "collections": document_registry.collections_of(doc_id),
+    }
+    batch = pa.RecordBatch.from_arrays(
+        [
+            pa.array(nodes),
+            texts.cast(pa.string()),
+            pa.FixedSizeListArray.from_arrays(pa.array(vectors.reshape(-1)), EMBEDDING_DIMENSIONS),
+            neighbours,
+            weights,
+            _cross_edge_lists(load_cross_edges(doc_id), nodes),
+        ],
+        schema=SNAPSHOT_SCHEMA.with_metadata({"snapshot": json.dumps(metadata)}),
+    )
+
+    # Step 3: Write it as a single uncompressed batch, so that it can be memory-mapped as it is
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, staging = tempfile.mkstemp(prefix=f".{doc_id}-", suffix=SNAPSHOT_SUFFIX, dir=directory)
+    with span("snapshot.write", rows=batch.num_rows), os.fdopen(fd, "wb") as f:
+        with pa.ipc.new_file(f, batch.schema) as writer:
+            writer.write_batch(batch)
+    # mkstemp creates the file readable by its owner only
+    os.chmod(staging, 0o644)
+    os.replace(staging, path)
+    return {"document_id": doc_id, "chunks": batch.num_rows, "bytes": os.path.getsize(path)}
+
+
+def export_documents(directory: str, doc_ids: list = None, workers: int = SNAPSHOT_WORKERS) -> list:
+    """
+    Writes the snapshots of several documents (all the stored ones by default) to `directory`, as
+    `<doc_id>.arrow` files, `workers` documents at a time.
+
+    Returns:
+    list: The result of `export_document` for each document.
+    """
+    doc_ids = stored_documents() if doc_ids is None else list(doc_ids)
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="snapshot") as pool:
+        return list(
+            pool.map(
+                lambda doc_id: export_document(doc_id, os.path.join(directory, doc_id + SNAPSHOT_SUFFIX)),
+                doc_ids,
+            )
+        )
+
+
+# --- Import ---------------------------------------------------------------------------------------------
+
+
+def read_snapshot(path: str):
+    """
+    Opens a snapshot file, memory-mapped: the columns are views of the file, only read when they are used.
+
+    Returns:
+    tuple: The metadata (dict) and the chunks (pa.Table, in SNAPSHOT_SCHEMA).
+
+    Raises:
+    InvalidSnapshot: If the file is not a snapshot, or its embeddings are not compatible with this service.
+    """
+    try:
+        with pa.memory_map(path, "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+        metadata = json.loads((table.schema.metadata or {}).get(b"snapshot", b"{}"))
+    except (pa.ArrowInvalid, OSError, ValueError) as e:
+        raise InvalidSnapshot(f"{path} is not a snapshot: {e}")
+    if metadata.get("format") != SNAPSHOT_FORMAT or metadata.get("version") != SNAPSHOT_VERSION:
+        raise InvalidSnapshot(f"{path} is not a version {SNAPSHOT_VERSION} snapshot")
+    if not re.match(DOC_ID_PATTERN, metadata.get("doc_id") or ""):
+        raise InvalidSnapshot(f"{path} has an invalid document ID: {metadata.get('doc_id')!r}")
+    # Query embeddings of another model would be compared with these vectors
+    if metadata.get("embedding_model") != EMBEDDING_MODEL or metadata.get("dimensions") != EMBEDDING_DIMENSIONS:
+        raise InvalidSnapshot(
+            f"{path} was embedded with {metadata.get('embedding_model')} ({metadata.get('dimensions')} dimensions), "
+            f"this service uses {EMBEDDING_MODEL} ({EMBEDDING_DIMENSIONS} dimensions)"
+        )
+    if not table.schema.equals(SNAPSHOT_SCHEMA):
+        raise InvalidSnapshot(f"{path} doesn't have the columns of a snapshot")
+    return metadata, table
+
+
+def _graph_from_lists(nodes, neighbours, weights, n_nodes):
+    counts = np.zeros(n_nodes, dtype=np.int64)
+    counts[nodes] = np.diff(neighbours.offsets.to_numpy())
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    return CSRGraph(
+        indptr,
+        neighbours.values.to_numpy().astype(np.int32, copy=False),
+        weights.values.to_numpy().astype(np.float32, copy=False),
+    )
+
+
+def _cross_edges_from_lists(nodes, cross_edges) -> CrossDocumentEdges:
+    lengths = np.diff(cross_edges.offsets.to_numpy())
+    if not lengths.sum():
+        return CrossDocumentEdges.empty()
+    targets = cross_edges.flatten()
+    documents = targets.field("document").dictionary_encode()
+    return CrossDocumentEdges(
+        documents.dictionary.to_pylist(),
+        np.repeat(nodes, lengths),
+        documents.indices.to_numpy(),
+        targets.field("node").to_numpy(),
+        targets.field("weight").to_numpy(),
+    )
+
+
+def _load_snapshot(path: str):
+    """
+    Reads a snapshot into what is written for its document: the rows of its chunks for the chunks table,
+    its graph and its cross-document edges. Nothing is written yet.
+
+    Returns:
+    tuple: The metadata (dict), the rows (pa.RecordBatch), the graph (CSRGraph) and the cross-document
+    edges (CrossDocumentEdges).
+    """
+    metadata, table = read_snapshot(path)
+    if table.num_rows == 0:
+        raise InvalidSnapshot(f"{path} has no chunks")
+    chunks = table.combine_chunks().to_batches()[0]
+    nodes = chunks.column("node").to_numpy()
+    if np.any(nodes < 0) or np.any(np.diff(nodes) <= 0):
+        raise InvalidSnapshot(f"{path} has chunks out of order")
+
+    doc_id = metadata["doc_id"]
+    n_nodes = max(metadata.get("graph_nodes") or 0, int(nodes[-1]) + 1)
+    graph = _graph_from_lists(nodes, chunks.column("neighbours"), chunks.column("weights"), n_nodes)
+    edges = _cross_edges_from_lists(nodes, chunks.column("cross_edges"))
+    rows = nodes_record_batch(
+        doc_id, chunks.column("text").to_pylist(), vectors_from_arrow(chunks.column("vector")), nodes=nodes
+    )
+    return metadata, rows, graph, edges
+
+
+def snapshot_paths(paths) -> list:
+    """
+    Expands directories into the snapshot files they contain.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*" + SNAPSHOT_SUFFIX))))
+        else:
+            files.append(path)
+    return files
+
+
+def import_snapshots(paths, workers: int = SNAPSHOT_WORKERS, batch_rows: int = SNAPSHOT_IMPORT_BATCH_ROWS) -> dict:
+    """
+    Restores documents from snapshot files (or directories of them), without calling OpenAI. A document
+    already stored is replaced by its snapshot.
+
+    The files are read by `workers` threads, a few files ahead of the writes, and the chunks of many
+    documents are written to LanceDB together, `batch_rows` rows at a time (one delete and one write for
+    all of them instead of a new table version per document). The registry is written once at the end.
+
+    Parameters:
+    paths (list): Snapshot files, or directories of snapshot files.
+    workers (int): The number of threads reading the snapshots.
+    batch_rows (int): The number of rows written to LanceDB at once.
+
+    Returns:
+    dict: The restored document IDs, and the number of chunks and bytes read.
+
+    Raises:
+    InvalidSnapshot: If a file is not a valid snapshot. The documents already written are kept (and registered).
+    """
+    files = snapshot_paths(paths)
+    restored, pending = [], []
+    chunks = size = 0
+
+    def flush():
+        # The graphs are written once the rows are, so that a failed import doesn't leave a document's
+        # graph out of step with its chunks. The lexical index is rebuilt on its first use.
+        if pending:
+            doc_ids = [metadata["doc_id"] for metadata, *_ in pending]
+            replace_documents_nodes(doc_ids, [rows for _, rows, *_ in pending])
+        for metadata, _, graph, edges in pending:
+            save_graph(metadata["doc_id"], graph)
+            save_cross_edges(metadata["doc_id"], edges)
+            delete_lexical_index(metadata["doc_id"])
+            restored.append(metadata)
+        pending.clear()
+
+    # Step 1: Read the files in the thread pool, a bounded number of them ahead of the writes
+    workers = max(1, workers)
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="snapshot") as pool:
+            futures = deque()
+            files = iter(files)
+            while True:
+                for path in files:
+                    futures.append((path, pool.submit(_load_snapshot, path)))
+                    if len(futures) >= 2 * workers:
+                        break
+                if not futures:
+                    break
+                path, future = futures.popleft()
+                try:
+                    snapshot = future.result()
+                except Exception:
+                    for _, queued in futures:
+                        queued.cancel()
+                    raise
+
+                # Step 2: Write the rows of many documents at once (a document restored twice is written in order)
+                if any(metadata["doc_id"] == snapshot[0]["doc_id"] for metadata, *_ in pending):
+                    flush()
+                pending.append(snapshot)
+                if sum(rows.num_rows for _, rows, *_ in pending) >= batch_rows:
+                    flush()
+                chunks += snapshot[1].num_rows
+                size += os.path.getsize(path)
+            flush()
+    finally:
+        # Step 3: Register the documents written
+        _register(restored)
+    return {"document_ids": [metadata["doc_id"] for metadata in restored], "chunks": chunks, "bytes": size}
+
+
+def _register(restored: list):
+    """
+    Registers restored documents and their collections, with one write of the registry, and drops what was
+    cached for their previous version.
+    """
+    documents, collections = {}, {}
+    for metadata in restored:
+        doc_id = metadata["doc_id"]
+        if metadata.get("document"):
+            documents[doc_id] = metadata["document"]
+        for collection_id in metadata.get("collections") or []:
+            collections.setdefault(collection_id, []).append(doc_id)
+        document_vectors.invalidate(doc_id)
+        answer_cache.invalidate(doc_id)
+        fallback_cache.invalidate(doc_id)
+    if documents or collections:
+        document_registry.restore(documents, collections)
+    if restored:
+        schedule_index_maintenance(open_nodes_table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or restore snapshots of ingested documents.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="write the snapshots of stored documents to a directory")
+    export.add_argument("directory")
+    export.add_argument("--documents", nargs="+", help="the documents to export (default: all of them)")
+    restore = commands.add_parser("import", help="restore documents from snapshot files or directories")
+    restore.add_argument("paths", nargs="+")
+    for command in (export, restore):
+        command.add_argument("--workers", type=int, default=SNAPSHOT_WORKERS)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        if args.command == "export":
+            results = export_documents(args.directory, args.documents, workers=args.workers)
+            documents, chunks = len(results), sum(r["chunks"] for r in results)
+            size = sum(r["bytes"] for r in results)
+        else:
+            result = import_snapshots(args.paths, workers=args.workers)
+            documents, chunks, size = len(result["document_ids"]), result["chunks"], result["bytes"]
+    except (UnknownDocument, InvalidSnapshot) as e:
+        parser.exit(1, f"{e}\n")
+    elapsed = time.perf_counter() - start
+    print(
+        f"{args.command}: {documents} documents, {chunks} chunks, {size / 1024**2:.1f} MB in {elapsed:.2f}s "
+        f"({size / 1024**2 / max(elapsed, 1e-9):.1f} MB/s)"
+    )
+    # The indexes are updated in a background thread after an import, which would be stopped on exit
+    wait_for_index_maintenance()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+# Latency (in milliseconds) added to every stubbed API call, to emulate the network round-trip
+STUB_OPENAI_LATENCY_MS = float(os.getenv("STUB_OPENAI_LATENCY_MS", "0"))
+# Latency (in milliseconds) between two chunks of a streamed completion
+STUB_OPENAI_TOKEN_LATENCY_MS = float(os.getenv("STUB_OPENAI_TOKEN_LATENCY_MS", "0"))
+EMBEDDING_DIMENSIONS = 1536
+
+
+def stub_embedding(text: str, dimensions: int = EMBEDDING_DIMENSIONS):
+    """
+    Returns a deterministic, unit-norm pseudo embedding for a text.
+
+    The vector is seeded from the SHA-256 of the text, so the same text always maps to the same vector
+    and different texts are (almost) orthogonal, like real embeddings of unrelated content.
+    """
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions)
+    vector /= np.linalg.norm(vector)
+    return vector.tolist()
+
+
+def _embeddings_response(input, model, encoding_format="float"):
+    inputs = [input] if isinstance(input, str) else list(input)
+    data = []
+    for i, text in enumerate(inputs):
+        embedding = stub_embedding(text)
+        if encoding_format == "base64":
+            # Like the API: the little-endian float32 bytes, base64-encoded
+            embedding = base64.b64encode(np.asarray(embedding, dtype="<f4").tobytes()).decode("ascii")
+        data.append(SimpleNamespace(index=i, embedding=embedding))
+    # Token counts estimated from the words, the API reports the real ones
+    n_tokens = sum(len(text.split()) for text in inputs)
+    return SimpleNamespace(
+        model=model, data=data, usage=SimpleNamespace(prompt_tokens=n_tokens, total_tokens=n_tokens)
+    )
+
+
+def _usage(messages, completion: str):
+    prompt_tokens = sum(len(message["content"].split()) for message in messages)
+    completion_tokens = len(completion.split())
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens,
+    )
+
+
+def _stub_answer(messages):
+    # Answer with the beginning of the last message (the prompt with the context)
+    prompt = " ".join(messages[-1]["content"].split())
+    return f"Stub answer: {prompt[:200]}"
+
+
+def _chat_response(messages, model, tools=None, **kwargs):
+    content, tool_calls = _stub_answer(messages), None
+    usage = _usage(messages, content)
+    if tools:
+        # Answer through the first function, as if it was forced with tool_choice
+        arguments = json.dumps({"content": content, "relevant": True})
+        function = SimpleNamespace(name=tools[0]["function"]["name"], arguments=arguments)
+        content, tool_calls = None, [SimpleNamespace(id="call_stub", type="function", function=function)]
+    return SimpleNamespace(
+        model=model,
+        choices=[
+            SimpleNamespace(
+                index=0,
+                finish_reason="tool_calls" if tool_calls else "stop",
+                message=SimpleNamespace(role="assistant", content=content, tool_calls=tool_calls),
+            )
+        ],
+        usage=usage,
+    )
+
+
+def _chat_stream_chunks(messages, model, tools=None, stream_options=None, **kwargs):
+    """
+    Splits a stub answer into stream chunks of a few characters, like the streamed API does.
+    With stream_options={"include_usage": True}, a last chunk without choices carries the usage.
+    """
+    response = _chat_response(messages, model, tools=tools)
+    message = response.choices[0].message
+    text = message.tool_calls[0].function.arguments if tools else message.content
+    for start in range(0, len(text), 8):
+        piece = text[start : start + 8]
+        if tools:
+            function = SimpleNamespace(name=None, arguments=piece)
+            delta = SimpleNamespace(content=None, tool_calls=[SimpleNamespace(index=0, function=function)])
+        else:
+            delta = SimpleNamespace(content=piece, tool_calls=None)
+        yield SimpleNamespace(model=model, choices=[SimpleNamespace(index=0, delta=delta)], usage=None)
+    if (stream_options or {}).get("include_usage"):
+        yield SimpleNamespace(model=model, choices=[], usage=response.usage)
+
+
+class _StubStream:
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            if STUB_OPENAI_TOKEN_LATENCY_MS:
+                time.sleep(STUB_OPENAI_TOKEN_LATENCY_MS / 1000)
+            yield chunk
+
+    def close(self):
+        pass
+
+
+class _StubAsyncStream:
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    async def __aiter__(self):
+        for chunk in self._chunks:
+            if STUB_OPENAI_TOKEN_LATENCY_MS:
+                await asyncio.sleep(STUB_OPENAI_TOKEN_LATENCY_MS / 1000)
+            yield chunk
+
+    async def close(self):
+        pass
+
+
+class _StubEmbeddings:
+    def create(self, input, model, encoding_format="float", **kwargs):
+        if STUB_OPENAI_LATENCY_MS:
+            time.sleep(STUB_OPENAI_LATENCY_MS / 1000)
+        return _embeddings_response(input, model, encoding_format)
+
+
+class _StubChatCompletions:
+    def create(self, messages, model, stream=False, **kwargs):
+        if STUB_OPENAI_LATENCY_MS:
+            time.sleep(STUB_OPENAI_LATENCY_MS / 1000)
+        if stream:
+            return _StubStream(list(_chat_stream_chunks(messages, model, **kwargs)))
+        return _chat_response(messages, model, **kwargs)
+
+
+class _StubAsyncEmbeddings:
+    async def create(self, input, model, encoding_format="float", **kwargs):
+        if STUB_OPENAI_LATENCY_MS:
+            await asyncio.sleep(STUB_OPENAI_LATENCY_MS / 1000)
+        return _embeddings_response(input, model, encoding_format)
+
+
+class _StubAsyncChatCompletions:
+    async def create(self, messages, model, stream=False, **kwargs):
+        if STUB_OPENAI_LATENCY_MS:
+            await asyncio.sleep(STUB_OPENAI_LATENCY_MS / 1000)
+        if stream:
+            return _StubAsyncStream(list(_chat_stream_chunks(messages, model, **kwargs)))
+        return _chat_response(messages, model, **kwargs)
+
+
+class StubOpenAI:
+    """
+    Local stand-in for the OpenAI client, used to benchmark the pipeline offline.
+
+    Only the parts of the client used by this project are implemented, with the same call signatures
+    and response shapes, so it can be swapped in wherever an `OpenAI` client is expected.
+    """
+
+    def __init__(self, **kwargs):
+        self.embeddings = _StubEmbeddings()
+        self.chat = SimpleNamespace(completions=_StubChatCompletions())
+
+
+class StubAsyncOpenAI:
+    """
+    Local stand-in for the `AsyncOpenAI` client, see `StubOpenAI`.
+    """
+
+    def __init__(self, **kwargs):
+        self.embeddings = _StubAsyncEmbeddings()
+        self.chat = SimpleNamespace(completions=_StubAsyncChatCompletions())
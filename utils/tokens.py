@@ -0,0 +1,37 @@
+from functools import lru_cache
+
+import tiktoken
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception as e:
+        print(f"tiktoken encoding unavailable for {model}, estimating tokens from byte length: {e}")
+        return None
+
+
+def get_token_counter(model: str, upper_bound: bool = True):
+    """
+    Returns a function counting the tokens of a text for an OpenAI model.
+
+    tiktoken downloads its encoding on first use; when it is not available (e.g. offline), the count is
+    estimated from the UTF-8 byte length: the byte length itself if `upper_bound` (e.g. to stay below a
+    request limit), otherwise a quarter of it, about the average for English text.
+    """
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    if upper_bound:
+        return lambda text: len(text.encode("utf-8"))
+    return lambda text: (len(text.encode("utf-8")) + 3) // 4
+
+
+def estimate_chat_tokens(messages: list, model: str, max_tokens: int = 0) -> int:
+    """
+    Estimates the tokens that a chat completion request counts against the tokens-per-minute limit:
+    those of the messages, a few more per message for the chat format, and the requested max_tokens.
+    """
+    count_tokens = get_token_counter(model, upper_bound=False)
+    return sum(count_tokens(message["content"]) + 4 for message in messages) + max_tokens
@@ -0,0 +1,337 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# "false" turns spans, request traces and metric recording into no-ops
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() in ("1", "true", "yes")
+# Number of recent request traces kept for GET /admin/traces
+TRACE_HISTORY = int(os.getenv("TRACE_HISTORY", "100"))
+# Requests slower than this are printed as one JSON line with their spans (0 disables it)
+TRACE_LOG_SLOW_MS = float(os.getenv("TRACE_LOG_SLOW_MS", "0"))
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """
+    Prometheus-style histogram: cumulative bucket counts, sum and count per label set.
+    """
+
+    def __init__(self, name: str, help: str, labels: tuple, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                labels = _format_labels(self.labels, label_values)
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}')
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="+Inf"}} {count}')
+                lines.append(f"{self.name}_sum{{{labels}}} {total}")
+                lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+class Counter:
+    """
+    Prometheus-style counter per label set.
+    """
+
+    def __init__(self, name: str, help: str, labels: tuple):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1, *label_values):
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + value
+
+    def value(self, *label_values) -> float:
+        with self._lock:
+            return self._series.get(label_values, 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._series.items()):
+                lines.append(f"{self.name}{{{_format_labels(self.labels, label_values)}}} {value}")
+        return lines
+
+
+def _format_labels(names, values) -> str:
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Duration of the HTTP requests.", ("method", "route", "status")
+)
+STAGE_DURATION = Histogram("stage_duration_seconds", "Duration of the traced stages (spans).", ("stage",))
+STAGE_ERRORS = Counter("stage_errors_total", "Traced stages that raised an exception.", ("stage",))
+OPENAI_TOKENS = Counter("openai_tokens_total", "Tokens reported by the OpenAI API.", ("model", "kind"))
+
+METRICS = [REQUEST_DURATION, STAGE_DURATION, STAGE_ERRORS, OPENAI_TOKENS]
+
+# Functions called on each scrape, see `register_gauges`
+_gauge_collectors = []
+
+
+def register_gauges(collect):
+    """
+    Registers a function returning gauges read at scrape time (e.g. cache statistics), as a dict
+    {name: (help, [(labels dict, value), ...])}.
+    """
+    _gauge_collectors.append(collect)
+
+
+def render_metrics() -> str:
+    """
+    Returns all the metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for collect in _gauge_collectors:
+        for name, (help, samples) in collect().items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{{{_format_labels(labels.keys(), labels.values())}}} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def record_tokens(model: str, usage):
+    """
+    Counts the tokens of an OpenAI response from its `usage` (ignored if the response has none).
+    """
+    if not TRACING_ENABLED or usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = getattr(usage, kind, None)
+        if value:
+            OPENAI_TOKENS.inc(value, model, kind.replace("_tokens", ""))
+
+
+class Trace:
+    """
+    The spans of one request, in the order they finished.
+    """
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.route = None
+        self.status = None
+        self.start = time.perf_counter()
+        self.duration_ms = None
+        self.spans = []
+
+    def server_timing(self) -> str:
+        """
+        Returns the Server-Timing header value: the total duration of each stage, and the request's so far.
+        """
+        totals = {}
+        for span in self.spans:
+            totals[span["name"]] = totals.get(span["name"], 0.0) + span["duration_ms"]
+        totals["total"] = (time.perf_counter() - self.start) * 1000
+        return ", ".join(f"{name};dur={duration:.2f}" for name, duration in totals.items())
+
+    def to_dict(self) -> dict:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "duration_ms": self.duration_ms,
+            "spans": self.spans,
+        }
+
+
+class _NoopSpan:
+    """
+    What `span` returns when tracing is disabled: one shared instance doing nothing.
+    """
+
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+_recent_traces = deque(maxlen=TRACE_HISTORY)
+
+
+class _Span:
+    __slots__ = ("name", "attributes", "start", "_token")
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self._token = _current_span.set(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        parent = None
+        try:
+            _current_span.reset(self._token)
+            parent = _current_span.get()
+        except ValueError:
+            # Exited in another context than it was entered in (e.g. a generator closed elsewhere)
+            pass
+        STAGE_DURATION.observe(duration, self.name)
+        if exc_type is not None:
+            STAGE_ERRORS.inc(1, self.name)
+        trace = _current_trace.get()
+        if trace is not None:
+            record = {
+                "name": self.name,
+                "parent": parent,
+                "start_ms": round((self.start - trace.start) * 1000, 3),
+                "duration_ms": round(duration * 1000, 3),
+            }
+            if self.attributes:
+                record["attributes"] = self.attributes
+            if exc_type is not None:
+                record["error"] = exc_type.__name__
+            trace.spans.append(record)
+        return False
+
+
+def span(name: str, **attributes):
+    """
+    Times a stage of the current request, as a context manager:
+
+        with span("retrieve.search", mode=mode):
+            ...
+
+    The duration is recorded in the stage_duration_seconds histogram and, inside a request, added to its
+    trace and Server-Timing header. Spans nest: a span records the one it was opened in as its parent.
+    Attributes known later can be added with `.set(**attributes)` on the span.
+    When tracing is disabled, this returns a shared no-op span.
+    """
+    if not TRACING_ENABLED:
+        return _NOOP
+    return _Span(name, attributes)
+
+
+def traced(name: str):
+    """
+    Decorator running a function (sync or async) inside a span.
+    """
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def recent_traces(limit: int = None) -> list:
+    """
+    Returns the most recent request traces, newest first.
+    """
+    traces = list(_recent_traces)[::-1]
+    return [trace.to_dict() for trace in traces[:limit]]
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware tracing each HTTP request: the spans opened while handling it are collected in a
+    Trace, the response carries them in a Server-Timing header, and the request duration is recorded in
+    the http_request_duration_seconds histogram (labelled by route template, not raw path).
+
+    The header is sent with the response start, so spans of a streamed body (e.g. the tokens of
+    /answer/stream) are in the trace and the metrics but not in the header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not TRACING_ENABLED or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(scope["method"], scope["path"])
+        token = _current_trace.set(trace)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                trace.status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_trace.reset(token)
+            duration = time.perf_counter() - trace.start
+            trace.duration_ms = round(duration * 1000, 3)
+            route = scope.get("route")
+            trace.route = getattr(route, "path", None) or "unmatched"
+            REQUEST_DURATION.observe(duration, trace.method, trace.route, trace.status or 500)
+            _recent_traces.append(trace)
+            if TRACE_LOG_SLOW_MS and trace.duration_ms >= TRACE_LOG_SLOW_MS:
+                print(json.dumps({"slow_request": trace.to_dict()}, default=str))
@@ -0,0 +1,144 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Memory budget of the cached documents (vectors, texts and indices), in bytes
+HOT_VECTOR_CACHE_BYTES = int(os.getenv("HOT_VECTOR_CACHE_BYTES", str(512 * 1024**2)))
+
+
+class TextStore:
+    """
+    The texts of a document's chunks, stored as one UTF-8 buffer and an array of offsets instead of
+    one Python string per chunk. A text is only decoded when it is returned.
+    """
+
+    def __init__(self, texts):
+        encoded = [text.encode("utf-8") for text in texts]
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(data) for data in encoded], out=self.offsets[1:])
+        self.buffer = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row: int) -> str:
+        return self.buffer[self.offsets[row] : self.offsets[row + 1]].tobytes().decode("utf-8")
+
+    @property
+    def nbytes(self) -> int:
+        return self.buffer.nbytes + self.offsets.nbytes
+
+
+class DocumentVectors:
+    """
+    The non-empty chunks of one document held in memory: their chunk indices, unit-normalized float32
+    vectors (one row per chunk) and texts, so that a top-k search is one matrix-vector product.
+    """
+
+    def __init__(self, nodes, vectors, texts):
+        nodes = np.asarray(nodes, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        texts = [text.strip() for text in texts]
+        keep = np.array([bool(text) for text in texts], dtype=bool)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.nodes = nodes[keep]
+        self.vectors = np.ascontiguousarray(vectors[keep] / norms[keep])
+        self.texts = TextStore([text for text, kept in zip(texts, keep) if kept])
+        self._rows = {int(node): row for row, node in enumerate(self.nodes)}
+
+    @property
+    def nbytes(self) -> int:
+        return self.nodes.nbytes + self.vectors.nbytes + self.texts.nbytes
+
+    def top_k(self, query_embedding, k: int):
+        """
+        Returns the k chunks most similar to the query, best first.
+
+        Returns:
+        list: (chunk index, text, cosine similarity) tuples.
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = self.vectors @ query
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(self.nodes[row]), self.texts[row], float(scores[row])) for row in top]
+
+    def text(self, node: int):
+        """
+        Returns the text of a chunk, or None if it is empty or unknown.
+        """
+        row = self._rows.get(int(node))
+        return None if row is None else self.texts[row]
+
+
+class DocumentVectorCache:
+    """
+    LRU of the DocumentVectors of the recently used documents, bounded by their size in bytes.
+    Documents are added when they are ingested and when they are searched, the least recently used
+    ones are evicted once the total exceeds max_bytes. A document larger than max_bytes is not cached.
+    """
+
+    def __init__(self, max_bytes: int = HOT_VECTOR_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, doc_id: str):
+        with self._lock:
+            document = self._documents.get(doc_id)
+            if document is None:
+                self.misses += 1
+                return None
+            self._documents.move_to_end(doc_id)
+            self.hits += 1
+            return document
+
+    def put(self, doc_id: str, document: DocumentVectors):
+        """
+        Caches the vectors of a document, replacing its previous version.
+        """
+        with self._lock:
+            previous = self._documents.pop(doc_id, None)
+            if previous is not None:
+                self.bytes -= previous.nbytes
+            if document.nbytes > self.max_bytes:
+                return
+            self._documents[doc_id] = document
+            self.bytes += document.nbytes
+            while self.bytes > self.max_bytes:
+                _, evicted = self._documents.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def invalidate(self, doc_id: str):
+        with self._lock:
+            previous = self._documents.pop(doc_id, None)
+            if previous is not None:
+                self.bytes -= previous.nbytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "documents": len(self._documents),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+document_vectors = DocumentVectorCache()
@@ -0,0 +1,288 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+from utils.tracing import span, traced
+
+# "IVF_PQ" or "IVF_HNSW_SQ"
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "IVF_PQ")
+# Below this number of rows, the prefiltered brute-force search is fast enough and no index is built
+VECTOR_INDEX_MIN_ROWS = int(os.getenv("VECTOR_INDEX_MIN_ROWS", "5000"))
+# New rows are added to the index incrementally once there are this many unindexed rows
+VECTOR_INDEX_REINDEX_ROWS = int(os.getenv("VECTOR_INDEX_REINDEX_ROWS", "1000"))
+# The index is retrained from scratch when the table has grown by this factor since it was built
+VECTOR_INDEX_RETRAIN_GROWTH = float(os.getenv("VECTOR_INDEX_RETRAIN_GROWTH", "2"))
+# Search parameters: partitions probed, and re-ranking of nprobes * refine_factor candidates
+VECTOR_INDEX_NPROBES = int(os.getenv("VECTOR_INDEX_NPROBES", "20"))
+VECTOR_INDEX_REFINE_FACTOR = int(os.getenv("VECTOR_INDEX_REFINE_FACTOR", "5"))
+VECTOR_METRIC = "cosine"
+
+VECTOR_INDEX_NAME = "vector_idx"
+DOC_ID_INDEX_NAME = "doc_id_idx"
+
+_maintenance_lock = threading.Lock()
+_maintenance_state = {"running": False, "pending": False, "last_run": None, "last_duration_ms": None, "last_actions": [], "last_error": None}
+_search_latencies = deque(maxlen=int(os.getenv("VECTOR_SEARCH_LATENCY_WINDOW", "1000")))
+
+
+def _index_stats(dataset, name):
+    try:
+        return dataset.stats.index_stats(name)
+    except Exception:
+        return None
+
+
+def _list_indices(dataset):
+    try:
+        return {index["name"]: index for index in dataset.list_indices()}
+    except Exception:
+        return {}
+
+
+def ensure_doc_id_column(table):
+    """
+    Migrates tables created before `doc_id` was a top-level column, by materializing it from
+    payload.meta.doc_id. The top-level column is what the scalar index and the prefilter use.
+    """
+    if "doc_id" not in table.schema.names:
+        table.add_columns({"doc_id": "payload.meta.doc_id"})
+        print(f"Added the 'doc_id' column to table '{table.name}'.")
+
+
+def _vector_index_parameters(n_rows: int) -> dict:
+    # About sqrt(n) partitions, and PQ sub-vectors of 16 dimensions
+    parameters = {
+        "metric": VECTOR_METRIC,
+        "num_partitions": max(1, int(math.sqrt(n_rows))),
+        "index_type": VECTOR_INDEX_TYPE,
+        "replace": True,
+    }
+    if VECTOR_INDEX_TYPE == "IVF_PQ":
+        parameters["num_sub_vectors"] = 96
+    return parameters
+
+
+@traced("index.maintenance")
+def maintain_indexes(table) -> list:
+    """
+    Creates or updates the indexes of the nodes table as it grows:
+
+    - a BTREE scalar index on doc_id, used to prefilter searches to one document;
+    - a vector index once the table has VECTOR_INDEX_MIN_ROWS rows, extended incrementally with the
+      new rows and retrained when the table has grown by VECTOR_INDEX_RETRAIN_GROWTH since it was built.
+
+    Returns:
+    list: Descriptions of the actions taken.
+    """
+    actions = []
+    ensure_doc_id_column(table)
+    dataset = table.to_lance()
+    indices = _list_indices(dataset)
+    n_rows = table.count_rows()
+
+    # Step 1: Scalar index on doc_id
+    if DOC_ID_INDEX_NAME not in indices:
+        table.create_scalar_index("doc_id", index_type="BTREE")
+        actions.append("created the doc_id scalar index")
+
+    # Step 2: Vector index
+    if VECTOR_INDEX_NAME not in indices:
+        if n_rows >= VECTOR_INDEX_MIN_ROWS:
+            table.create_index(**_vector_index_parameters(n_rows))
+            actions.append(f"created the {VECTOR_INDEX_TYPE} vector index on {n_rows} rows")
+    else:
+        stats = _index_stats(dataset, VECTOR_INDEX_NAME) or {}
+        # The incremental updates don't retrain the partitions, which were sized for sqrt(rows) at training
+        partitions = (stats.get("indices") or [{}])[0].get("num_partitions", 0)
+        trained_rows = partitions**2
+        if trained_rows and n_rows >= VECTOR_INDEX_RETRAIN_GROWTH * trained_rows:
+            table.create_index(**_vector_index_parameters(n_rows))
+            actions.append(f"retrained the vector index on {n_rows} rows (was trained on {trained_rows})")
+        elif stats.get("num_unindexed_rows", 0) >= VECTOR_INDEX_REINDEX_ROWS:
+            dataset.optimize.optimize_indices(index_names=[VECTOR_INDEX_NAME])
+            actions.append(f"indexed {stats['num_unindexed_rows']} new rows incrementally")
+
+    # Step 3: New rows are not in the scalar index until it is optimized
+    doc_id_stats = _index_stats(table.to_lance(), DOC_ID_INDEX_NAME) or {}
+    if doc_id_stats.get("num_unindexed_rows", 0) >= VECTOR_INDEX_REINDEX_ROWS:
+        table.to_lance().optimize.optimize_indices(index_names=[DOC_ID_INDEX_NAME])
+        actions.append("updated the doc_id scalar index")
+    return actions
+
+
+def _run_maintenance(open_table):
+    while True:
+        start = time.perf_counter()
+        try:
+            actions = maintain_indexes(open_table())
+            _maintenance_state.update(last_actions=actions, last_error=None)
+            if actions:
+                print(f"Vector index maintenance: {', '.join(actions)}.")
+        except Exception as e:
+            _maintenance_state["last_error"] = str(e)
+            print(f"Error maintaining the vector indexes: {e}")
+        _maintenance_state.update(
+            last_run=datetime.now().isoformat(),
+            last_duration_ms=round((time.perf_counter() - start) * 1000, 2),
+        )
+        with _maintenance_lock:
+            # Rows were added while we were running, go again
+            if not _maintenance_state["pending"]:
+                _maintenance_state["running"] = False
+                return
+            _maintenance_state["pending"] = False
+
+
+def schedule_index_maintenance(open_table):
+    """
+    Runs `maintain_indexes` in a background thread, so that building an index doesn't delay uploads.
+    Calls made while it is running are coalesced into a single extra run.
+
+    Parameters:
+    open_table (callable): Returns the nodes table.
+    """
+    with _maintenance_lock:
+        if _maintenance_state["running"]:
+            _maintenance_state["pending"] = True
+            return
+        _maintenance_state["running"] = True
+    threading.Thread(
+        target=_run_maintenance, args=(open_table,), name="vector-index-maintenance", daemon=True
+    ).start()
+
+
+def wait_for_index_maintenance(timeout_s: float = None) -> bool:
+    """
+    Waits for the scheduled index maintenance to finish, e.g. before a command line tool exits, which would
+    stop the background thread.
+
+    Returns:
+    bool: False if it was still running after timeout_s.
+    """
+    deadline = None if timeout_s is None else time.monotonic() + timeout_s
+    while True:
+        with _maintenance_lock:
+            if not _maintenance_state["running"]:
+                return True
+        if deadline is not None and time.monotonic() > deadline:
+            return False
+        time.sleep(0.1)
+
+
+def vector_search(table, query_embedding, doc_id: str, limit: int, columns=None):
+    """
+    Searches the rows of one document closest to the query embedding.
+
+    The doc_id filter is applied before the vector search (prefilter, served by the scalar index), and
+    the vector index is used when there is one. The search latency is recorded for `index_status`.
+    """
+    start = time.perf_counter()
+    query = (
+        table.search(query_embedding)
+        .metric(VECTOR_METRIC)
+        .where(f"doc_id = '{doc_id}'", prefilter=True)
+        .nprobes(VECTOR_INDEX_NPROBES)
+        .refine_factor(VECTOR_INDEX_REFINE_FACTOR)
+        .limit(limit)
+    )
+    if columns:
+        query = query.select(columns)
+    with span("lancedb.search", limit=limit):
+        results = query.to_list()
+    _search_latencies.append(time.perf_counter() - start)
+    return results
+
+
+def _latency_stats() -> dict:
+    if not _search_latencies:
+        return {"count": 0}
+    latencies = np.array(_search_latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "count": len(latencies),
+        "mean_ms": round(float(latencies.mean()), 2),
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+    }
+
+
+def index_status(table) -> dict:
+    """
+    Returns the state of the indexes of the nodes table, the maintenance state and the latency of
+    the recent searches.
+    """
+    dataset = table.to_lance()
+    indices = []
+    for name, index in _list_indices(dataset).items():
+        stats = _index_stats(dataset, name) or {}
+        indices.append(
+            {
+                "name": name,
+                "type": index.get("type"),
+                "fields": index.get("fields"),
+                "indexed_rows": stats.get("num_indexed_rows"),
+                "unindexed_rows": stats.get("num_unindexed_rows"),
+                "deltas": stats.get("num_indices"),
+                "partitions": (stats.get("indices") or [{}])[0].get("num_partitions"),
+            }
+        )
+    return {
+        "table": table.name,
+        "rows": table.count_rows(),
+        "version": table.version,
+        "indices": indices,
+        "search": {
+            "metric": VECTOR_METRIC,
+            "nprobes": VECTOR_INDEX_NPROBES,
+            "refine_factor": VECTOR_INDEX_REFINE_FACTOR,
+            "latency": _latency_stats(),
+        },
+        "maintenance": dict(_maintenance_state),
+    }
+
+
+def estimate_recall(table, samples: int = 20, k: int = 10, seed: int = None) -> dict:
+    """
+    Estimates the recall@k of the indexed search, by comparing it with an exact search on the same
+    document for queries taken from random rows of the table.
+    """
+    dataset = table.to_lance()
+    n_rows = dataset.count_rows()
+    if n_rows == 0:
+        return {"samples": 0, "k": k, "recall": None}
+    rng = np.random.default_rng(seed)
+    rows = dataset.take(
+        sorted(rng.choice(n_rows, size=min(samples, n_rows), replace=False).tolist()),
+        columns=["vector", "doc_id"],
+    ).to_pylist()
+
+    recalls, indexed_ms, exact_ms = [], [], []
+    for row in rows:
+        query = np.asarray(row["vector"], dtype=np.float32)
+        start = time.perf_counter()
+        approximate = vector_search(table, query, row["doc_id"], k, columns=["id"])
+        indexed_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        exact = dataset.to_table(
+            columns=["id"],
+            nearest={"column": "vector", "q": query, "k": k, "metric": VECTOR_METRIC, "use_index": False},
+            filter=f"doc_id = '{row['doc_id']}'",
+            prefilter=True,
+        )["id"].to_pylist()
+        exact_ms.append((time.perf_counter() - start) * 1000)
+        if exact:
+            recalls.append(len({r["id"] for r in approximate} & set(exact)) / len(exact))
+
+    return {
+        "samples": len(recalls),
+        "k": k,
+        "recall": round(float(np.mean(recalls)), 4) if recalls else None,
+        "indexed_search_ms": round(float(np.mean(indexed_ms)), 2),
+        "exact_search_ms": round(float(np.mean(exact_ms)), 2),
+    }
@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+import pyarrow as pa
+
+EMBEDDING_DIMENSIONS = 1536
+
+# Storage type of the persisted embeddings: "float32", "float16" (half the size) or "int8" (a quarter,
+# quantized with one scale per vector). Vectors are always float32 in memory.
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "float32")
+STORAGE_DTYPES = {"float32": pa.float32(), "float16": pa.float16(), "int8": pa.int8()}
+if EMBEDDING_STORAGE_DTYPE not in STORAGE_DTYPES:
+    raise ValueError(
+        f"EMBEDDING_STORAGE_DTYPE must be one of {', '.join(STORAGE_DTYPES)}, got '{EMBEDDING_STORAGE_DTYPE}'"
+    )
+
+# LanceDB can only search float vectors: int8 storage keeps the searchable vectors in float16
+SEARCHABLE_STORAGE_DTYPE = "float16" if EMBEDDING_STORAGE_DTYPE == "int8" else EMBEDDING_STORAGE_DTYPE
+
+
+def quantize_int8(matrix):
+    """
+    Quantizes float vectors to int8 with a symmetric scale per vector (its largest absolute value / 127).
+
+    Returns:
+    tuple: The int8 codes, same shape as `matrix`, and the float32 scales, one per row.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scales = np.abs(matrix).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    codes = np.rint(matrix / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def dequantize_int8(codes, scales):
+    return codes.astype(np.float32) * np.asarray(scales, dtype=np.float32)[:, None]
+
+
+def vectors_to_arrow(matrix, dtype: str = EMBEDDING_STORAGE_DTYPE):
+    """
+    Converts a matrix of vectors (one per row) to a fixed-size list column of the storage type.
+
+    Returns:
+    tuple: The vector column, and the scale column for int8 storage (None otherwise).
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    scales = None
+    if dtype == "int8":
+        matrix, scales = quantize_int8(matrix)
+        scales = pa.array(scales, pa.float32())
+    elif dtype == "float16":
+        matrix = matrix.astype(np.float16)
+    values = pa.array(matrix.reshape(-1), STORAGE_DTYPES[dtype])
+    return pa.FixedSizeListArray.from_arrays(values, matrix.shape[1]), scales
+
+
+def vectors_from_arrow(column, scales=None):
+    """
+    Converts a fixed-size list column of vectors back to a float32 matrix, one row per vector.
+    """
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    values = column.flatten().to_numpy(zero_copy_only=False)
+    matrix = values.reshape(len(column), column.type.list_size)
+    if scales is not None:
+        if isinstance(scales, (pa.Array, pa.ChunkedArray)):
+            scales = scales.to_numpy()
+        return dequantize_int8(matrix, scales)
+    return matrix.astype(np.float32, copy=False)
+
+
+def storage_dtype_of(vector_type: pa.DataType) -> str:
+    """
+    Returns the storage type name of an existing vector column, e.g. of a table created in another mode.
+    """
+    return next(name for name, value_type in STORAGE_DTYPES.items() if value_type == vector_type.value_type)